@@ -0,0 +1,212 @@
+"""
+Per-rank speed calibration.
+
+Heterogeneous splits need each rank's relative speed, which on a real mixed fleet
+(different GPU models, throttled or shared cards) can't be read from the
+environment. `calibrate_speeds` runs a short micro-benchmark on every rank of a
+group: the ring's block attention (the Triton kernel on GPU) over one
+representative block, and the GEMMs of one decoder layer over the same tokens.
+It all-gathers the measured throughputs, so every rank gets the same
+`SpeedProfile`. Each rank's measurement is cached on disk keyed by its host,
+device, driver and the benchmark shapes, so the benchmark runs once per device
+rather than once per job.
+"""
+
+import dataclasses
+import hashlib
+import json
+import math
+import os
+import socket
+import time
+from typing import Dict, List, Optional
+
+import torch
+import torch.distributed as dist
+
+
+_CACHE_ENV = "FMS_CALIBRATION_CACHE"
+
+
+@dataclasses.dataclass
+class CalibrationShapes:
+    """Shapes of the micro-benchmark, those of one layer of the model to run."""
+
+    block_len: int = 2048
+    nheads: int = 32
+    kvheads: int = 8
+    head_dim: int = 128
+    emb_dim: int = 4096
+    hidden_dim: int = 14336
+    dtype: str = "bfloat16"
+
+
+@dataclasses.dataclass
+class SpeedProfile:
+    """
+    Measured throughputs of the ranks of a group, in group rank order.
+
+    attention: query-key pairs per second of the block attention for one layer,
+        the unit of `fms.distributed.planner.CostModel.speeds`
+    gemm: FLOP/s of the layer's projections
+    layer: tokens per second of one layer (attention over a block plus GEMMs)
+    """
+
+    attention: List[float]
+    gemm: List[float]
+    layer: List[float]
+
+    @property
+    def world_size(self) -> int:
+        return len(self.layer)
+
+    def weights(self, ring_order: Optional[List[int]] = None) -> List[float]:
+        """Relative speeds summing to 1, per ring position of `ring_order`."""
+        order = list(range(self.world_size)) if ring_order is None else ring_order
+        total = sum(self.layer)
+        return [self.layer[r] / total for r in order]
+
+
+def default_cache_dir() -> str:
+    """`$FMS_CALIBRATION_CACHE`, or `~/.cache/fms/calibration`."""
+    return os.environ.get(
+        _CACHE_ENV, os.path.join(os.path.expanduser("~"), ".cache", "fms", "calibration")
+    )
+
+
+def calibrate_speeds(
+    group: Optional[dist.ProcessGroup] = None,
+    shapes: Optional[CalibrationShapes] = None,
+    iters: int = 5,
+    warmup: int = 2,
+    cache_dir: Optional[str] = None,
+    refresh: bool = False,
+) -> SpeedProfile:
+    """
+    Measure (or load from the cache) the speed of every rank in `group`.
+    Collective: every rank of the group must call it. With `refresh`, the cache is
+    ignored and overwritten.
+    """
+    shapes = CalibrationShapes() if shapes is None else shapes
+    device = _calibration_device(group)
+    cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+    path = os.path.join(cache_dir, f"{_cache_key(device, shapes)}.json")
+
+    local = None
+    if not refresh and os.path.exists(path):
+        with open(path, "r") as f:
+            local = json.load(f)
+    if local is None:
+        local = measure_speed(device, shapes, iters, warmup)
+        os.makedirs(cache_dir, exist_ok=True)
+        # ranks sharing a device (or the CPU) share the file
+        tmp_path = f"{path}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(local, f, indent=2)
+        os.replace(tmp_path, path)
+
+    measured: List[Optional[Dict[str, float]]] = [None] * dist.get_world_size(group)
+    dist.all_gather_object(measured, local, group=group)
+    return SpeedProfile(
+        attention=[m["attention"] for m in measured],
+        gemm=[m["gemm"] for m in measured],
+        layer=[m["layer"] for m in measured],
+    )
+
+
+def measure_speed(
+    device: torch.device, shapes: CalibrationShapes, iters: int = 5, warmup: int = 2
+) -> Dict[str, float]:
+    """Throughputs of this device, see `SpeedProfile`."""
+    # the ring implementation imports the strategy, which calibrates
+    from fms.distributed.ring_attention import _block_softmax_stats
+
+    dtype = getattr(torch, shapes.dtype)
+    if device.type == "cpu" and dtype != torch.float32:
+        # half precision matmuls on CPU aren't representative of anything
+        dtype = torch.float32
+    tokens, head_dim = shapes.block_len, shapes.head_dim
+    generator = torch.Generator(device=device).manual_seed(0)
+
+    def randn(*shape, dtype=dtype):
+        return torch.randn(*shape, generator=generator, device=device, dtype=dtype)
+
+    # the ring attends in fp32 accumulators to K/V in the model dtype
+    q = randn(1, shapes.nheads, tokens, head_dim, dtype=torch.float32)
+    k = randn(1, shapes.kvheads, tokens, head_dim)
+    v = randn(1, shapes.kvheads, tokens, head_dim)
+    indices = torch.arange(tokens, device=device)
+    scale = math.sqrt(head_dim)
+
+    def attention():
+        _block_softmax_stats(q, k.float(), v.float(), indices, indices, scale, None, False)
+
+    qkv_dim = (shapes.nheads + 2 * shapes.kvheads) * head_dim
+    x = randn(tokens, shapes.emb_dim)
+    w_qkv = randn(shapes.emb_dim, qkv_dim)
+    w_o = randn(shapes.nheads * head_dim, shapes.emb_dim)
+    w_up = randn(shapes.emb_dim, 2 * shapes.hidden_dim)
+    w_down = randn(shapes.hidden_dim, shapes.emb_dim)
+    attn_out = randn(tokens, shapes.nheads * head_dim)
+    hidden = randn(tokens, shapes.hidden_dim)
+
+    def gemm():
+        x @ w_qkv
+        attn_out @ w_o
+        x @ w_up
+        hidden @ w_down
+
+    gemm_flops = 2 * tokens * (
+        shapes.emb_dim * qkv_dim
+        + shapes.nheads * head_dim * shapes.emb_dim
+        + 3 * shapes.emb_dim * shapes.hidden_dim
+    )
+    attention_time = _time(attention, iters, warmup, device)
+    gemm_time = _time(gemm, iters, warmup, device)
+    return {
+        "attention": tokens * tokens / attention_time,
+        "gemm": gemm_flops / gemm_time,
+        "layer": tokens / (attention_time + gemm_time),
+    }
+
+
+def _time(fn, iters: int, warmup: int, device: torch.device) -> float:
+    """Seconds per call of `fn`."""
+    for _ in range(warmup):
+        fn()
+    _synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    _synchronize(device)
+    return max((time.perf_counter() - start) / iters, 1e-9)
+
+
+def _calibration_device(group) -> torch.device:
+    if dist.get_backend(group) == "nccl":
+        return torch.device("cuda", torch.cuda.current_device())
+    return torch.device("cpu")
+
+
+def _cache_key(device: torch.device, shapes: CalibrationShapes) -> str:
+    """Hash of this rank's host, device, driver, MPS share and the benchmark shapes."""
+    if device.type == "cuda":
+        driver = getattr(torch._C, "_cuda_getDriverVersion", lambda: None)()
+        local = [
+            socket.gethostname(),
+            device.index,
+            torch.cuda.get_device_name(device),
+            driver,
+            torch.version.cuda,
+        ]
+    else:
+        local = [socket.gethostname(), "cpu", torch.get_num_threads()]
+    # MPS-throttled ranks are slower than their device
+    local.append(os.environ.get("CUDA_MPS_ACTIVE_THREAD_PERCENTAGE"))
+    local += [torch.__version__, dataclasses.asdict(shapes)]
+    return hashlib.sha1(json.dumps(local).encode()).hexdigest()[:16]
+
+
+def _synchronize(device: torch.device) -> None:
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
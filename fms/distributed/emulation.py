@@ -0,0 +1,215 @@
+"""
+Emulated heterogeneity for CPU (gloo) runs.
+
+The hetero experiments throttle GPUs with CUDA MPS, which needs the MPS daemon
+and a GPU per rank. A `HeteroEmulator` instead slows one rank of a CPU run to a
+fraction `speed` of its real speed, so partitioners and stragglers can be tested
+in CI and on laptops with reproducible heterogeneity. Given to a
+`RingAttentionStrategy` (`emulator=`), it learns the rank's compute spans: from
+the start of a forward pass to each wait on communication, between waits, and
+from the last wait to the end of the pass. Before every wait it stretches the
+span that just ended to what it would take at `speed`:
+
+- "sleep": duty-cycling, the rank idles for the extra time
+- "spin": injected compute, the rank runs matmuls for the extra time (it keeps
+  its cores busy, as a contended device would)
+- "threads": no extra time, the rank runs with `speed` of its intra-op threads
+
+`speed` is a constant, a list of `(seconds, speed)` steps from when the
+emulator was created, or a function of those seconds. Sends over the ring can be
+shaped to a link of `bandwidth` bytes/s and `latency` seconds: they are issued
+in order from a background thread once the link would have carried the previous
+ones, so the transfer still overlaps with compute.
+
+Spans are wall time of eager CPU ops, which are synchronous; on GPU they would
+measure kernel launches, so the emulator is for CPU runs.
+"""
+
+import contextlib
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+import torch
+from torch.distributed import P2POp
+
+
+_MODES = ("sleep", "spin", "threads")
+
+Speed = Union[float, Sequence[Tuple[float, float]], Callable[[float], float]]
+
+
+class _DelayedSend:
+    """Work handle of a send the link thread issues later."""
+
+    def __init__(self, future: Future):
+        self.future = future
+
+    def wait(self, timeout=None) -> bool:
+        self.future.result().wait()
+        return True
+
+    def is_completed(self) -> bool:
+        return self.future.done() and self.future.result().is_completed()
+
+
+class HeteroEmulator:
+    """
+    speed: fraction of its real speed the rank runs at, like an MPS percentage
+        / 100 (see the module docstring for time-varying speeds)
+    mode: "sleep", "spin" or "threads"
+    bandwidth: bytes/s of the rank's outgoing link, None for unshaped sends
+    latency: seconds every send takes on top of its bytes
+    """
+
+    def __init__(
+        self,
+        speed: Speed = 1.0,
+        mode: str = "sleep",
+        bandwidth: Optional[float] = None,
+        latency: float = 0.0,
+    ):
+        if mode not in _MODES:
+            raise ValueError(f"unknown emulation mode {mode!r}, expected one of {_MODES}")
+        if not callable(speed) and not isinstance(speed, (int, float)):
+            speed = sorted((float(t), float(s)) for t, s in speed)
+        self.speed = speed
+        self.mode = mode
+        self.bandwidth = bandwidth
+        self.latency = latency
+        # seconds of real compute, and of compute added by the emulation
+        self.compute_s = 0.0
+        self.injected_s = 0.0
+        self._created = time.perf_counter()
+        self._span_start: Optional[float] = None
+        self._base_threads = torch.get_num_threads()
+        # the thread count to restore at the end of a forward pass in "threads" mode
+        self._saved_threads: Optional[int] = None
+        self._link: Optional[ThreadPoolExecutor] = None
+        self._spin_operand: Optional[torch.Tensor] = None
+        self.current_speed()
+
+    @classmethod
+    def from_env(cls, rank: int) -> Optional["HeteroEmulator"]:
+        """
+        The emulator of `rank` from FMS_EMULATE_SPEEDS (comma-separated speeds of
+        every rank), FMS_EMULATE_MODE, FMS_EMULATE_BANDWIDTH and
+        FMS_EMULATE_LATENCY, or None if FMS_EMULATE_SPEEDS isn't set.
+        """
+        speeds = os.environ.get("FMS_EMULATE_SPEEDS")
+        if not speeds:
+            return None
+        bandwidth = os.environ.get("FMS_EMULATE_BANDWIDTH")
+        return cls(
+            speed=float(speeds.split(",")[rank]),
+            mode=os.environ.get("FMS_EMULATE_MODE", "sleep"),
+            bandwidth=float(bandwidth) if bandwidth else None,
+            latency=float(os.environ.get("FMS_EMULATE_LATENCY", 0.0)),
+        )
+
+    def current_speed(self) -> float:
+        elapsed = time.perf_counter() - self._created
+        if callable(self.speed):
+            speed = float(self.speed(elapsed))
+        elif isinstance(self.speed, (int, float)):
+            speed = float(self.speed)
+        else:
+            # the last step started, or the first one before it starts
+            speed = self.speed[0][1]
+            for start, step_speed in self.speed:
+                if start <= elapsed:
+                    speed = step_speed
+        if not 0 < speed <= 1:
+            raise ValueError(f"emulated speed must be in (0, 1], got {speed}")
+        return speed
+
+    @property
+    def active(self) -> bool:
+        return self._span_start is not None
+
+    def start(self) -> None:
+        """Start of a forward pass: the first compute span begins."""
+        if self.mode == "threads":
+            self._saved_threads = torch.get_num_threads()
+            torch.set_num_threads(max(1, round(self._base_threads * self.current_speed())))
+        self._span_start = time.perf_counter()
+
+    def throttle(self) -> None:
+        """End the current compute span, stretched to its duration at `speed`."""
+        if self._span_start is None:
+            return
+        span = time.perf_counter() - self._span_start
+        self._span_start = None
+        self.compute_s += span
+        if self.mode == "threads":
+            return
+        extra = span * (1 / self.current_speed() - 1)
+        if extra <= 0:
+            return
+        if self.mode == "sleep":
+            time.sleep(extra)
+        else:
+            self._spin(extra)
+        self.injected_s += extra
+
+    def resume(self) -> None:
+        """A wait has ended: the next compute span begins."""
+        self._span_start = time.perf_counter()
+
+    def stop(self) -> None:
+        """End of a forward pass."""
+        self.throttle()
+        if self._saved_threads is not None:
+            torch.set_num_threads(self._saved_threads)
+            self._saved_threads = None
+
+    @contextlib.contextmanager
+    def waiting(self):
+        """Around a wait on communication within a forward pass."""
+        active = self.active
+        self.throttle()
+        try:
+            yield
+        finally:
+            if active:
+                self.resume()
+
+    def _spin(self, seconds: float) -> None:
+        if self._spin_operand is None:
+            self._spin_operand = torch.randn(128, 128)
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            self._spin_operand @ self._spin_operand
+
+    @property
+    def shapes_links(self) -> bool:
+        return self.bandwidth is not None or self.latency > 0
+
+    def transfer_time(self, nbytes: int) -> float:
+        """Seconds the emulated link takes to carry `nbytes`."""
+        if self.bandwidth is None:
+            return self.latency
+        return self.latency + nbytes / self.bandwidth
+
+    def issue(self, ops: List[P2POp]) -> List:
+        """
+        Issue P2P `ops`: receives right away, sends from the link thread, each
+        after the transfer time of the sends before it and its own.
+        """
+        if self._link is None:
+            # one thread, so sends leave in order, as over a single link
+            self._link = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fms-emulated-link")
+        works = []
+        for op in ops:
+            if op.op is not torch.distributed.isend:
+                works.append(op.op(op.tensor, op.peer, op.group))
+                continue
+            delay = self.transfer_time(op.tensor.numel() * op.tensor.element_size())
+
+            def send(op=op, delay=delay):
+                time.sleep(delay)
+                return op.op(op.tensor, op.peer, op.group)
+
+            works.append(_DelayedSend(self._link.submit(send)))
+        return works
@@ -0,0 +1,113 @@
+"""
+Compressed wire format for ring KV hops.
+
+At long context the K/V blocks passed around the ring dominate its time on PCIe
+links. With `RingAttentionStrategy.kv_compression` set, every block is quantized
+before it is sent, with one scale per (batch, head) of the block, and dequantized
+to its original dtype as soon as it has arrived. The scales travel in the same
+message as the payload: a flat uint8 tensor holding the fp32 scales followed by
+the int8 or fp8 (e4m3) values, so a hop is still one send and one receive per
+tensor. This roughly halves the traffic of a bf16 model (quarters it for fp32)
+at the cost of a small, bounded error in the attention output (see
+`compression_error`).
+"""
+
+import dataclasses
+import math
+from typing import Optional, Tuple
+
+import torch
+from torch import Tensor
+
+
+# compression name -> payload dtype
+WIRE_DTYPES = {
+    "int8": torch.int8,
+    "fp8": torch.float8_e4m3fn,
+}
+
+
+def _qmax(compression: str) -> float:
+    if compression == "int8":
+        return 127.0
+    return torch.finfo(WIRE_DTYPES[compression]).max
+
+
+def check_compression(compression: Optional[str]) -> None:
+    if compression is not None and compression not in WIRE_DTYPES:
+        raise ValueError(
+            f"unknown kv_compression {compression!r}, expected one of {list(WIRE_DTYPES)}"
+        )
+
+
+def message_bytes(shape: Tuple[int, ...], compression: str) -> int:
+    """Size of the message a b x h x len x d block is sent as."""
+    return 4 * shape[0] * shape[1] + math.prod(shape) * WIRE_DTYPES[compression].itemsize
+
+
+def wire_bytes(x: Tensor, compression: Optional[str]) -> int:
+    """Bytes that sending `x` puts on the link."""
+    if compression is None:
+        return x.numel() * x.element_size()
+    return message_bytes(tuple(x.shape), compression)
+
+
+def quantize_kv(x: Tensor, compression: str) -> Tensor:
+    """Quantize a b x h x len x d block into a flat uint8 message."""
+    qmax = _qmax(compression)
+    amax = x.abs().amax(dim=(2, 3), keepdim=True).float()
+    # all-zero heads (e.g. padding) keep a finite scale
+    scale = (amax / qmax).clamp(min=1e-12)
+    scaled = x.float() / scale
+    if compression == "int8":
+        payload = scaled.round().clamp(-qmax, qmax).to(torch.int8)
+    else:
+        payload = scaled.clamp(-qmax, qmax).to(WIRE_DTYPES[compression])
+    # scales first: they need 4-byte alignment to be viewed as fp32 on receipt
+    return torch.cat(
+        [scale.flatten().view(torch.uint8), payload.flatten().view(torch.uint8)]
+    )
+
+
+def dequantize_kv(
+    message: Tensor, shape: Tuple[int, ...], compression: str, dtype: torch.dtype
+) -> Tensor:
+    """Inverse of `quantize_kv` for a block of `shape`, returned as `dtype`."""
+    num_scales = shape[0] * shape[1]
+    scale = message[: 4 * num_scales].view(torch.float32).view(shape[0], shape[1], 1, 1)
+    payload = message[4 * num_scales :].view(WIRE_DTYPES[compression]).view(shape)
+    return (payload.float() * scale).to(dtype)
+
+
+@dataclasses.dataclass
+class CompressedKV:
+    """
+    Receive side of a compressed hop: the message buffer and what it decodes to.
+    `RingAttentionStrategy.ring_shift_kv_wait` dequantizes it once the transfer
+    has completed.
+    """
+
+    message: Tensor
+    shape: Tuple[int, ...]
+    compression: str
+    dtype: torch.dtype
+
+    @classmethod
+    def empty_like(cls, x: Tensor, compression: str) -> "CompressedKV":
+        message = torch.empty(
+            message_bytes(tuple(x.shape), compression), dtype=torch.uint8, device=x.device
+        )
+        return cls(message, tuple(x.shape), compression, x.dtype)
+
+    def dequantize(self) -> Tensor:
+        return dequantize_kv(self.message, self.shape, self.compression, self.dtype)
+
+
+def compression_error(x: Tensor, compression: str) -> float:
+    """
+    Relative L2 error of sending `x` compressed, e.g. to check a model's K/V
+    before enabling compression for it.
+    """
+    restored = dequantize_kv(quantize_kv(x, compression), tuple(x.shape), compression, torch.float32)
+    reference = x.float()
+    return ((restored - reference).norm() / reference.norm().clamp(min=1e-12)).item()
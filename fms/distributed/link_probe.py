@@ -0,0 +1,193 @@
+"""
+Pairwise link bandwidth / latency probe.
+
+`probe_links` times point-to-point transfers between every ordered pair of ranks in
+a group, over NCCL (CUDA tensors) or gloo (CPU tensors), for a set of message
+sizes. Results are cached on disk keyed by the hosts and devices of the group, so
+the probe runs once per node and device set rather than once per job. The cache
+file is a superset of the topology files read by
+`fms.distributed.topology.load_topology`.
+"""
+
+import dataclasses
+import hashlib
+import json
+import os
+import socket
+import time
+from typing import List, Optional, Sequence
+
+import torch
+import torch.distributed as dist
+
+from fms.distributed.topology import optimize_ring_order
+
+
+_DEFAULT_MESSAGE_SIZES = (1 << 10, 1 << 20, 1 << 24)
+_CACHE_ENV = "FMS_LINK_CACHE"
+
+
+@dataclasses.dataclass
+class LinkProfile:
+    """
+    Measured links between the ranks of a group.
+
+    message_sizes: bytes of each probed message
+    times: times[s][i][j] one-way transfer time in seconds of message_sizes[s] from
+        rank i to rank j
+    latency: latency[i][j] in microseconds, half a round trip of the smallest message
+    bandwidth: bandwidth[i][j] in GB/s, from the largest message
+    """
+
+    message_sizes: List[int]
+    times: List[List[List[float]]]
+    latency: List[List[float]]
+    bandwidth: List[List[float]]
+
+    @property
+    def world_size(self) -> int:
+        return len(self.bandwidth)
+
+    def transfer_time(self, src: int, dst: int, nbytes: int) -> float:
+        """Estimated seconds to send `nbytes` from `src` to `dst` (latency + size / bandwidth)."""
+        if src == dst:
+            return 0.0
+        return self.latency[src][dst] * 1e-6 + nbytes / (self.bandwidth[src][dst] * 1e9)
+
+    def ring_order(self, message_bytes: Optional[int] = None) -> List[int]:
+        """Ring order with the fastest slowest hop, see `optimize_ring_order`."""
+        return optimize_ring_order(self.bandwidth, self.latency, message_bytes)
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(dataclasses.asdict(self), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "LinkProfile":
+        with open(path, "r") as f:
+            return cls(**json.load(f))
+
+
+def default_cache_dir() -> str:
+    """`$FMS_LINK_CACHE`, or `~/.cache/fms/links`."""
+    return os.environ.get(
+        _CACHE_ENV, os.path.join(os.path.expanduser("~"), ".cache", "fms", "links")
+    )
+
+
+def probe_links(
+    group: Optional[dist.ProcessGroup] = None,
+    message_sizes: Sequence[int] = _DEFAULT_MESSAGE_SIZES,
+    iters: int = 5,
+    warmup: int = 2,
+    cache_dir: Optional[str] = None,
+    refresh: bool = False,
+) -> LinkProfile:
+    """
+    Measure (or load from the cache) the links between all pairs of ranks in
+    `group`. Collective: every rank of the group must call it, and every rank gets
+    the same profile.
+
+    Pairs are timed one at a time with the other ranks idle, as a message followed
+    by a one-byte acknowledgement, so the timings don't contend for shared links.
+    With `refresh`, the cache is ignored and overwritten.
+    """
+    message_sizes = sorted(int(s) for s in message_sizes)
+    rank = dist.get_rank(group)
+    world_size = dist.get_world_size(group)
+    device = _probe_device(group)
+
+    cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+    path = os.path.join(cache_dir, f"{_cache_key(group, device)}.json")
+
+    # rank 0 reads the cache and shares it, so all ranks agree on whether to probe
+    cached = [None]
+    if rank == 0 and not refresh and os.path.exists(path):
+        profile = LinkProfile.load(path)
+        if profile.message_sizes == message_sizes and profile.world_size == world_size:
+            cached[0] = dataclasses.asdict(profile)
+    dist.broadcast_object_list(cached, src=_global_rank(group, 0), group=group)
+    if cached[0] is not None:
+        return LinkProfile(**cached[0])
+
+    ack_time = _time_pairs(1, iters, warmup, group, device)
+    times = []
+    for nbytes in message_sizes:
+        round_trip = _time_pairs(nbytes, iters, warmup, group, device)
+        times.append((round_trip - ack_time / 2).clamp(min=0).tolist())
+
+    latency = (ack_time / 2 * 1e6).tolist()
+    largest = message_sizes[-1]
+    send_time = torch.tensor(times[-1], dtype=torch.float64) - ack_time / 2
+    bandwidth = (largest / send_time.clamp(min=1e-9) / 1e9).tolist()
+    for i in range(world_size):
+        latency[i][i] = 0.0
+        bandwidth[i][i] = 0.0
+
+    profile = LinkProfile(message_sizes, times, latency, bandwidth)
+    if rank == 0:
+        os.makedirs(cache_dir, exist_ok=True)
+        profile.save(path)
+    return profile
+
+
+def _time_pairs(nbytes, iters, warmup, group, device) -> torch.Tensor:
+    """[world_size, world_size] seconds per (message + ack) round trip, from the sender."""
+    rank = dist.get_rank(group)
+    world_size = dist.get_world_size(group)
+    payload = torch.zeros(nbytes, dtype=torch.uint8, device=device)
+    ack = torch.zeros(1, dtype=torch.uint8, device=device)
+    timings = torch.zeros(world_size, world_size, dtype=torch.float64, device=device)
+
+    for src in range(world_size):
+        for dst in range(world_size):
+            if src == dst:
+                continue
+            dist.barrier(group=group)
+            if rank == src:
+                peer = _global_rank(group, dst)
+                for i in range(warmup + iters):
+                    if i == warmup:
+                        _synchronize(device)
+                        start = time.perf_counter()
+                    dist.send(payload, peer, group=group)
+                    dist.recv(ack, peer, group=group)
+                _synchronize(device)
+                timings[src, dst] = (time.perf_counter() - start) / iters
+            elif rank == dst:
+                peer = _global_rank(group, src)
+                for _ in range(warmup + iters):
+                    dist.recv(payload, peer, group=group)
+                    dist.send(ack, peer, group=group)
+
+    # every entry was filled in by its sender only
+    dist.all_reduce(timings, group=group)
+    return timings.cpu()
+
+
+def _probe_device(group) -> torch.device:
+    if dist.get_backend(group) == "nccl":
+        return torch.device("cuda", torch.cuda.current_device())
+    return torch.device("cpu")
+
+
+def _cache_key(group, device) -> str:
+    """Hash of every rank's host and device, in rank order."""
+    if device.type == "cuda":
+        local = f"{socket.gethostname()}:{device.index}:{torch.cuda.get_device_name(device)}"
+    else:
+        local = f"{socket.gethostname()}:cpu"
+    members = [None] * dist.get_world_size(group)
+    dist.all_gather_object(members, local, group=group)
+    return hashlib.sha1(json.dumps(members).encode()).hexdigest()[:16]
+
+
+def _global_rank(group, group_rank: int) -> int:
+    if group is None:
+        return group_rank
+    return dist.get_global_rank(group, group_rank)
+
+
+def _synchronize(device: torch.device) -> None:
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
@@ -0,0 +1,261 @@
+"""
+Per-rank peak memory of a context parallel forward pass, and the fastest split
+that fits every device.
+
+Heterogeneous nodes mix memory sizes as well as speeds, and a speed-proportional
+`block_lens` can put more tokens on a fast but small card than it can hold.
+`MemoryModel` estimates what each rank holds at its peak for a model config, a
+split and the ring's buffer policy:
+
+- weights: the full model, or one tensor parallel shard of it
+- KV shard: K/V of the local tokens, for every layer when they are cached
+- receive buffers: ring messages padded to the longest block, one send copy and
+  two (ping-pong) or `prefetch_depth` receives, at the wire size of
+  `kv_compression`; the all-gather mode holds every rank's block instead
+- accumulators: fp32 online softmax state and the fp32 copy of the queries
+  (plus a scores block on the naive, non-Triton path)
+- activations: one layer's hidden states, QKV projections and FFN intermediates
+  for the local tokens
+- output: the full-sequence embeddings every rank holds before sharding and after
+  the final gather, and the logits over them
+
+`memory_constrained_block_lens` then caps each rank at the tokens it can hold and
+spreads the rest over the others by speed; `plan_context_parallel` uses it when
+given a model and the device capacities and rejects splits nothing fits.
+"""
+
+import dataclasses
+import math
+from typing import List, Optional
+
+from fms.distributed.kv_compression import WIRE_DTYPES
+from fms.distributed.strategy import proportional_block_lens
+
+
+@dataclasses.dataclass
+class MemoryEstimate:
+    """Bytes one rank holds at its peak, by category."""
+
+    weights: int
+    kv_cache: int
+    buffers: int
+    accumulators: int
+    activations: int
+    output: int
+
+    @property
+    def total(self) -> int:
+        return sum(dataclasses.astuple(self))
+
+
+@dataclasses.dataclass
+class MemoryModel:
+    """
+    Model dimensions (a decoder like `LLaMAConfig`) and run settings:
+
+    hidden_dim: FFN inner dimension (gated, three projections)
+    element_size: bytes of weights and activations (2 for bf16)
+    tp_size: tensor parallel shards of the weights and heads (`ring_tp`)
+    use_cache: K/V of every layer stay resident, otherwise only one layer's
+    mode, prefetch_depth, kv_compression: the ring's buffer policy, see
+        `RingAttentionStrategy`
+    materialize_scores: the attention blocks run on the naive path (position
+        bias or dense masks, CPU), which materializes a fp32 scores block
+    gather_output: every rank computes logits for the full sequence
+    """
+
+    emb_dim: int
+    nheads: int
+    kvheads: int
+    nlayers: int
+    vocab_size: int
+    hidden_dim: int
+    batch_size: int = 1
+    element_size: int = 2
+    tp_size: int = 1
+    tie_heads: bool = False
+    use_cache: bool = True
+    mode: str = "pass_kv"
+    prefetch_depth: int = 1
+    kv_compression: Optional[str] = None
+    materialize_scores: bool = False
+    gather_output: bool = True
+
+    @classmethod
+    def from_config(cls, config, strategy=None, **kwargs) -> "MemoryModel":
+        """
+        Build from a `LLaMAConfig`-like config, taking the buffer policy from a
+        `RingAttentionStrategy` if given.
+        """
+        hidden_dim = int(config.hidden_grow_factor * config.emb_dim)
+        if getattr(config, "multiple_of", None):
+            hidden_dim = config.multiple_of * math.ceil(hidden_dim / config.multiple_of)
+        if strategy is not None:
+            kwargs.setdefault("tp_size", getattr(strategy, "tp_size", 1))
+            kwargs.setdefault("mode", strategy.mode)
+            kwargs.setdefault("prefetch_depth", strategy.prefetch_depth)
+            kwargs.setdefault("kv_compression", strategy.kv_compression)
+            kwargs.setdefault("gather_output", strategy.gather_output)
+        return cls(
+            emb_dim=config.emb_dim,
+            nheads=config.nheads,
+            kvheads=config.kvheads or config.nheads,
+            nlayers=config.nlayers,
+            vocab_size=config.src_vocab_size,
+            hidden_dim=hidden_dim,
+            tie_heads=getattr(config, "tie_heads", False),
+            **kwargs,
+        )
+
+    @property
+    def head_dim(self) -> int:
+        return self.emb_dim // self.nheads
+
+    @property
+    def local_heads(self) -> int:
+        return math.ceil(self.nheads / self.tp_size)
+
+    @property
+    def local_kvheads(self) -> int:
+        return math.ceil(self.kvheads / self.tp_size)
+
+    def weight_bytes(self) -> int:
+        attn = self.emb_dim * (self.nheads + 2 * self.kvheads) * self.head_dim
+        attn += self.nheads * self.head_dim * self.emb_dim
+        ffn = 3 * self.emb_dim * self.hidden_dim
+        embeddings = self.vocab_size * self.emb_dim * (1 if self.tie_heads else 2)
+        params = self.nlayers * (attn + ffn) + embeddings
+        return math.ceil(params / self.tp_size) * self.element_size
+
+    def estimate(self, block_lens: List[int], rank: int) -> MemoryEstimate:
+        """Peak memory of ring position `rank` under `block_lens`."""
+        return self._estimate(block_lens[rank], sum(block_lens), max(block_lens))
+
+    def _estimate(self, tokens: int, seq_len: int, msg_len: int) -> MemoryEstimate:
+        batch = self.batch_size
+        heads, kvheads, head_dim = self.local_heads, self.local_kvheads, self.head_dim
+
+        kv_token = 2 * batch * kvheads * head_dim
+        kv_cache = kv_token * tokens * self.element_size
+        if self.use_cache:
+            kv_cache *= self.nlayers
+
+        if self.mode == "allgather":
+            buffers = kv_token * seq_len * self.element_size
+        else:
+            wire_size = self.element_size
+            if self.kv_compression is not None:
+                wire_size = WIRE_DTYPES[self.kv_compression].itemsize
+            receives = max(2, self.prefetch_depth)
+            buffers = kv_token * msg_len * ((1 + receives) * wire_size)
+            if self.kv_compression is not None:
+                # blocks are dequantized into the model dtype on receipt
+                buffers += kv_token * msg_len * self.element_size
+
+        # numerator, fp32 queries, denominator and max
+        accumulators = batch * heads * tokens * (2 * head_dim + 2) * 4
+        if self.materialize_scores:
+            accumulators += batch * heads * tokens * msg_len * 4
+
+        local_emb = heads * head_dim
+        activations = batch * tokens * self.element_size * (
+            2 * self.emb_dim
+            + local_emb
+            + 2 * kvheads * head_dim
+            + 3 * math.ceil(self.hidden_dim / self.tp_size)
+        )
+
+        output_tokens = seq_len if self.gather_output else tokens
+        output = batch * self.element_size * (
+            seq_len * self.emb_dim + output_tokens * (self.emb_dim + self.vocab_size)
+        )
+
+        return MemoryEstimate(
+            weights=self.weight_bytes(),
+            kv_cache=kv_cache,
+            buffers=buffers,
+            accumulators=accumulators,
+            activations=activations,
+            output=output,
+        )
+
+    def peak(self, block_lens: List[int]) -> List[int]:
+        """Estimated peak bytes of every rank."""
+        return [self.estimate(block_lens, r).total for r in range(len(block_lens))]
+
+    def max_tokens(self, block_lens: List[int], capacity: float) -> int:
+        """
+        Most tokens a rank can hold within `capacity` bytes while the sequence
+        length and the longest block stay those of `block_lens`, -1 if it can't
+        even hold its fixed costs.
+        """
+        # the estimate is linear in the rank's own block length
+        seq_len, msg_len = sum(block_lens), max(block_lens)
+        base = self._estimate(0, seq_len, msg_len).total
+        per_token = self._estimate(1, seq_len, msg_len).total - base
+        if base > capacity:
+            return -1
+        return int((capacity - base) // per_token)
+
+    def check(self, block_lens: List[int], capacities: List[float]) -> None:
+        """Raise ValueError if any rank's estimated peak exceeds its capacity."""
+        over = []
+        for rank, capacity in enumerate(capacities):
+            estimate = self.estimate(block_lens, rank)
+            if estimate.total > capacity:
+                over.append(
+                    f"rank {rank}: {estimate.total / 2**30:.2f} GiB > "
+                    f"{capacity / 2**30:.2f} GiB ({estimate})"
+                )
+        if over:
+            raise ValueError(
+                f"block_lens {block_lens} don't fit in memory: " + "; ".join(over)
+            )
+
+
+def _capped_block_lens(seq_len: int, speeds: List[float], caps: List[int]) -> List[int]:
+    """Split `seq_len` proportionally to `speeds` without exceeding any rank's cap."""
+    lens = [0] * len(speeds)
+    free = [r for r in range(len(speeds)) if caps[r] > 0]
+    remaining = seq_len
+    while remaining > 0:
+        if not free:
+            raise ValueError(f"{seq_len} tokens don't fit within per-rank limits {caps}")
+        share = proportional_block_lens(remaining, [speeds[r] for r in free])
+        capped = [r for r, n in zip(free, share) if n >= caps[r]]
+        if not capped:
+            for r, n in zip(free, share):
+                lens[r] += n
+            break
+        for r in capped:
+            remaining -= caps[r] - lens[r]
+            lens[r] = caps[r]
+        free = [r for r in free if r not in capped]
+    return lens
+
+
+def memory_constrained_block_lens(
+    seq_len: int,
+    speeds: List[float],
+    memory_model: MemoryModel,
+    capacities: List[float],
+    max_iterations: int = 32,
+) -> List[int]:
+    """
+    The speed-proportional split of `seq_len`, with ranks whose estimated peak
+    would exceed their capacity (bytes) capped at what they hold and the rest
+    spread over the others by speed. Raises ValueError if no split fits.
+    """
+    block_lens = proportional_block_lens(seq_len, speeds)
+    for _ in range(max_iterations):
+        # receive buffers follow the longest block, so caps depend on the split
+        caps = [
+            memory_model.max_tokens(block_lens, capacity) for capacity in capacities
+        ]
+        if any(cap < 0 for cap in caps):
+            break
+        if all(n <= cap for n, cap in zip(block_lens, caps)):
+            return block_lens
+        block_lens = _capped_block_lens(seq_len, speeds, caps)
+    memory_model.check(block_lens, capacities)
+    return block_lens
@@ -0,0 +1,154 @@
+"""
+Online regression model of rank throughput.
+
+Offline fits of rank speed go stale as soon as the hardware, the drivers or the
+kernels change. `OnlinePerformanceModel` predicts a rank's ring attention
+throughput (query tokens per second of one profiled forward pass) from log2 of the request's
+sequence length and per-rank features (e.g. the MPS percentage, a calibrated
+speed, a device one-hot) as a degree-2 polynomial in log throughput. It is fit
+by least squares from running sums, so every observation is a cheap rank-one
+update; older observations are decayed, so the fit follows the hardware as it
+changes. `record_forward` feeds it the per-rank busy times of the profiled
+forward passes (`RingAttentionStrategy.timings`), and the model is saved to and
+loaded from a small JSON file between runs.
+"""
+
+import json
+import math
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+import torch.distributed as dist
+
+from fms.distributed.strategy import proportional_block_lens
+
+
+# log2 seq_len is centered here, which keeps the normal equations well conditioned
+_REFERENCE_SEQ_LEN = 16384
+
+class OnlinePerformanceModel:
+    """
+    num_rank_features: length of the per-rank feature vectors
+    decay: weight every earlier observation keeps per new one (1 never forgets)
+    ridge: regularization of directions the observations don't cover yet
+    """
+
+    def __init__(self, num_rank_features: int, decay: float = 0.99, ridge: float = 1e-3):
+        if not 0 < decay <= 1:
+            raise ValueError(f"decay must be in (0, 1], got {decay}")
+        self.num_rank_features = num_rank_features
+        self.decay = decay
+        self.ridge = ridge
+        dim = len(self._features(1, [0.0] * num_rank_features))
+        # decayed sums of phi phi^T and phi y, and the decayed observation count
+        self.gram = np.zeros((dim, dim))
+        self.moment = np.zeros(dim)
+        self.count = 0.0
+        self._coef: Optional[np.ndarray] = None
+
+    def _features(self, seq_len: int, rank_features: Sequence[float]) -> np.ndarray:
+        if len(rank_features) != self.num_rank_features:
+            raise ValueError(
+                f"expected {self.num_rank_features} rank features, got {len(rank_features)}"
+            )
+        x = [math.log2(seq_len / _REFERENCE_SEQ_LEN), *rank_features]
+        quadratic = [x[i] * x[j] for i in range(len(x)) for j in range(i, len(x))]
+        return np.array([1.0, *x, *quadratic])
+
+    def observe(
+        self, seq_len: int, rank_features: Sequence[float], tokens: int, seconds: float
+    ) -> None:
+        """Add one measurement: a rank with `rank_features` attended `tokens` queries in `seconds`."""
+        phi = self._features(seq_len, rank_features)
+        target = math.log(tokens / seconds)
+        self.gram = self.decay * self.gram + np.outer(phi, phi)
+        self.moment = self.decay * self.moment + phi * target
+        self.count = self.decay * self.count + 1
+        self._coef = None
+
+    def coefficients(self) -> np.ndarray:
+        if self._coef is None:
+            regularized = self.gram + self.ridge * np.eye(len(self.moment))
+            self._coef = np.linalg.lstsq(regularized, self.moment, rcond=None)[0]
+        return self._coef
+
+    def predict(self, seq_len: int, rank_features: Sequence[Sequence[float]]) -> List[float]:
+        """Predicted throughput of every rank, from its feature vector."""
+        if self.count == 0:
+            raise ValueError("the model has no observations yet")
+        phi = np.stack([self._features(seq_len, f) for f in rank_features])
+        return np.exp(phi @ self.coefficients()).tolist()
+
+    def weights(self, seq_len: int, rank_features: Sequence[Sequence[float]]) -> List[float]:
+        """Relative speeds of the ranks summing to 1, uniform before any observation."""
+        if self.count == 0:
+            return [1.0 / len(rank_features)] * len(rank_features)
+        throughput = self.predict(seq_len, rank_features)
+        return [t / sum(throughput) for t in throughput]
+
+    def block_lens(self, seq_len: int, rank_features: Sequence[Sequence[float]]) -> List[int]:
+        """`block_lens` splitting `seq_len` by predicted rank throughput."""
+        return proportional_block_lens(seq_len, self.weights(seq_len, rank_features))
+
+    def save(self, path: str) -> None:
+        state = {
+            "num_rank_features": self.num_rank_features,
+            "decay": self.decay,
+            "ridge": self.ridge,
+            "gram": self.gram.tolist(),
+            "moment": self.moment.tolist(),
+            "count": self.count,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "OnlinePerformanceModel":
+        with open(path, "r") as f:
+            state = json.load(f)
+        model = cls(state["num_rank_features"], state["decay"], state["ridge"])
+        model.gram = np.array(state["gram"])
+        model.moment = np.array(state["moment"])
+        model.count = state["count"]
+        return model
+
+    @classmethod
+    def load_or_create(cls, path: str, num_rank_features: int, **kwargs) -> "OnlinePerformanceModel":
+        """The model saved at `path`, or a new one if there is none."""
+        if os.path.exists(path):
+            return cls.load(path)
+        return cls(num_rank_features, **kwargs)
+
+
+def record_forward(
+    model: OnlinePerformanceModel, strategy, rank_features: Sequence[float]
+) -> None:
+    """
+    Update `model` with the average busy time per forward pass of every rank of
+    `strategy`'s group since its timings were last reset (`strategy.profile` must
+    be set), each with its own `rank_features`. Collective; every rank's model gets
+    the same updates. Resets the strategy's timings. Raises ValueError on every
+    rank if any rank profiled no forward pass.
+    """
+    timings = strategy.timings
+    local = (strategy.local_q_len, timings.forwards, timings.busy_ms, list(rank_features))
+    gathered: List = [None] * strategy.world_size
+    if strategy.world_size > 1:
+        dist.all_gather_object(gathered, local, group=strategy.group)
+    else:
+        gathered = [local]
+    if any(forwards == 0 for _, forwards, _, _ in gathered):
+        raise ValueError(
+            "record_forward needs a profiled forward pass on every rank; set "
+            "strategy.profile before running the model"
+        )
+    seq_len = sum(strategy.block_lens)
+    for tokens, forwards, busy_ms, features in gathered:
+        seconds = busy_ms / 1000 / forwards
+        if tokens > 0 and seconds > 0:
+            model.observe(seq_len, features, tokens, seconds)
+    timings.reset()
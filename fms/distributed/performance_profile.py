@@ -0,0 +1,269 @@
+"""
+Measured performance lookup table for partitioning.
+
+A `PerformanceProfile` holds throughput measurements over a grid of
+
+- device: device or emulation name ("A100", "L40S", "mps")
+- slowdown: share of the device available, e.g. the MPS percentage (100 for a
+  whole device)
+- seq_len, world_size, dtype, and the head config (nheads, kvheads, head_dim)
+
+and answers throughput queries between and beyond the measured points: it
+interpolates monotonically (PCHIP, shape preserving, no overshoot between
+points) in log throughput over log2 seq_len, then over slowdown. Outside the
+measured range, throughput follows the power law of the nearest segment in
+seq_len and is clamped in slowdown. Queries are vectorized over seq_len and
+slowdown. Categorical fields must match a measured value, except world_size,
+which falls back to the nearest measured one.
+
+Profiles load from and save to Parquet (requires pyarrow), and import the CSVs of
+the hpml_testing sweeps (`from_csv`).
+"""
+
+import dataclasses
+import math
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import torch
+from torch import Tensor
+
+
+# categorical fields a query selects measurements by
+_KEY_FIELDS = ("device", "dtype", "nheads", "kvheads", "head_dim", "world_size")
+
+
+@dataclasses.dataclass(frozen=True)
+class ProfilePoint:
+    """One measurement; `throughput` in tokens (or FLOPs) per second, higher is faster."""
+
+    device: str
+    slowdown: float
+    seq_len: int
+    world_size: int
+    dtype: str
+    nheads: int
+    kvheads: int
+    head_dim: int
+    throughput: float
+
+
+def _pchip_slopes(x: Tensor, y: Tensor) -> Tensor:
+    """Fritsch-Carlson derivatives at `x` [n] of the columns of `y` [n, Q]."""
+    n = x.numel()
+    if n == 1:
+        return torch.zeros_like(y)
+    h = (x[1:] - x[:-1]).unsqueeze(-1)
+    delta = (y[1:] - y[:-1]) / h
+    if n == 2:
+        return torch.cat([delta, delta])
+
+    # interior: weighted harmonic mean of the secants, 0 at local extrema
+    h0, h1 = h[:-1], h[1:]
+    m0, m1 = delta[:-1], delta[1:]
+    w1, w2 = 2 * h1 + h0, h1 + 2 * h0
+    same_sign = m0 * m1 > 0
+    ones = torch.ones_like(m0)
+    inner = (w1 + w2) / (w1 / torch.where(same_sign, m0, ones) + w2 / torch.where(same_sign, m1, ones))
+    inner = torch.where(same_sign, inner, torch.zeros_like(inner))
+
+    def edge(h0, h1, m0, m1):
+        d = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+        d = torch.where(torch.sign(d) != torch.sign(m0), torch.zeros_like(d), d)
+        overshoot = (torch.sign(m0) != torch.sign(m1)) & (d.abs() > 3 * m0.abs())
+        return torch.where(overshoot, 3 * m0, d)
+
+    first = edge(h[0], h[1], delta[0], delta[1])
+    last = edge(h[-1], h[-2], delta[-1], delta[-2])
+    return torch.cat([first[None], inner, last[None]])
+
+
+def _pchip(x: Tensor, y: Tensor, xq: Tensor, extrapolate: bool) -> Tensor:
+    """
+    Evaluate the PCHIP interpolant through (`x` [n], column q of `y` [n, Q]) at
+    `xq[q]`. Outside [x[0], x[-1]] the end secant is continued if `extrapolate`,
+    else the end value is held.
+    """
+    n = x.numel()
+    if n == 1:
+        return y[0].clone()
+    d = _pchip_slopes(x, y)
+    cols = torch.arange(xq.numel())
+    idx = (torch.searchsorted(x, xq.contiguous(), right=True) - 1).clamp(0, n - 2)
+    x0, x1 = x[idx], x[idx + 1]
+    h = x1 - x0
+    t = ((xq - x0) / h).clamp(0.0, 1.0)
+    y0, y1, d0, d1 = y[idx, cols], y[idx + 1, cols], d[idx, cols], d[idx + 1, cols]
+    t2, t3 = t * t, t * t * t
+    out = (
+        (2 * t3 - 3 * t2 + 1) * y0
+        + (t3 - 2 * t2 + t) * h * d0
+        + (-2 * t3 + 3 * t2) * y1
+        + (t3 - t2) * h * d1
+    )
+    if extrapolate:
+        low_slope = (y[1] - y[0]) / (x[1] - x[0])
+        high_slope = (y[-1] - y[-2]) / (x[-1] - x[-2])
+        out = torch.where(xq < x[0], y[0] + (xq - x[0]) * low_slope, out)
+        out = torch.where(xq > x[-1], y[-1] + (xq - x[-1]) * high_slope, out)
+    return out
+
+
+class PerformanceProfile:
+    """Throughput lookup table, see the module docstring."""
+
+    def __init__(self, points: Sequence[ProfilePoint]):
+        self.points = list(points)
+        # key -> slowdown -> (log2 seq_len, log throughput), sorted by seq_len
+        self._grids: Dict[Tuple, Dict[float, Tuple[Tensor, Tensor]]] = {}
+        by_key: Dict[Tuple, Dict[float, Dict[int, float]]] = {}
+        for p in self.points:
+            if p.throughput <= 0:
+                raise ValueError(f"throughput must be positive: {p}")
+            key = tuple(getattr(p, f) for f in _KEY_FIELDS)
+            by_key.setdefault(key, {}).setdefault(float(p.slowdown), {})[p.seq_len] = p.throughput
+        for key, levels in by_key.items():
+            grid = {}
+            for slowdown, values in levels.items():
+                seq_lens = sorted(values)
+                grid[slowdown] = (
+                    torch.tensor([math.log2(s) for s in seq_lens], dtype=torch.float64),
+                    torch.tensor([math.log(values[s]) for s in seq_lens], dtype=torch.float64),
+                )
+            self._grids[key] = dict(sorted(grid.items()))
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PerformanceProfile) and sorted(
+            self.points, key=dataclasses.astuple
+        ) == sorted(other.points, key=dataclasses.astuple)
+
+    def _select(self, **key) -> Tuple:
+        """The measured key matching the given fields (None matches anything)."""
+        candidates = [
+            k
+            for k in self._grids
+            if all(
+                key[f] is None or f == "world_size" or k[i] == key[f]
+                for i, f in enumerate(_KEY_FIELDS)
+            )
+        ]
+        if not candidates:
+            raise KeyError(f"no measurements for {key}")
+        world_size = key["world_size"]
+        if world_size is not None:
+            # the closest measured ring size stands in for unmeasured ones
+            nearest = min(abs(k[-1] - world_size) for k in candidates)
+            candidates = [k for k in candidates if abs(k[-1] - world_size) == nearest]
+        if len(candidates) > 1:
+            raise ValueError(
+                f"{key} matches several measured configs, specify more fields: {candidates}"
+            )
+        return candidates[0]
+
+    def throughput(
+        self,
+        seq_len: Union[int, Sequence[int], Tensor],
+        slowdown: Union[float, Sequence[float], Tensor] = 100.0,
+        device: Optional[str] = None,
+        world_size: Optional[int] = None,
+        dtype: Optional[str] = None,
+        nheads: Optional[int] = None,
+        kvheads: Optional[int] = None,
+        head_dim: Optional[int] = None,
+    ) -> Tensor:
+        """
+        Interpolated throughput at every (seq_len, slowdown) pair (broadcast
+        against each other) of the config the other fields select.
+        """
+        key = self._select(
+            device=device, world_size=world_size, dtype=dtype,
+            nheads=nheads, kvheads=kvheads, head_dim=head_dim,
+        )
+        seq_len, slowdown = torch.broadcast_tensors(
+            torch.as_tensor(seq_len, dtype=torch.float64),
+            torch.as_tensor(slowdown, dtype=torch.float64),
+        )
+        shape = seq_len.shape
+        log_len, slowdown = seq_len.flatten().log2(), slowdown.flatten()
+
+        # along seq_len at every measured slowdown, then across slowdowns
+        grid = self._grids[key]
+        levels = torch.tensor(list(grid), dtype=torch.float64)
+        at_levels = torch.stack(
+            [
+                _pchip(x, y[:, None].expand(-1, log_len.numel()), log_len, extrapolate=True)
+                for x, y in grid.values()
+            ]
+        )
+        log_throughput = _pchip(levels, at_levels, slowdown, extrapolate=False)
+        return log_throughput.exp().view(shape)
+
+    def weights(
+        self, seq_len: int, slowdowns: Sequence[float], **key
+    ) -> List[float]:
+        """Relative speeds of ranks running at `slowdowns`, summing to 1."""
+        throughput = self.throughput(seq_len, list(slowdowns), **key)
+        return (throughput / throughput.sum()).tolist()
+
+    def save(self, path: str) -> None:
+        """Write the measurements as a Parquet file."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = {
+            f.name: [getattr(p, f.name) for p in self.points]
+            for f in dataclasses.fields(ProfilePoint)
+        }
+        types = {
+            "device": pa.dictionary(pa.int32(), pa.string()),
+            "dtype": pa.dictionary(pa.int32(), pa.string()),
+            "slowdown": pa.float64(),
+            "throughput": pa.float64(),
+        }
+        table = pa.table(
+            {name: pa.array(values, type=types.get(name, pa.int32())) for name, values in columns.items()}
+        )
+        pq.write_table(table, path, compression="zstd")
+
+    @classmethod
+    def load(cls, path: str) -> "PerformanceProfile":
+        import pyarrow.parquet as pq
+
+        columns = pq.read_table(path).to_pydict()
+        return cls([ProfilePoint(*row) for row in zip(*(columns[f.name] for f in dataclasses.fields(ProfilePoint)))])
+
+    @classmethod
+    def from_csv(cls, path: str, **defaults) -> "PerformanceProfile":
+        """
+        Import a sweep CSV: the `mps_pct, latency_ms` ring profiles of
+        `generate_ring_profile.py` (throughput = seq_len / latency) or the
+        `mps_pct, size, dtype, tflops` matmul sweeps. Fields the CSV lacks come
+        from `defaults` (seq_len, device, world_size, dtype, nheads, kvheads,
+        head_dim).
+        """
+        import csv
+
+        fields = dict(device="mps", world_size=1, dtype="float16", nheads=32, kvheads=32, head_dim=128)
+        fields.update(defaults)
+        points = []
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                point = dict(fields, slowdown=float(row["mps_pct"]))
+                if "size" in row:
+                    point["seq_len"] = int(row["size"])
+                if "dtype" in row:
+                    point["dtype"] = row["dtype"]
+                if "latency_ms" in row:
+                    point["throughput"] = point["seq_len"] / (float(row["latency_ms"]) / 1000)
+                elif "tflops" in row:
+                    point["throughput"] = float(row["tflops"]) * 1e12
+                else:
+                    raise ValueError(f"{path} has neither a latency_ms nor a tflops column")
+                points.append(ProfilePoint(**point))
+        return cls(points)
+
+    @classmethod
+    def from_records(cls, records: Sequence[Mapping]) -> "PerformanceProfile":
+        return cls([ProfilePoint(**r) for r in records])
@@ -0,0 +1,235 @@
+"""
+Context-parallel planning: how to split a request across ranks and which
+algorithm to run it with.
+
+`CostModel` estimates the latency of one attention layer for a given split from
+per-rank attention throughput and link speeds:
+
+- pass-KV runs in lockstep: every step waits for the slowest rank's block and
+  for the KV hop it overlaps with, plus a fixed per-step overhead
+- all-gather pays for one gather (overlapped with the local block) and then
+  every rank attends independently, so heterogeneous ranks don't wait on each
+  other step by step
+
+`CostModel.chunk_size` picks the sub-chunk size of the pipelined pass-KV ring
+(`RingAttentionStrategy.chunk_size`) from the same link costs.
+
+`plan_context_parallel` splits a request proportionally to the ranks' speeds and
+returns the cheaper mode as a `ContextParallelPlan`, which
+`RingAttentionStrategy.apply_plan` applies. Given a `kv_compression` it also turns
+on compressed KV hops (`fms.distributed.kv_compression`) when the pass-KV ring is
+predicted to be bound by its links and compression makes it the cheapest plan.
+Given a `MemoryModel` and the devices' capacities, each mode's split is the
+fastest one that fits every rank (`memory_constrained_block_lens`), and modes
+that fit nowhere are ruled out before launch.
+"""
+
+import dataclasses
+import math
+from typing import List, Optional
+
+from fms.distributed.kv_compression import WIRE_DTYPES
+from fms.distributed.link_probe import LinkProfile
+from fms.distributed.memory import MemoryModel, memory_constrained_block_lens
+from fms.distributed.strategy import proportional_block_lens
+
+
+@dataclasses.dataclass
+class ContextParallelPlan:
+    mode: str
+    block_lens: List[int]
+    estimated_time: float
+    kv_compression: Optional[str] = None
+
+
+@dataclasses.dataclass
+class CostModel:
+    """
+    speeds: attention throughput of each rank (in ring order) in query-key pairs
+        per second for one layer, e.g. from a calibration run
+    kv_bytes_per_token: bytes of K and V for one token of one layer (2 * kvheads *
+        head_dim * element size), small for GQA models
+    bandwidth: link bandwidth in GB/s, used when there is no `links` profile
+    latency_us: link latency, used when there is no `links` profile
+    links: measured links between the ranks (see `probe_links`), indexed in ring
+        order
+    step_overhead_us: fixed cost of one dependent ring step (launches and the
+        synchronization between compute and the hop)
+    causal: count only the query-key pairs a causal mask keeps
+    """
+
+    speeds: List[float]
+    kv_bytes_per_token: int
+    bandwidth: float = 25.0
+    latency_us: float = 10.0
+    links: Optional[LinkProfile] = None
+    step_overhead_us: float = 20.0
+    causal: bool = True
+
+    @property
+    def world_size(self) -> int:
+        return len(self.speeds)
+
+    def hop_time(self, src: int, dst: int, tokens: int) -> float:
+        nbytes = tokens * self.kv_bytes_per_token
+        if self.links is not None:
+            return self.links.transfer_time(src, dst, nbytes)
+        return self.latency_us * 1e-6 + nbytes / (self.bandwidth * 1e9)
+
+    def block_time(self, block_lens: List[int], rank: int, source: int) -> float:
+        """Seconds for `rank` to attend its queries to `source`'s keys."""
+        starts = [sum(block_lens[:r]) for r in range(len(block_lens))]
+        pairs = _visible_pairs(
+            starts[rank], block_lens[rank], starts[source], block_lens[source], self.causal
+        )
+        return pairs / self.speeds[rank]
+
+    def pass_kv_time(self, block_lens: List[int]) -> float:
+        world_size = self.world_size
+        msg_len = max(block_lens)
+        total = 0.0
+        for step in range(world_size):
+            slowest = 0.0
+            for rank in range(world_size):
+                t = self.block_time(block_lens, rank, (rank - step) % world_size)
+                if step < world_size - 1:
+                    t = max(t, self.hop_time(rank, (rank + 1) % world_size, msg_len))
+                slowest = max(slowest, t)
+            total += slowest + self.step_overhead_us * 1e-6
+        return total
+
+    def chunk_size(self, block_lens: List[int], latency_overhead: float = 0.25) -> int:
+        """
+        Tokens per sub-chunk of a pipelined ring hop: the smallest chunk whose
+        per-message latency is at most `latency_overhead` of its transfer time on
+        the slowest hop. Smaller chunks expose less of each hop but pay the
+        latency more often.
+        """
+        world_size = self.world_size
+        hops = [(r, (r + 1) % world_size) for r in range(world_size)]
+        latency = max(self.hop_time(src, dst, 0) for src, dst in hops)
+        per_token = max(
+            self.hop_time(src, dst, 1) - self.hop_time(src, dst, 0) for src, dst in hops
+        )
+        msg_len = max(block_lens)
+        if per_token <= 0:
+            return msg_len
+        tokens = math.ceil(latency / (latency_overhead * per_token))
+        return max(1, min(msg_len, tokens))
+
+    def comm_bound(self, block_lens: List[int]) -> bool:
+        """Whether the pass-KV ring spends more time waiting on hops than computing."""
+        world_size = self.world_size
+        msg_len = max(block_lens)
+        compute = comm = 0.0
+        for step in range(world_size - 1):
+            compute += max(
+                self.block_time(block_lens, rank, (rank - step) % world_size)
+                for rank in range(world_size)
+            )
+            comm += max(
+                self.hop_time(rank, (rank + 1) % world_size, msg_len)
+                for rank in range(world_size)
+            )
+        return comm > compute
+
+    def compressed(self, kv_compression: str, element_size: int = 2) -> "CostModel":
+        """
+        This model with KV hops sent as `kv_compression` instead of
+        `element_size`-byte values (the per-head scales are negligible).
+        """
+        wire_size = WIRE_DTYPES[kv_compression].itemsize
+        return dataclasses.replace(
+            self, kv_bytes_per_token=self.kv_bytes_per_token * wire_size // element_size
+        )
+
+    def allgather_time(self, block_lens: List[int]) -> float:
+        world_size = self.world_size
+        msg_len = max(block_lens)
+        # ring all-gather: world_size - 1 rounds bound by the slowest link
+        gather = sum(
+            max(self.hop_time(r, (r + 1) % world_size, msg_len) for r in range(world_size))
+            for _ in range(world_size - 1)
+        )
+        slowest = 0.0
+        for rank in range(world_size):
+            local = self.block_time(block_lens, rank, rank)
+            remote = sum(
+                self.block_time(block_lens, rank, source)
+                for source in range(world_size)
+                if source != rank
+            )
+            slowest = max(slowest, max(local, gather) + remote)
+        return slowest + 2 * self.step_overhead_us * 1e-6
+
+
+def plan_context_parallel(
+    seq_len: int,
+    cost_model: CostModel,
+    modes=("pass_kv", "allgather"),
+    kv_compression: Optional[str] = None,
+    element_size: int = 2,
+    memory_model: Optional[MemoryModel] = None,
+    capacities: Optional[List[float]] = None,
+) -> ContextParallelPlan:
+    """
+    Split `seq_len` by rank speed and pick the mode with the lower estimate. With
+    `kv_compression`, a comm-bound pass-KV ring is also costed with compressed
+    hops of `element_size`-byte K/V and chosen if that is cheaper still. With a
+    `memory_model` and per-rank `capacities` (bytes, in ring order), splits are
+    capped to fit and ValueError is raised if no mode fits.
+    """
+    estimates = {
+        "pass_kv": cost_model.pass_kv_time,
+        "allgather": cost_model.allgather_time,
+    }
+    candidates = {}
+    for mode in modes:
+        if memory_model is None:
+            block_lens = proportional_block_lens(seq_len, cost_model.speeds)
+        else:
+            assert capacities is not None, "capacities are required with a memory_model"
+            try:
+                block_lens = memory_constrained_block_lens(
+                    seq_len,
+                    cost_model.speeds,
+                    dataclasses.replace(memory_model, mode=mode),
+                    capacities,
+                )
+            except ValueError:
+                continue
+        candidates[mode] = ContextParallelPlan(
+            mode, block_lens, estimates[mode](block_lens)
+        )
+    if not candidates:
+        raise ValueError(f"no context parallel mode fits {seq_len} tokens in memory")
+
+    plan = min(candidates.values(), key=lambda p: p.estimated_time)
+    ring = candidates.get("pass_kv")
+    if (
+        kv_compression is not None
+        and ring is not None
+        and cost_model.comm_bound(ring.block_lens)
+    ):
+        compressed = cost_model.compressed(kv_compression, element_size)
+        estimate = compressed.pass_kv_time(ring.block_lens)
+        if estimate < plan.estimated_time:
+            plan = ContextParallelPlan("pass_kv", ring.block_lens, estimate, kv_compression)
+    return plan
+
+
+def _visible_pairs(q_start: int, q_len: int, k_start: int, k_len: int, causal: bool) -> int:
+    """Number of (query, key) pairs a causal (or full) mask keeps between two blocks."""
+    if not causal:
+        return q_len * k_len
+    total = 0
+    # each query i sees keys [k_start, min(i + 1, k_end))
+    lo = max(q_start, k_start)
+    hi = min(q_start + q_len, k_start + k_len)
+    if hi > lo:
+        # queries inside the key range see a growing prefix
+        n = hi - lo
+        total += n * (lo - k_start) + n * (n + 1) // 2
+    # queries past the key range see all of it
+    total += max(0, q_start + q_len - max(q_start, k_start + k_len)) * k_len
+    return total
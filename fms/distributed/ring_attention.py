@@ -8,17 +8,35 @@ with support for heterogeneous GPU configurations. Key features:
 - Online softmax for correct attention merging across variable-sized shards
 - Async P2P communication overlapped with compute via separate CUDA streams
 - Custom Triton kernels for block-wise attention statistics
+- Compact `RingMask` descriptors evaluated per KV block, so no dense N x N mask
+  is needed and fully masked blocks are skipped
 
-The main entry point is `ring_attention()`, which is called from LLaMABlock
-when the "ring" distributed strategy is enabled.
+The ring is registered as the "ring" attention op (see `register_attention_op`).
+`RingAttentionStrategy` shards the sequence before the first distributed layer and
+routes the attention of every distributed layer through this op, so any model
+built on `MultiHeadAttention` gets context parallelism without model changes.
 """
+import dataclasses
+import functools
 import math
 import torch
 from torch import Tensor
-from typing import List, Optional, Tuple
-
-from fms.modules.attention import MultiHeadAttention
-from fms.distributed.strategy import RingAttentionStrategy
+from typing import Callable, Optional, Tuple, Union
+from typing_extensions import NotRequired, Unpack
+
+from fms.modules.attention import (
+    AttentionKwargs,
+    MultiHeadAttention,
+    register_attention_op,
+)
+from fms.distributed import kv_compression
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.ring_plan import RingBlock, RingPlan, build_ring_plan
+from fms.distributed.strategy import (
+    HierarchicalRingAttentionStrategy,
+    RingAttentionStrategy,
+)
+from fms.distributed.tracing import Tracer, trace_span
 
 # Use Triton only when block size is big enough (Q_len*K_len)
 _TRITON_MIN_WORK = 2048
@@ -31,356 +49,297 @@ except ImportError as e:
     print("[Triton IMPORT ERROR]", e)
     _HAS_TRITON = False
 
-# Global state for profiling
-_layer_call_counter = 0
-_printed_stream_info = False
+# Finite "-inf" used for masked logits, matching the Triton kernel. Rows that are
+# fully masked within a block then get zero weight when merged instead of NaNs.
+_MASK_VALUE = -1e9
 
-# Aggregate timing across all layers
-_total_compute_ms = 0.0
-_total_comm_ms = 0.0
-_total_bytes = 0
 
+class RingAttentionKwargs(AttentionKwargs):
+    """
+    ring_strategy: RingAttentionStrategy
+        the strategy holding this rank's shard of the sequence and its ring peers.
+        Injected by `RingAttentionStrategy` for every distributed layer.
+    mask: RingMask | Tensor
+        mask over the global sequence; a `RingMask` is preferred, a dense tensor
+        is sliced per KV block
+    is_causal_mask: bool
+        causal masking when `mask` is not a `RingMask`; defaults to causal when no
+        mask is given
+    sliding_window: int
+        attention window (e.g. Mistral's), added to the mask. Set by
+        `RingAttentionStrategy` when built with `sliding_window`. Under a causal window the
+        ring stops after the ranks overlapping each window, see
+        `RingAttentionStrategy.ring_steps()`
+    position_bias: Callable[[Tensor, Tensor], Tensor]
+        additive attention bias for given global query and key positions (e.g.
+        MPNet's relative position bias), evaluated per KV block instead of being
+        folded into a dense N x N mask
+    """
 
-def ring_forward(
-    self,
-    x,
-    *,
-    mask=None,
-    position_ids=None,
-    past_key_value_state=None,
-    use_cache=False,
-    is_causal_mask=False,
-    attn_algorithm=None
-):
-    """LLaMABlock forward pass using ring attention instead of standard attention."""
-    residual = x
-    x_norm = self.ln(x)
-
-    attn_output = ring_attention(
-        x_norm=x_norm,
-        attn_module=self.attn,
-        strategy=self.distributed_strategy,
-        valid_len=self.distributed_strategy._local_valid_len,
-        mask=mask,
-        position_ids=position_ids, # Sharded position_ids
-        past_key_value_state=past_key_value_state,
-        use_cache=use_cache,
-        causal=is_causal_mask,
+    ring_strategy: RingAttentionStrategy
+    mask: NotRequired[Union[Tensor, RingMask]]
+    is_causal_mask: NotRequired[bool]
+    sliding_window: NotRequired[int]
+    position_bias: NotRequired[Callable[[Tensor, Tensor], Tensor]]
+
+
+def _ring_store_op(
+    keys: Tensor,
+    values: Tensor,
+    key_cache: Optional[Tensor],
+    value_cache: Optional[Tensor],
+    **attn_kwargs: Unpack[RingAttentionKwargs],
+) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+    # the cache holds this rank's shard of the prompt, which a decode step can't
+    # attend over without the other ranks' shards
+    if key_cache is not None and key_cache.numel() > 0:
+        raise ValueError(
+            "ring attention only supports prefill; decode with a model that is not "
+            "context parallel"
+        )
+    keys = keys.transpose(2, 1)
+    values = values.transpose(2, 1)
+    return keys, values, keys, values
+
+
+def _ring_compute_op(
+    query: Tensor,
+    key_cache: Tensor,
+    value_cache: Tensor,
+    nheads: int,
+    kvheads: int,
+    p_dropout: float,
+    scale_factor: Optional[float],
+    **attn_kwargs: Unpack[RingAttentionKwargs],
+) -> Tensor:
+    strategy = attn_kwargs["ring_strategy"]
+    queries = query.transpose(2, 1)
+    assert queries.size(2) == strategy.local_q_len, (
+        f"query shard has {queries.size(2)} tokens, expected {strategy.local_q_len}"
     )
 
-    # Unpack attention output
-    if use_cache:
-        x, cache = attn_output
+    # no transpose in the store op without a cache, same check as sdpa
+    if key_cache.shape[1] != kvheads and key_cache.shape[2] == kvheads:
+        key_cache = key_cache.transpose(2, 1)
+        value_cache = value_cache.transpose(2, 1)
+
+    mask = attn_kwargs.get("mask", None)
+    causal = attn_kwargs.get("is_causal_mask", mask is None)
+
+    # MultiHeadAttention passes a multiplier; the ring loop divides by its scale.
+    # K/V stay compact (kvheads) on the wire and are shared by query heads at compute
+    scale = 1.0 / scale_factor if scale_factor else math.sqrt(queries.size(-1))
+    sliding_window = attn_kwargs.get("sliding_window", None)
+    if strategy.mode == "allgather":
+        ring_loop = _compute_attention_allgather
+    elif torch.compiler.is_compiling() and not isinstance(
+        strategy, HierarchicalRingAttentionStrategy
+    ):
+        # P2P handles and streams break the graph; the eager-only overlap
+        # variants (bidirectional, chunked, prefetch) fall back to this too
+        ring_loop = functools.partial(
+            _compute_attention_ring_functional,
+            plan=_ring_plan(strategy, mask, causal, sliding_window, queries.device),
+        )
+    elif isinstance(strategy, HierarchicalRingAttentionStrategy):
+        ring_loop = _compute_attention_hierarchical_ring
+    elif strategy.bidirectional:
+        ring_loop = _compute_attention_bidirectional_ring
+    elif strategy.chunk_size is not None:
+        ring_loop = _compute_attention_chunked_ring
+    elif strategy.prefetch_depth > 1:
+        ring_loop = _compute_attention_prefetch_ring
     else:
-        x = attn_output
-        cache = None
+        ring_loop = functools.partial(
+            _compute_attention_ring_pass_kv,
+            plan=_ring_plan(strategy, mask, causal, sliding_window, queries.device),
+        )
+    attn = ring_loop(
+        queries,
+        key_cache,
+        value_cache,
+        mask,
+        strategy,
+        strategy.local_q_start,
+        strategy.local_q_len,
+        scale,
+        torch.float32,
+        causal,
+        sliding_window,
+        attn_kwargs.get("position_bias", None),
+        dropout_p=p_dropout,
+    )
 
-    x = x + residual
+    # attn: b x h x qlen x ds -> b x qlen x h x ds
+    return attn.transpose(2, 1).contiguous()
 
-    # then we do FF and Add&Norm
-    residual = x
-    x = self.ff_ln(x)
-    x = self.ff_sub_layer(x)
-    x = x + residual
 
-    if use_cache:
-        return (x, cache)
-    else:
-        return x
+register_attention_op("ring", _ring_store_op, _ring_compute_op)
 
 
-def ring_attention(
-    x_norm: Tensor,
-    attn_module: MultiHeadAttention,
+def _ring_plan(
     strategy: RingAttentionStrategy,
-    valid_len: int,
-    *,
-    mask: Optional[Tensor] = None,
-    position_ids: Optional[Tensor] = None,
-    past_key_value_state: Optional[Tuple[Tensor, Tensor]] = None,
-    use_cache: bool = False,
-    causal: bool = False,
-):
+    mask: Optional[Union[Tensor, RingMask]],
+    causal: bool,
+    sliding_window: Optional[int],
+    device: torch.device,
+) -> RingPlan:
     """
-    Distributed ring attention with heterogeneous partitioning.
-    KV tensors rotate around the ring while Q stays local.
+    The `RingPlan` of the current forward pass for this mask, built by the first
+    layer and reused by the others (the strategy drops its plans at layer 0).
     """
-    batch_size, num_valid_tokens_input_shard, emb_dim = x_norm.shape
-
-    #decode check
-    is_decode = (use_cache and past_key_value_state is not None and past_key_value_state[0].numel() > 0)
-
-    if is_decode:
-        return _ring_attention_pass_q(
-            x_norm=x_norm,
-            attn_module=attn_module,
-            strategy=strategy,
-            valid_len=valid_len,
-            mask=mask,
-            position_ids=position_ids,
-            past_key_value_state=past_key_value_state,
-            use_cache=use_cache,
-            causal=causal,
-        )
-    else:
-        return _ring_attention_pass_kv(
-            x_norm=x_norm,
-            attn_module=attn_module,
-            strategy=strategy,
-            valid_len=valid_len,
-            mask=mask,
-            position_ids=position_ids,
-            past_key_value_state=past_key_value_state,
-            use_cache=use_cache,
-            causal=causal,
-        )
+    key = _plan_key(strategy, mask, causal, sliding_window)
+    plan = strategy._ring_plans.get(key)
+    if plan is None:
+        ring_mask, dense_mask = _ring_masks(mask, causal, sliding_window)
+        plan = build_ring_plan(strategy, ring_mask, dense_mask, device, key=key)
+        strategy._ring_plans[key] = plan
+    return plan
 
-def _ring_attention_pass_q(
-    x_norm: Tensor,
-    attn_module: MultiHeadAttention,
+
+def _plan_key(
     strategy: RingAttentionStrategy,
-    valid_len: int,
-    *,
-    mask: Optional[Tensor] = None,
-    position_ids: Optional[Tensor] = None,
-    past_key_value_state: Optional[Tuple[Tensor, Tensor]] = None,
-    use_cache: bool = False,
-    causal: bool = False,
-):
-    return 0
+    mask: Optional[Union[Tensor, RingMask]],
+    causal: bool,
+    sliding_window: Optional[int],
+) -> Tuple:
+    """What a `RingPlan` depends on: the mask and the shard layout."""
+    return (
+        id(mask),
+        causal,
+        sliding_window,
+        strategy.local_q_start,
+        strategy.local_q_len,
+        tuple(strategy.block_lens),
+    )
 
-def _ring_attention_pass_kv(
+
+def ring_attention(
     x_norm: Tensor,
     attn_module: MultiHeadAttention,
     strategy: RingAttentionStrategy,
-    valid_len: int,
     *,
-    mask: Optional[Tensor] = None,
+    mask: Optional[Union[Tensor, RingMask]] = None,
     position_ids: Optional[Tensor] = None,
-    past_key_value_state: Optional[Tuple[Tensor, Tensor]] = None,
     use_cache: bool = False,
-    causal: bool = False,
+    causal: bool = True,
 ):
     """
-    Ring attention for prefill using pass-KV strategy.
-    KV tensors rotate around the ring while Q stays local.
-    """
-    batch_size, num_valid_tokens_input_shard, emb_dim = x_norm.shape
-
-    # in hetero:
-    assert num_valid_tokens_input_shard == strategy.local_q_len
-    current_rank_token_global_start_idx = strategy.local_q_start
-    valid_len = strategy.local_q_len
-
-    # slice to valid length to be safe
-    current_rank_input_slice = x_norm[:, :valid_len]
-
-    # compute position ids for the current tokens
-    if position_ids is not None:
-        position_ids_for_rope_computation = position_ids[:, current_rank_token_global_start_idx:current_rank_token_global_start_idx + valid_len]
-    elif valid_len > 0:
-        position_ids_for_rope_computation = torch.arange(
-            current_rank_token_global_start_idx,
-            current_rank_token_global_start_idx + valid_len,
-            device=x_norm.device
-        ).unsqueeze(0).expand(batch_size, -1)
-    else:
-        position_ids_for_rope_computation = None
-
-    # compute QKV + RoPE for new tokens
-    if valid_len:
-        q, k, v = _compute_qkv_and_rope(
-            attn_module, current_rank_input_slice, position_ids_for_rope_computation
-        )
-    else:
-        nheads, emb_kq_per_head, emb_v_per_head = attn_module.nheads, attn_module.emb_kq_per_head, attn_module.emb_v_per_head
-        q = k = torch.empty((batch_size, nheads, 0, emb_kq_per_head), device=x_norm.device, dtype=x_norm.dtype)
-        v = torch.empty((batch_size, nheads, 0, emb_v_per_head), device=x_norm.device, dtype=x_norm.dtype)
-
-    scale = attn_module.scale_factor or math.sqrt(attn_module.emb_kq_per_head)
-    accum_dtype = torch.float32
-
-    # main ring attention with pass-KV
-    out = _compute_attention_ring_pass_kv(
-        q, k, v, mask, strategy, current_rank_token_global_start_idx, valid_len, scale, accum_dtype, causal
-    )
-
-    if valid_len:
-        proj = out.transpose(1, 2).reshape(batch_size, valid_len, -1)
-        out = attn_module.dense(proj)
-    else:
-        out = torch.empty((batch_size, 0, emb_dim), device=x_norm.device, dtype=x_norm.dtype)
-
-    # Return cache if requested
-    if use_cache:
-        return out, (k, v)
-    else:
-        return out
-
-
-def _compute_qkv_and_rope(
-    attn: MultiHeadAttention,
-    x: Tensor,
-    rope_position_ids: Optional[Tensor]
-) -> Tuple[Tensor, Tensor, Tensor]:
-    batch_size, seq_len, _ = x.shape # x is current_rank_input_slice, so seq_len is valid_len for this rank
-    q_proj, k_proj, v_proj = attn.in_proj(x, None, None)
-    nheads, kvheads = attn.nheads, attn.kvheads
-    emb_kq_per_head, emb_v_per_head = attn.emb_kq_per_head, attn.emb_v_per_head
-
-    # reshape & apply RoPE if needed
-    q = q_proj.view(batch_size, seq_len, nheads, emb_kq_per_head)
-    k = k_proj.view(batch_size, seq_len, kvheads, emb_kq_per_head)
-    v = v_proj.view(batch_size, seq_len, kvheads, emb_v_per_head)
-    if attn.position_encoder and seq_len:
-        assert rope_position_ids is not None
-        valid_rope_pos_mask = rope_position_ids.ne(-1)
-        if valid_rope_pos_mask.any():
-            rope_internal_max_seq_len = getattr(attn.position_encoder, "max_seq_len", 2048)
-            clamped_rope_ids = rope_position_ids.clamp(0, rope_internal_max_seq_len - 1)
-            q, k = attn.position_encoder.adjusted_qk(q, k, clamped_rope_ids, past_kv_state=None)
-
-    q, k, v = [x_tensor.permute(0, 2, 1, 3) for x_tensor in (q, k, v)]
-    if nheads != kvheads:
-        kv_to_q_head_ratio = nheads // kvheads
-        k = k.repeat_interleave(kv_to_q_head_ratio, dim=1)
-        v = v.repeat_interleave(kv_to_q_head_ratio, dim=1)
-    return q, k, v
-
-
-def _online_softmax_update(
-    attn_weights: Tensor,
-    v_block: Tensor,
-    numerator: Tensor,
-    denominator: Tensor,
-    prev_max_score: Tensor,
-) -> Tuple[Tensor, Tensor, Tensor]:
-    """
-    Online softmax update for a single block of attention.
-    """
-    # Find max in current block
-    block_max = attn_weights.max(dim=-1, keepdim=True).values
-
-    # Update global max
-    new_max_score = torch.maximum(prev_max_score, block_max)
-    # Correction factor for previous accumulations
-    correction = torch.exp(prev_max_score - new_max_score)
-    # Exp weights for current block (shifted by new max)
-    exp_weights = torch.exp(attn_weights - new_max_score)
-    # Update numerator and denominator with correction
-    numerator = (numerator * correction) + torch.matmul(exp_weights, v_block)
-    denominator = (denominator * correction) + exp_weights.sum(dim=-1, keepdim=True)
-
-    return numerator, denominator, new_max_score
-
-
-def _print_stream_info(strategy):
-    """Print stream info once per forward pass (rank 0 only)."""
-    if strategy.rank != 0:
-        return
-
-    default_stream = torch.cuda.current_stream()
-    streams_different = strategy._comm_stream != default_stream
-    print(f"[Ring Attention] Using separate streams: {streams_different}")
-
-
-def _has_offdiag_contribution(strategy: RingAttentionStrategy, q_start: int, q_len: int, causal: bool) -> bool:
-    """
-    Check if any off-diagonal block will CONTRIBUTE (not just exist).
-
-    With causal masking, an off-diagonal block is fully masked when:
-        k_start > q_end  (all keys are "future" relative to all queries)
+    Run `attn_module` on this rank's shard `x_norm` with the "ring" attention op.
 
-    For 2 GPUs:
-        - Rank 0: q_end = N/2-1, off-diag k_start = N/2 → k_start > q_end → MASKED
-        - Rank 1: q_end = N-1,   off-diag k_start = 0   → k_start ≤ q_end → CONTRIBUTES
-
-    Returns True if merging is needed (can't use Flash Attention shortcut).
+    Inside a model distributed with `RingAttentionStrategy` this happens
+    automatically; this helper is for driving a single attention module directly
+    (e.g. in benchmarks). `position_ids` cover the global sequence and are sliced
+    to this rank's shard.
     """
-    if strategy.world_size == 1:
-        return False
-    if not causal:
-        return True  # All blocks contribute in non-causal
-
-    q_end = q_start + q_len - 1
-
-    # Check each other rank's K block
-    for i in range(1, strategy.world_size):
-        source_rank = (strategy.rank - i) % strategy.world_size
-        k_start = strategy.block_starts[source_rank]
-        # If k_start <= q_end, some K positions are not masked → contributes
-        if k_start <= q_end:
-            return True
-    return False
+    strategy._ring_plans.clear()
+    strategy._hop = 0
+    strategy._begin_forward()
+    if strategy.tracer is not None:
+        strategy.tracer.begin_layer()
+    output = attn_module(
+        x_norm,
+        position_ids=strategy.local_position_ids(
+            position_ids, x_norm.size(0), x_norm.device
+        ),
+        use_cache=use_cache,
+        attn_name="ring",
+        ring_strategy=strategy,
+        mask=mask,
+        is_causal_mask=causal,
+    )
+    strategy._end_forward()
+    if strategy.tracer is not None:
+        strategy.tracer.end_layer()
+    return output
 
 
 def _compute_attention_ring_pass_kv(
     q: Tensor,
     k: Tensor,
     v: Tensor,
-    mask: Optional[Tensor],
+    mask: Optional[Union[Tensor, RingMask]],
     strategy: RingAttentionStrategy,
     q_start: int,
     num_valid_tokens: int,
     scale: float,
     accum_dtype: torch.dtype,
     causal: bool,
+    sliding_window: Optional[int] = None,
+    position_bias: Optional[Callable[[Tensor, Tensor], Tensor]] = None,
+    dropout_p: float = 0.0,
+    plan: Optional[RingPlan] = None,
 ) -> Tensor:
     """
     Main ring loop: overlap async KV communication with attention compute.
     Uses online softmax to merge results across heterogeneous shards.
-    """
-    global _layer_call_counter, _printed_stream_info, _total_compute_ms, _total_comm_ms, _total_bytes
 
-    batch_size, nheads, _, emb_v = q.shape[0], q.shape[1], q.shape[2], v.shape[-1]
+    Each block's visible key range is taken from a `RingMask` (built from `causal`
+    when a dense or no mask is given): fully masked blocks are skipped and partially
+    masked ones are trimmed before compute.
+
+    `k` and `v` may have fewer heads than `q` (grouped-query attention); they are
+    passed around the ring compact and shared by the query heads at compute time.
+
+    With a causal `sliding_window` (given directly or on the `RingMask`), only the
+    KV tails other ranks can see are sent and the ring stops once every rank has
+    received the blocks overlapping its windows, so comm and compute per rank are
+    O(window) rather than O(N).
 
+    `position_bias(query_indices, key_indices)` returns an additive bias for one
+    block, so relative position schemes (MPNet) work without a dense mask. Biased
+    and dense-masked blocks take the naive path.
+
+    The hop schedule (block offsets, skipped blocks, index tensors, mask slices,
+    peers and receive buffers) comes from `plan`, which `_ring_compute_op` builds
+    once per forward pass and shares between layers; it is built here if not given
+    or if it was built for another mask or shard layout.
+    """
     # Online softmax accumulators (FP32)
-    numerator = torch.zeros((batch_size, nheads, num_valid_tokens, emb_v), device=q.device, dtype=accum_dtype)
-    denominator = torch.zeros((batch_size, nheads, num_valid_tokens, 1), device=q.device, dtype=accum_dtype)
-    max_score = torch.full((batch_size, nheads, num_valid_tokens, 1), float("-inf"), device=q.device, dtype=accum_dtype)
+    stats = _init_stats(q, v, num_valid_tokens, accum_dtype)
 
-    # Cast inputs once
+    # Cast queries once; K/V travel in their own dtype (or `strategy.kv_compression`)
+    # and are cast block by block at compute
     q_cast = q.to(accum_dtype)
-    cur_k, cur_v = k.to(accum_dtype), v.to(accum_dtype)
+    cur_k, cur_v = k, v
     cur_len = cur_k.shape[2]
 
+    ring_mask, dense_mask = _ring_masks(mask, causal, sliding_window)
+    key = _plan_key(strategy, mask, causal, sliding_window)
+    if plan is None or not plan.matches(key):
+        plan = build_ring_plan(
+            strategy, ring_mask, dense_mask, q.device, accum_dtype, key=key
+        )
+
     # Global indices for causal masking
-    query_indices = torch.arange(q_start, q_start + num_valid_tokens, device=q.device)
+    query_indices = plan.query_indices
+
+    # windowed ring: a prefix or non-causal mask can see past the window of the
+    # preceding ranks, so those keep the full ring (blocks are still skipped)
+    ring_window = plan.window
+    num_steps = plan.num_steps
 
-    # Timing accumulators
-    PROFILE = True
+    # Timing accumulators (CUDA events, so only on GPU), opt-in via strategy.profile
+    PROFILE = strategy.profile and q.is_cuda
     total_bytes_transferred = 0
     comm_events = []  # List of (start_event, end_event) tuples
     compute_events = []  # List of (start_event, end_event) tuples
-    diag_compute_events = []  # (start, end) for diagonal block compute
-    offdiag_compute_events = []  # (start, end) for off-diagonal block compute
-
-    # Track layer for printing
-    _layer_call_counter += 1
-    current_layer = _layer_call_counter
-    should_print = (current_layer == 1)  # Only print first layer
-
-    # Print stream info once per forward pass
-    if not _printed_stream_info:
-        _printed_stream_info = True
-        _print_stream_info(strategy)
-
-    # DEBUG: Test if Triton works without NCCL communication
-    _DEBUG_DISABLE_COMM = False  # Set to True to test Triton without comm
 
     # Main Ring Loop
-    for i in range(strategy.world_size):
+    for i in range(num_steps):
         # 1. Start async comm for next iteration (overlaps with compute)
         comm_start_event = None
         reqs, recv_k, recv_v, recv_len = None, None, None, None
 
-        # Track what is being computed this iteration
-        did_diag_compute = False
-        did_offdiag_compute = False
-
-        if i < strategy.world_size - 1 and not _DEBUG_DISABLE_COMM:
+        if i < num_steps - 1:
+            send_k, send_v, send_len = cur_k, cur_v, cur_len
+            if i == 0 and ring_window is not None:
+                # only the tail of the local block is visible to later ranks
+                span_start, send_len = plan.send_span
+                send_k = cur_k[:, :, span_start - q_start:]
+                send_v = cur_v[:, :, span_start - q_start:]
             reqs, recv_k, recv_v, recv_len, comm_start_event = strategy.ring_shift_kv_async(
-                cur_k, cur_v, cur_len, iteration=i, enable_timing=PROFILE
+                send_k, send_v, send_len, iteration=i, enable_timing=PROFILE, plan=plan,
             )
 
         # Record compute start event on default stream
@@ -390,69 +349,28 @@ def _compute_attention_ring_pass_kv(
             compute_start.record()
 
         # 2. Identify block source and offset
-        source_rank = (strategy.rank - i) % strategy.world_size
-        block_offset = strategy.block_starts[source_rank]
-        is_diagonal = (i == 0)  # Diagonal block: Q and K are from same rank's tokens
+        block = plan.blocks[i]
 
         # 3. Compute attention on current block using Triton
-        if num_valid_tokens > 0 and cur_len > 0:
-            k_start = block_offset
-            q_end = q_start + num_valid_tokens - 1
-
-            # Skip block ONLY if fully masked by causality
-            is_fully_masked = causal and (k_start > q_end)
-
-            if not is_fully_masked:
-                key_indices = torch.arange(block_offset, block_offset + cur_len, device=q.device)
-
-                # Correctly slice mask for this specific block [Local Q, Remote K]
-                mask_slice = None
-                if mask is not None:
-                    m_q_start = q_start
-                    m_q_end = q_start + num_valid_tokens
-                    m_k_start = block_offset
-                    m_k_end = block_offset + cur_len
-                    if mask.ndim >= 2:
-                        mask_slice = mask[..., m_q_start:m_q_end, m_k_start:m_k_end]
-
-                # This ensures consistent timing and math across all ranks
-                z_block, l_block, m_block = _block_softmax_stats(
-                    q_cast, cur_k, cur_v,
-                    query_indices, key_indices,
-                    scale, mask_slice, causal
-                )
-
-                # Merge this block's stats into the global accumulator
-                numerator, denominator, max_score = _online_softmax_merge_stats(
-                    z_block, l_block, m_block,
-                    numerator, denominator, max_score
-                )
-
-                if is_diagonal:
-                    did_diag_compute = True
-                else:
-                    did_offdiag_compute = True
-
+        stats, _ = _attend_block(
+            q_cast, cur_k, cur_v, q_start, block.offset, query_indices, stats,
+            scale, causal, ring_mask, dense_mask, position_bias, block, dropout_p=dropout_p, tracer=strategy.tracer,
+        )
         # Record compute end event on DEFAULT stream
         if compute_start is not None and compute_end is not None:
             compute_end.record()
             compute_events.append((compute_start, compute_end))
 
-            if did_diag_compute:
-                diag_compute_events.append((compute_start, compute_end))
-            elif did_offdiag_compute:
-                offdiag_compute_events.append((compute_start, compute_end))
-
         # 4. Wait for comm and get new K,V for next iteration
-        if i < strategy.world_size - 1 and not _DEBUG_DISABLE_COMM:
+        if i < num_steps - 1:
             assert reqs is not None and recv_k is not None and recv_v is not None and recv_len is not None
             cur_k, cur_v, cur_len, comm_end_event, sync_event = strategy.ring_shift_kv_wait(
                 reqs, recv_k, recv_v, recv_len, enable_timing=PROFILE
             )
 
             if PROFILE:
-                total_bytes_transferred += cur_k.numel() * cur_k.element_size()
-                total_bytes_transferred += cur_v.numel() * cur_v.element_size()
+                total_bytes_transferred += kv_compression.wire_bytes(cur_k, strategy.kv_compression)
+                total_bytes_transferred += kv_compression.wire_bytes(cur_v, strategy.kv_compression)
                 if comm_start_event and comm_end_event:
                     comm_events.append((comm_start_event, comm_end_event))
 
@@ -463,106 +381,615 @@ def _compute_attention_ring_pass_kv(
             # Slice to valid length
             cur_k = cur_k[:, :, :cur_len].contiguous()
             cur_v = cur_v[:, :, :cur_len].contiguous()
-            cur_k, cur_v = cur_k.to(accum_dtype), cur_v.to(accum_dtype)
 
-    # Synchronize and compute timing from CUDA events
-    torch.cuda.synchronize()
+        strategy._next_hop()
 
-    # Calculate actual times from CUDA events
-    total_comm_time_ms = 0.0
-    total_compute_time_ms = 0.0
-    total_offdiag_compute_ms = 0.0
-    total_diag_compute_ms = 0.0
+    # Synchronize and accumulate timing from CUDA events
+    if PROFILE:
+        torch.cuda.synchronize()
+        timings = strategy.timings
+        timings.layers += 1
+        timings.bytes += total_bytes_transferred
+        timings.comm_ms += sum(start.elapsed_time(end) for start, end in comm_events)
+        timings.compute_ms += sum(start.elapsed_time(end) for start, end in compute_events)
 
-    for start_evt, end_evt in comm_events:
-        total_comm_time_ms += start_evt.elapsed_time(end_evt)
+    return _finalize_stats(stats, q.dtype)
 
-    for start_evt, end_evt in compute_events:
-        total_compute_time_ms += start_evt.elapsed_time(end_evt)
 
-    for start_evt, end_evt in diag_compute_events:
-        total_diag_compute_ms += start_evt.elapsed_time(end_evt)
+def _compute_attention_ring_functional(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    mask: Optional[Union[Tensor, RingMask]],
+    strategy: RingAttentionStrategy,
+    q_start: int,
+    num_valid_tokens: int,
+    scale: float,
+    accum_dtype: torch.dtype,
+    causal: bool,
+    sliding_window: Optional[int] = None,
+    position_bias: Optional[Callable[[Tensor, Tensor], Tensor]] = None,
+    dropout_p: float = 0.0,
+    plan: Optional[RingPlan] = None,
+) -> Tensor:
+    """
+    Pass-KV ring for torch.compile. Each hop is a functional all-to-all
+    (`strategy.functional_shift_kv`) issued before the block's compute and
+    unpacked after it, so the wait lands behind the compute and Inductor can
+    overlap the two; there are no request handles, events, host synchronization
+    or module state to break the graph. The schedule comes from a `RingPlan`, so
+    every shape and index is static for a given shard layout.
+    """
+    stats = _init_stats(q, v, num_valid_tokens, accum_dtype)
+
+    q_cast = q.to(accum_dtype)
+    cur_k, cur_v = k, v
+    ring_mask, dense_mask = _ring_masks(mask, causal, sliding_window)
+    key = _plan_key(strategy, mask, causal, sliding_window)
+    if plan is None or not plan.matches(key):
+        plan = build_ring_plan(
+            strategy, ring_mask, dense_mask, q.device, accum_dtype, key=key
+        )
+
+    for i in range(plan.num_steps):
+        message = None
+        if i < plan.num_steps - 1:
+            send_k, send_v, send_len = cur_k, cur_v, cur_k.shape[2]
+            if i == 0 and plan.window is not None:
+                # only the tail of the local block is visible to later ranks
+                span_start, send_len = plan.send_span
+                send_k = cur_k[:, :, span_start - q_start:]
+                send_v = cur_v[:, :, span_start - q_start:]
+            message = strategy.functional_shift_kv(send_k, send_v, send_len, plan.msg_len)
+
+        block = plan.blocks[i]
+        stats, _ = _attend_block(
+            q_cast, cur_k, cur_v, q_start, block.offset, plan.query_indices, stats,
+            scale, causal, ring_mask, dense_mask, position_bias, block, dropout_p=dropout_p, tracer=strategy.tracer,
+        )
+
+        if message is not None:
+            cur_k, cur_v = strategy.functional_unpack_kv(
+                message, cur_k, cur_v, plan.msg_len, plan.recv_lens[i]
+            )
 
-    for start_evt, end_evt in offdiag_compute_events:
-        total_offdiag_compute_ms += start_evt.elapsed_time(end_evt)
+    return _finalize_stats(stats, q.dtype)
 
-    # Accumulate timing for summary
-    global _total_compute_ms, _total_comm_ms, _total_bytes
-    _total_compute_ms += total_compute_time_ms
-    _total_comm_ms += total_comm_time_ms
-    _total_bytes += total_bytes_transferred
 
-    # Print timing (only rank 1, first layer only)
-    if PROFILE and strategy.rank == 1 and should_print:
-        comm_bandwidth_gbps = (total_bytes_transferred / 1e9) / (total_comm_time_ms / 1000) if total_comm_time_ms > 0 else 0
+def _compute_attention_chunked_ring(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    mask: Optional[Union[Tensor, RingMask]],
+    strategy: RingAttentionStrategy,
+    q_start: int,
+    num_valid_tokens: int,
+    scale: float,
+    accum_dtype: torch.dtype,
+    causal: bool,
+    sliding_window: Optional[int] = None,
+    position_bias: Optional[Callable[[Tensor, Tensor], Tensor]] = None,
+    dropout_p: float = 0.0,
+) -> Tensor:
+    """
+    Pass-KV ring with every hop pipelined in `strategy.chunk_size` sub-chunks.
+
+    Each sub-chunk is its own P2P op. As soon as sub-chunk j of a block arrives it
+    is forwarded to the next rank, together with posting the receive of sub-chunk
+    j of the following block, and then attended to, so compute on sub-chunk j
+    overlaps the transfer of sub-chunk j + 1. Only one sub-chunk per hop is exposed
+    instead of a whole block. Online softmax makes the per-chunk merges exact.
+    Sliding windows shorten the ring as in `_compute_attention_ring_pass_kv`.
+
+    No `RingPlan`: it describes whole-block hops, while this schedule is made of
+    sub-chunks, so the spans and chunk lengths are recomputed every layer from
+    `strategy.kv_span()` and `kv_chunks()` (integer arithmetic on the host).
+    """
+    stats = _init_stats(q, v, num_valid_tokens, accum_dtype)
 
-        print(f"\n[Ring Attention layer={current_layer}] tokens={num_valid_tokens}, world_size={strategy.world_size}")
-        print(f"  comm: {total_comm_time_ms:6.2f}ms | compute: {total_compute_time_ms:6.2f}ms")
-        print(f"  diag: {total_diag_compute_ms:6.2f} ms | offdiag: {total_offdiag_compute_ms:6.4f} ms")
-        print(f"  data: {total_bytes_transferred/1e6:.2f} MB | bandwidth: {comm_bandwidth_gbps:.2f} GB/s")
-        if total_comm_time_ms < total_compute_time_ms:
-            print(f"  comm hidden behind compute")
+    q_cast = q.to(accum_dtype)
+    # sub-chunks travel in the K/V dtype and are cast one by one at compute
+    local_k, local_v = k, v
+    query_indices = torch.arange(q_start, q_start + num_valid_tokens, device=q.device)
+    ring_mask, dense_mask = _ring_masks(mask, causal, sliding_window)
+
+    ring_window = None
+    if ring_mask.causal and ring_mask.prefix_len == 0:
+        ring_window = ring_mask.sliding_window
+    num_steps = strategy.ring_steps(ring_window)
+    world_size, rank = strategy.world_size, strategy.rank
+
+    def post(send_k, send_v, recv_len):
+        # (reqs, recv_k, recv_v, recv_len), as ring_shift_kv_wait takes them
+        return strategy.chunk_shift_kv_async(send_k, send_v, recv_len)[:4]
+
+    # in-flight (reqs, recv_k, recv_v, recv_len) per sub-chunk of the next block
+    incoming = []
+    for i in range(num_steps):
+        current, incoming = incoming, []
+        source_rank = (rank - i) % world_size
+        forward = i < num_steps - 1
+        next_len = 0
+        if forward:
+            next_len = strategy.kv_span((rank - i - 1) % world_size, ring_window)[1]
+        recv_chunks = strategy.kv_chunks(next_len)
+
+        if i == 0:
+            # the local block is at hand: post all of its chunks, then attend to it
+            span_start, span_len = strategy.kv_span(rank, ring_window)
+            offset = span_start - q_start
+            sent = strategy.kv_chunks(span_len) if forward else []
+            for j in range(max(len(sent), len(recv_chunks))):
+                lo, length = sent[j] if j < len(sent) else (0, 0)
+                incoming.append(post(
+                    local_k[:, :, offset + lo:offset + lo + length],
+                    local_v[:, :, offset + lo:offset + lo + length],
+                    recv_chunks[j][1] if j < len(recv_chunks) else 0,
+                ))
+            stats, _ = _attend_block(
+                q_cast, local_k, local_v, q_start, q_start, query_indices, stats,
+                scale, causal, ring_mask, dense_mask, position_bias, dropout_p=dropout_p, tracer=strategy.tracer,
+            )
+            strategy._next_hop()
+            continue
+
+        block_offset, block_len = strategy.kv_span(source_rank, ring_window)
+        chunks = strategy.kv_chunks(block_len)
+        for j in range(max(len(current), len(recv_chunks))):
+            chunk = None
+            send_k, send_v = local_k[:, :, :0], local_v[:, :, :0]
+            if j < len(current):
+                chunk_k, chunk_v, chunk_len, _, sync_event = strategy.ring_shift_kv_wait(*current[j])
+                if sync_event is not None:
+                    torch.cuda.current_stream().wait_event(sync_event)
+                if chunk_len > 0:
+                    chunk = (chunk_k, chunk_v)
+                    if forward:
+                        send_k, send_v = chunk
+            if forward:
+                # forward this chunk and post the receive of the next block's
+                incoming.append(post(
+                    send_k, send_v, recv_chunks[j][1] if j < len(recv_chunks) else 0
+                ))
+            if chunk is not None:
+                stats, _ = _attend_block(
+                    q_cast, chunk[0], chunk[1], q_start, block_offset + chunks[j][0],
+                    query_indices, stats, scale, causal, ring_mask, dense_mask,
+                    position_bias, dropout_p=dropout_p, tracer=strategy.tracer,
+                )
+        strategy._next_hop()
+
+    return _finalize_stats(stats, q.dtype)
+
+
+def _compute_attention_prefetch_ring(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    mask: Optional[Union[Tensor, RingMask]],
+    strategy: RingAttentionStrategy,
+    q_start: int,
+    num_valid_tokens: int,
+    scale: float,
+    accum_dtype: torch.dtype,
+    causal: bool,
+    sliding_window: Optional[int] = None,
+    position_bias: Optional[Callable[[Tensor, Tensor], Tensor]] = None,
+    dropout_p: float = 0.0,
+) -> Tensor:
+    """
+    Pass-KV ring that runs up to `strategy.prefetch_depth` hops ahead.
+
+    Receives for the next `prefetch_depth` blocks are posted into their own buffers
+    before they are needed, and each block is forwarded to the next rank as soon
+    as it has arrived, before this rank attends to it. Sends and receives are
+    separate P2P ops, so a rank never waits for its neighbours' compute, only for
+    the data, and transient stragglers are absorbed by the posted buffers instead
+    of stalling the whole ring every hop. At most `prefetch_depth` blocks are in
+    flight in each direction.
+
+    This loop doesn't use a `RingPlan` either: up to `prefetch_depth` receive
+    buffers are live at once instead of the plan's two alternating sets, and the
+    block spans are cheap host-side `strategy.kv_span()` lookups per hop.
+    """
+    stats = _init_stats(q, v, num_valid_tokens, accum_dtype)
+
+    q_cast = q.to(accum_dtype)
+    # blocks and the prefetch buffers stay in the K/V dtype; cast per block at compute
+    local_k, local_v = k, v
+    query_indices = torch.arange(q_start, q_start + num_valid_tokens, device=q.device)
+    ring_mask, dense_mask = _ring_masks(mask, causal, sliding_window)
+
+    ring_window = None
+    if ring_mask.causal and ring_mask.prefix_len == 0:
+        ring_window = ring_mask.sliding_window
+    num_steps = strategy.ring_steps(ring_window)
+    world_size, rank, depth = strategy.world_size, strategy.rank, strategy.prefetch_depth
+
+    # posted receives by ring step, and sends not known to be complete yet
+    receives = {}
+    sends = []
+
+    def prefetch(step):
+        if step < num_steps:
+            recv_len = strategy.kv_span((rank - step) % world_size, ring_window)[1]
+            receives[step] = strategy.prefetch_kv_recv(local_k, local_v, recv_len)
+
+    def wait_send(reqs):
+        # the buffers of a completed send can be reused; not a hop of the ring
+        if reqs is not None:
+            strategy._wait(reqs, "send_wait")
+
+    def send(send_k, send_v):
+        sends.append(strategy.prefetch_kv_send(send_k, send_v))
+        # bound the send buffers in flight
+        if len(sends) > depth:
+            wait_send(sends.pop(0))
+
+    if num_steps > 1:
+        # only the tail of the local block is visible to later ranks
+        span_start, _ = strategy.kv_span(rank, ring_window)
+        send(local_k[:, :, span_start - q_start:], local_v[:, :, span_start - q_start:])
+        for step in range(1, depth + 1):
+            prefetch(step)
+    stats, _ = _attend_block(
+        q_cast, local_k, local_v, q_start, q_start, query_indices, stats,
+        scale, causal, ring_mask, dense_mask, position_bias, dropout_p=dropout_p, tracer=strategy.tracer,
+    )
+    strategy._next_hop()
+
+    for i in range(1, num_steps):
+        cur_k, cur_v, _, _, sync_event = strategy.ring_shift_kv_wait(*receives.pop(i))
+        if sync_event is not None:
+            torch.cuda.current_stream().wait_event(sync_event)
+        if i < num_steps - 1:
+            send(cur_k, cur_v)
+        prefetch(i + depth)
+        stats, _ = _attend_block(
+            q_cast, cur_k, cur_v, q_start,
+            strategy.kv_span((rank - i) % world_size, ring_window)[0],
+            query_indices, stats, scale, causal, ring_mask, dense_mask, position_bias, dropout_p=dropout_p, tracer=strategy.tracer,
+        )
+        strategy._next_hop()
+
+    for reqs in sends:
+        wait_send(reqs)
+
+    return _finalize_stats(stats, q.dtype)
+
+
+def _compute_attention_hierarchical_ring(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    mask: Optional[Union[Tensor, RingMask]],
+    strategy: HierarchicalRingAttentionStrategy,
+    q_start: int,
+    num_valid_tokens: int,
+    scale: float,
+    accum_dtype: torch.dtype,
+    causal: bool,
+    sliding_window: Optional[int] = None,
+    position_bias: Optional[Callable[[Tensor, Tensor], Tensor]] = None,
+    dropout_p: float = 0.0,
+) -> Tensor:
+    """
+    Two-level ring loop for `HierarchicalRingAttentionStrategy`: one inner ring per
+    node's blocks, with the outer (inter-node) transfer of the next node's block
+    started at the beginning of each inner ring and only waited on at its end.
+    Blocks are merged with the same online softmax as the flat ring.
+
+    The two-level schedule is not a `RingPlan` one; block offsets come from
+    `strategy.block_source()` per hop, and only the query index tensor is
+    rebuilt per layer.
+    """
+    stats = _init_stats(q, v, num_valid_tokens, accum_dtype)
+
+    # K/V cross both rings in their own dtype and are cast block by block at compute
+    q_cast = q.to(accum_dtype)
+    cur_k, cur_v = k, v
+    cur_len = cur_k.shape[2]
+    query_indices = torch.arange(q_start, q_start + num_valid_tokens, device=q.device)
+    ring_mask, dense_mask = _ring_masks(mask, causal, sliding_window)
+
+    outer = None
+    for i in range(strategy.world_size):
+        outer_step, inner_step = divmod(i, strategy.ranks_per_node)
+        if inner_step == 0 and outer_step < strategy.num_nodes - 1:
+            outer = strategy.outer_shift_kv_async(cur_k, cur_v, cur_len, outer_step)
+        inner = None
+        if inner_step < strategy.ranks_per_node - 1:
+            inner = strategy.inner_shift_kv_async(cur_k, cur_v, cur_len, i)
+
+        block_offset = strategy.block_starts[strategy.block_source(i)]
+        stats, _ = _attend_block(
+            q_cast, cur_k, cur_v, q_start, block_offset, query_indices, stats,
+            scale, causal, ring_mask, dense_mask, position_bias, dropout_p=dropout_p, tracer=strategy.tracer,
+        )
+
+        if inner is not None:
+            reqs, recv_k, recv_v, recv_len, _ = inner
+            cur_k, cur_v, cur_len, _, sync_event = strategy.ring_shift_kv_wait(
+                reqs, recv_k, recv_v, recv_len
+            )
+        elif outer is not None:
+            reqs, recv_k, recv_v, recv_len, _ = outer
+            cur_k, cur_v, cur_len, _, sync_event = strategy.outer_shift_kv_wait(
+                reqs, recv_k, recv_v, recv_len
+            )
+            outer = None
         else:
-            print(f"  comm is bottleneck")
+            strategy._next_hop()
+            continue
+        if sync_event is not None:
+            torch.cuda.current_stream().wait_event(sync_event)
+        cur_k = cur_k[:, :, :cur_len].contiguous()
+        cur_v = cur_v[:, :, :cur_len].contiguous()
+        strategy._next_hop()
 
-    if num_valid_tokens == 0:
-        return torch.empty((batch_size, nheads, 0, emb_v), device=q.device, dtype=q.dtype)
+    return _finalize_stats(stats, q.dtype)
 
-    return (numerator / (denominator + 1e-8)).to(q.dtype)
 
-def _compute_attention_ring_pass_q():
-    return
+def _compute_attention_bidirectional_ring(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    mask: Optional[Union[Tensor, RingMask]],
+    strategy: RingAttentionStrategy,
+    q_start: int,
+    num_valid_tokens: int,
+    scale: float,
+    accum_dtype: torch.dtype,
+    causal: bool,
+    sliding_window: Optional[int] = None,
+    position_bias: Optional[Callable[[Tensor, Tensor], Tensor]] = None,
+    dropout_p: float = 0.0,
+) -> Tensor:
+    """
+    Bidirectional ring loop: KV blocks travel clockwise and counter-clockwise
+    concurrently, each direction over about half of the ring
+    (`strategy.bidirectional_steps()`), so a full-duplex link carries a block each
+    way per hop and the ring takes world_size // 2 hops instead of world_size - 1.
+    Both blocks received at a step are merged with the same online softmax as the
+    one-way ring.
+
+    The `RingPlan` of the one-way ring doesn't describe the two directions, so
+    block offsets are read from `strategy.block_starts` as they arrive.
+    """
+    stats = _init_stats(q, v, num_valid_tokens, accum_dtype)
 
-def _attn_scores(
-    Q: Tensor,
-    K: Tensor,
-    query_indices: Tensor, # global indices for queries in Q
-    key_indices: Tensor,   # global indices for keys in K
+    q_cast = q.to(accum_dtype)
+    query_indices = torch.arange(q_start, q_start + num_valid_tokens, device=q.device)
+    ring_mask, dense_mask = _ring_masks(mask, causal, sliding_window)
+    rank, world_size = strategy.rank, strategy.world_size
+    # hops of each direction; the clockwise ring is the longer one
+    hops = strategy.bidirectional_steps()
+
+    # (k, v, len) held by the clockwise and by the counter-clockwise ring; blocks
+    # travel in their own dtype and are cast at compute
+    local = (k, v, k.shape[2])
+    blocks = [local, local]
+
+    for i in range(hops[0] + 1):
+        pending = [None, None]
+        for reverse, (bk, bv, blen) in enumerate(blocks):
+            if i < hops[reverse]:
+                pending[reverse] = strategy.bidirectional_shift_kv_async(
+                    bk, bv, blen, iteration=i, reverse=bool(reverse)
+                )
+
+        # the local block once, then the block each direction brought this step
+        for reverse in range(2 if i > 0 else 1):
+            if i > hops[reverse]:
+                continue
+            source_rank = (rank + (i if reverse else -i)) % world_size
+            bk, bv, _ = blocks[reverse]
+            stats, _ = _attend_block(
+                q_cast, bk, bv, q_start, strategy.block_starts[source_rank],
+                query_indices, stats, scale, causal, ring_mask, dense_mask,
+                position_bias, dropout_p=dropout_p, tracer=strategy.tracer,
+            )
+
+        for reverse, shift in enumerate(pending):
+            if shift is None:
+                continue
+            reqs, recv_k, recv_v, recv_len, _ = shift
+            recv_k, recv_v, recv_len, _, sync_event = strategy.ring_shift_kv_wait(
+                reqs, recv_k, recv_v, recv_len,
+                stream=strategy._reverse_stream if reverse else None,
+            )
+            if sync_event is not None:
+                torch.cuda.current_stream().wait_event(sync_event)
+            blocks[reverse] = (
+                recv_k[:, :, :recv_len].contiguous(),
+                recv_v[:, :, :recv_len].contiguous(),
+                recv_len,
+            )
+        strategy._next_hop()
+
+    return _finalize_stats(stats, q.dtype)
+
+
+def _compute_attention_allgather(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    mask: Optional[Union[Tensor, RingMask]],
+    strategy: RingAttentionStrategy,
+    q_start: int,
+    num_valid_tokens: int,
     scale: float,
-    mask: Optional[Tensor],
+    accum_dtype: torch.dtype,
     causal: bool,
+    sliding_window: Optional[int] = None,
+    position_bias: Optional[Callable[[Tensor, Tensor], Tensor]] = None,
+    dropout_p: float = 0.0,
 ) -> Tensor:
-    batch_size, nheads, num_q, _ = Q.shape # num_q is num_queries_in_block for Q
-    num_k = K.shape[2]          # num_k is current_block_k_len for K
-    if num_q == 0 or num_k == 0:
-        return Q.new_empty((batch_size, nheads, num_q, num_k))
+    """
+    All-gather context parallelism: gather every rank's compact K/V once, then
+    attend locally. The local block is computed while the gather is in flight;
+    the preceding and following ranks' keys are then attended as one block each,
+    so under a causal mask the following keys are skipped entirely.
+    """
+    stats = _init_stats(q, v, num_valid_tokens, accum_dtype)
 
-    scores = torch.matmul(Q / scale, K.transpose(-2, -1))
-    if mask is not None:
-        scores = scores + mask.to(scores.dtype)
-    if causal:
-        # build a [1,1,q_len,k_len] mask where key_pos > query_pos
-        future_mask = (key_indices[None, :] > query_indices[:, None])
-        future_mask = future_mask.unsqueeze(0).unsqueeze(0)
-        scores = scores.masked_fill(future_mask, float("-inf"))
-    return scores
+    q_cast = q.to(accum_dtype)
+    query_indices = torch.arange(q_start, q_start + num_valid_tokens, device=q.device)
+    ring_mask, dense_mask = _ring_masks(mask, causal, sliding_window)
+
+    pending = strategy.all_gather_kv_async(k, v) if strategy.world_size > 1 else None
+    stats, _ = _attend_block(
+        q_cast, k.to(accum_dtype), v.to(accum_dtype), q_start, q_start, query_indices,
+        stats, scale, causal, ring_mask, dense_mask, position_bias, dropout_p=dropout_p, tracer=strategy.tracer,
+    )
+
+    if pending is not None:
+        gathered_k, gathered_v = strategy.all_gather_kv_wait(*pending)
+        rank = strategy.rank
+        for ranks, block_offset in (
+            (range(rank), 0),
+            (range(rank + 1, strategy.world_size), q_start + strategy.shard_len(rank)),
+        ):
+            if len(ranks) == 0:
+                continue
+            block_k = torch.cat([gathered_k[r] for r in ranks], dim=2).to(accum_dtype)
+            block_v = torch.cat([gathered_v[r] for r in ranks], dim=2).to(accum_dtype)
+            stats, _ = _attend_block(
+                q_cast, block_k, block_v, q_start, block_offset, query_indices, stats,
+                scale, causal, ring_mask, dense_mask, position_bias, dropout_p=dropout_p, tracer=strategy.tracer,
+            )
+
+    return _finalize_stats(stats, q.dtype)
+
+
+def _init_stats(
+    q: Tensor, v: Tensor, num_valid_tokens: int, accum_dtype: torch.dtype
+) -> Tuple[Tensor, Tensor, Tensor]:
+    """Empty online softmax accumulators (numerator, denominator, max) of this rank's queries."""
+    shape = (q.shape[0], q.shape[1], num_valid_tokens)
+    return (
+        torch.zeros(shape + (v.shape[-1],), device=q.device, dtype=accum_dtype),
+        torch.zeros(shape + (1,), device=q.device, dtype=accum_dtype),
+        torch.full(shape + (1,), float("-inf"), device=q.device, dtype=accum_dtype),
+    )
+
+
+def _finalize_stats(stats: Tuple[Tensor, Tensor, Tensor], dtype: torch.dtype) -> Tensor:
+    """The attention output of merged online softmax `stats`, in `dtype`."""
+    numerator, denominator, _ = stats
+    return (numerator / (denominator + 1e-8)).to(dtype)
+
+
+def _ring_masks(
+    mask: Optional[Union[Tensor, RingMask]],
+    causal: bool,
+    sliding_window: Optional[int],
+) -> Tuple[RingMask, Optional[Tensor]]:
+    """The compact mask descriptor and, for a dense (legacy) mask, the 4D tensor to slice per block."""
+    if isinstance(mask, RingMask):
+        if sliding_window is not None and mask.sliding_window is None:
+            mask = dataclasses.replace(mask, sliding_window=sliding_window)
+        return mask, None
+    dense_mask = mask
+    # bs x q_len x kv_len -> bs x 1 x q_len x kv_len, same as sdpa
+    while dense_mask is not None and dense_mask.ndim < 4:
+        dense_mask = dense_mask.unsqueeze(1)
+    return RingMask(causal=causal, sliding_window=sliding_window), dense_mask
+
+
+def _attend_block(
+    q: Tensor,
+    k: Tensor,
+    v: Tensor,
+    q_start: int,
+    block_offset: int,
+    query_indices: Tensor,
+    stats: Tuple[Tensor, Tensor, Tensor],
+    scale: float,
+    causal: bool,
+    ring_mask: RingMask,
+    dense_mask: Optional[Tensor],
+    position_bias: Optional[Callable[[Tensor, Tensor], Tensor]],
+    block: Optional[RingBlock] = None,
+    dropout_p: float = 0.0,
+    tracer: Optional[Tracer] = None,
+) -> Tuple[Tuple[Tensor, Tensor, Tensor], bool]:
+    """
+    Merge the KV block starting at global position `block_offset` into the online
+    softmax `stats` (numerator, denominator, max). Returns the new stats and
+    whether anything was computed: fully masked blocks are skipped and partially
+    masked ones trimmed to their visible key range. A planned `block` supplies
+    the visible range, key indices and mask slice instead of computing them.
+    `dropout_p` drops attention probabilities of the block, see
+    `_block_softmax_stats_naive`.
+    """
+    num_q, cur_len = query_indices.numel(), k.shape[2]
+    if num_q == 0 or cur_len == 0:
+        return stats, False
+
+    if block is not None:
+        if block.skipped:
+            return stats, False
+        (k_lo, k_hi), key_indices, mask_slice = block.key_range, block.key_indices, block.mask_slice
+    else:
+        # Visible sub-range of this KV block; empty if fully masked
+        k_lo, k_hi = ring_mask.block_key_range(
+            q_start, q_start + num_q, block_offset, block_offset + cur_len
+        )
+        if k_lo >= k_hi:
+            return stats, False
+        key_indices = torch.arange(k_lo, k_hi, device=q.device)
+
+        # Correctly slice mask for this specific block [Local Q, Remote K]
+        mask_slice = None
+        if dense_mask is not None and dense_mask.ndim >= 2:
+            mask_slice = dense_mask[..., q_start:q_start + num_q, k_lo:k_hi]
+            if mask_slice.dtype == torch.bool:
+                mask_slice = torch.zeros(
+                    mask_slice.shape, device=q.device, dtype=q.dtype
+                ).masked_fill(~mask_slice, _MASK_VALUE)
+
+    block_k = k[:, :, k_lo - block_offset:k_hi - block_offset].to(q.dtype)
+    block_v = v[:, :, k_lo - block_offset:k_hi - block_offset].to(q.dtype)
+
+    if position_bias is not None:
+        bias = position_bias(query_indices, key_indices).to(q.dtype)
+        mask_slice = bias if mask_slice is None else mask_slice + bias
+
+    # This ensures consistent timing and math across all ranks
+    with trace_span(tracer, "compute", "compute", block=block_offset, keys=k_hi - k_lo):
+        z_block, l_block, m_block = _block_softmax_stats(
+            q, block_k, block_v,
+            query_indices, key_indices,
+            scale, mask_slice, causal, ring_mask, dropout_p
+        )
+
+    # Merge this block's stats into the global accumulator
+    with trace_span(tracer, "merge", "compute", block=block_offset):
+        stats = _online_softmax_merge_stats(z_block, l_block, m_block, *stats)
+    return stats, True
 
 
-def reset_layer_counter():
-    global _layer_call_counter, _printed_stream_info
-    global _total_compute_ms, _total_comm_ms, _total_bytes
-    _layer_call_counter = 0
-    _printed_stream_info = False
-    _total_compute_ms = 0.0
-    _total_comm_ms = 0.0
-    _total_bytes = 0
+def reset_layer_counter(strategy: RingAttentionStrategy):
+    """Reset the ring timings `strategy` accumulates while profiling."""
+    strategy.timings.reset()
 
 
-def print_timing_summary(rank: int = 0):
+def print_timing_summary(strategy: RingAttentionStrategy, rank: int = 0):
     if rank != 0:
         return
 
-    if _total_compute_ms == 0 and _total_comm_ms == 0:
+    timings = strategy.timings
+    if timings.compute_ms == 0 and timings.comm_ms == 0:
         return
 
-    num_layers = _layer_call_counter
-    comm_bandwidth_gbps = (_total_bytes / 1e9) / (_total_comm_ms / 1000) if _total_comm_ms > 0 else 0
+    comm_bandwidth_gbps = (timings.bytes / 1e9) / (timings.comm_ms / 1000) if timings.comm_ms > 0 else 0
 
-    print(f"\n[Ring Attention Summary] {num_layers} layers")
-    print(f"  comm (total):    {_total_comm_ms:8.2f}ms")
-    print(f"  compute (total): {_total_compute_ms:8.2f}ms")
-    print(f"  data: {_total_bytes/1e6:.2f} MB | bandwidth: {comm_bandwidth_gbps:.2f} GB/s")
-    if _total_comm_ms < _total_compute_ms:
+    print(f"\n[Ring Attention Summary] {timings.layers} layers")
+    print(f"  comm (total):    {timings.comm_ms:8.2f}ms")
+    print(f"  compute (total): {timings.compute_ms:8.2f}ms")
+    print(f"  data: {timings.bytes/1e6:.2f} MB | bandwidth: {comm_bandwidth_gbps:.2f} GB/s")
+    if timings.comm_ms < timings.compute_ms:
         print(f"  comm hidden behind compute")
     else:
         print(f"  comm is bottleneck")
@@ -595,13 +1022,15 @@ def _online_softmax_merge_stats(
 
 def _block_softmax_stats_naive(
     Q: Tensor,           # [B, H, Q_block, D_k]
-    K: Tensor,           # [B, H, K_block, D_k]
-    V: Tensor,           # [B, H, K_block, D_v]
+    K: Tensor,           # [B, H_kv, K_block, D_k]
+    V: Tensor,           # [B, H_kv, K_block, D_v]
     query_indices: Tensor,  # [Q_block] global positions
     key_indices: Tensor,    # [K_block] global positions
     scale: float,
     mask: Optional[Tensor],
     causal: bool,
+    ring_mask: Optional[RingMask] = None,
+    dropout_p: float = 0.0,
 ) -> Tuple[Tensor, Tensor, Tensor]:
     """
     Compute per-query block stats:
@@ -609,6 +1038,10 @@ def _block_softmax_stats_naive(
         l_block: sum_j exp(S_ij - m_block_i)
         z_block: sum_j exp(S_ij - m_block_i) * V_j
     using a naive matmul implementation.
+
+    With `dropout_p`, z_block only sums the kept keys, scaled by 1 / (1 - dropout_p),
+    while l_block sums all of them: once merged and normalized this is dropout
+    applied to the softmax probabilities, as in sdpa.
     """
     B, H, Q_len, Dk = Q.shape
     K_len = K.shape[2]
@@ -620,6 +1053,11 @@ def _block_softmax_stats_naive(
         z_block = Q.new_zeros((B, H, Q_len, Dv))
         return z_block, l_block, m_block
 
+    # grouped-query attention: each K/V head serves H // H_kv query heads
+    if K.shape[1] != H:
+        K = K.repeat_interleave(H // K.shape[1], dim=1)
+        V = V.repeat_interleave(H // V.shape[1], dim=1)
+
     # 1. logits
     scores = torch.matmul(Q / scale, K.transpose(-2, -1))  # [B, H, Q_len, K_len]
 
@@ -627,12 +1065,18 @@ def _block_softmax_stats_naive(
     if mask is not None:
         scores = scores + mask.to(scores.dtype)
 
-    if causal:
+    if ring_mask is not None:
+        allowed = ring_mask.block_mask(query_indices, key_indices)  # [B|1,1,Q,K]
+        scores = scores.masked_fill(~allowed, _MASK_VALUE)
+    elif causal:
         # future positions: key_idx > query_idx
         future_mask = (key_indices[None, :] > query_indices[:, None])  # [Q_len, K_len]
         future_mask = future_mask.unsqueeze(0).unsqueeze(0)            # [1,1,Q,K]
         scores = scores.masked_fill(future_mask, float("-inf"))
 
+    # fully masked rows keep a finite max so they merge with zero weight
+    scores = scores.clamp(min=_MASK_VALUE)
+
     # 3. m_block: per-query max
     m_block = scores.max(dim=-1, keepdim=True).values  # [B,H,Q,1]
 
@@ -641,6 +1085,9 @@ def _block_softmax_stats_naive(
     l_block = exp_scores.sum(dim=-1, keepdim=True)     # [B,H,Q,1]
 
     # 5. z_block: per-query weighted sum of V
+    if dropout_p > 0.0:
+        keep = torch.rand_like(exp_scores) >= dropout_p
+        exp_scores = exp_scores * keep / (1.0 - dropout_p)
     z_block = torch.matmul(exp_scores, V)              # [B,H,Q,Dv]
 
     return z_block, l_block, m_block
@@ -656,15 +1103,18 @@ def _block_softmax_stats(
     scale: float,
     mask: Optional[Tensor],
     causal: bool,
+    ring_mask: Optional[RingMask] = None,
+    dropout_p: float = 0.0,
 ) -> Tuple[Tensor, Tensor, Tensor]:
-    # Triton path
-    if _HAS_TRITON and Q.is_cuda:
-        # Always use Triton path to prevent deadlock from divergent code paths on ranks
+    # Triton path; it evaluates `ring_mask` in-kernel but can't apply a dense mask
+    # or dropout, which every rank either has or doesn't, so the choice is the same
+    # on all ranks
+    if _HAS_TRITON and Q.is_cuda and mask is None and dropout_p == 0.0:
         return block_softmax_stats_triton(
-            Q, K, V, query_indices, key_indices, scale, mask, causal
+            Q, K, V, query_indices, key_indices, scale, ring_mask, causal
         )
 
     # Fallback: pure PyTorch, correct but slower
     return _block_softmax_stats_naive(
-        Q, K, V, query_indices, key_indices, scale, mask, causal
+        Q, K, V, query_indices, key_indices, scale, mask, causal, ring_mask, dropout_p
     )
\ No newline at end of file
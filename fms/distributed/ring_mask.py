@@ -0,0 +1,233 @@
+"""
+Compact attention mask descriptors for ring attention.
+
+A dense ``[B, N, N]`` mask is quadratic in the global sequence length and cannot
+be materialized at long context. `RingMask` instead describes the mask by its
+structure (causality, padding spans, packed document ids, sliding window and a
+bidirectional prefix). The ring loop evaluates it one KV block at a time, uses
+`block_key_range()` to skip (or trim) blocks that are fully masked, and only
+ever builds the ``[B, 1, Q_local, K_block]`` boolean mask of the block being
+computed (or nothing at all on the Triton path, where the descriptor is
+evaluated inside the kernel).
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple, Union
+
+import torch
+from torch import Tensor
+
+
+@dataclass
+class RingMask:
+    """
+    Structural description of an attention mask over the global sequence.
+
+    Args
+    ----
+    causal : bool
+        If True, a query only attends to keys at the same or earlier positions.
+    valid_start : Tensor | None
+        ``[B]`` global index of the first non-pad token of each sequence.
+    valid_end : Tensor | None
+        ``[B]`` global index one past the last non-pad token of each sequence.
+        Together with `valid_start` this covers both left and right padding.
+        As with the masks built by `fms.utils.generation.pad_input_ids`, pad
+        queries only see pad keys and real queries only see real keys.
+    document_ids : Tensor | None
+        ``[B, N]`` (or ``[N]``, shared by the batch) id of the packed document
+        each global position belongs to. A query only attends to keys of its
+        own document. Blocks are only skipped based on document ids when the
+        ids are non-decreasing along the sequence, as they are for packing.
+    sliding_window : int | None
+        If set, a query at position ``i`` only attends to keys ``j`` with
+        ``|i - j| < sliding_window``.
+    prefix_len : int
+        Number of leading positions attended bidirectionally (prefix-LM). Keys
+        in the prefix are visible to every query regardless of `causal` and
+        `sliding_window`.
+    """
+
+    causal: bool = True
+    valid_start: Optional[Tensor] = None
+    valid_end: Optional[Tensor] = None
+    document_ids: Optional[Tensor] = None
+    sliding_window: Optional[int] = None
+    prefix_len: int = 0
+
+    # host-side copies used for block skipping, filled lazily (one D2H copy per
+    # mask, not one per block)
+    _valid_spans: Optional[List[Tuple[int, int]]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _docs_cpu: Optional[Tensor] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _docs_sorted: bool = field(default=False, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if (self.valid_start is None) != (self.valid_end is None):
+            raise ValueError("valid_start and valid_end must be given together")
+        if self.sliding_window is not None and self.sliding_window <= 0:
+            raise ValueError(
+                f"sliding_window must be positive, got {self.sliding_window}"
+            )
+        if self.document_ids is not None and self.document_ids.dim() == 1:
+            self.document_ids = self.document_ids.unsqueeze(0)
+
+    @classmethod
+    def from_padding(
+        cls,
+        lengths: Union[Sequence[int], Tensor],
+        seq_len: int,
+        padding_side: str = "left",
+        **kwargs,
+    ) -> "RingMask":
+        """
+        Build a mask for a batch padded to `seq_len` as done by
+        `fms.utils.generation.pad_input_ids`.
+
+        Args:
+            lengths: number of real (non-pad) tokens of each sequence
+            seq_len: padded global sequence length
+            padding_side: "left" or "right"
+            kwargs: remaining `RingMask` fields (e.g. causal=False)
+        """
+        lengths_t = torch.as_tensor(lengths, dtype=torch.long)
+        if padding_side == "left":
+            valid_start = seq_len - lengths_t
+            valid_end = torch.full_like(lengths_t, seq_len)
+        elif padding_side == "right":
+            valid_start = torch.zeros_like(lengths_t)
+            valid_end = lengths_t
+        else:
+            raise ValueError(f"padding_side must be 'left' or 'right', got {padding_side!r}")
+        return cls(valid_start=valid_start, valid_end=valid_end, **kwargs)
+
+    @property
+    def has_padding(self) -> bool:
+        return self.valid_start is not None
+
+    def _host_valid_spans(self) -> List[Tuple[int, int]]:
+        if self._valid_spans is None:
+            assert self.valid_start is not None and self.valid_end is not None
+            self._valid_spans = list(
+                zip(self.valid_start.tolist(), self.valid_end.tolist())
+            )
+        return self._valid_spans
+
+    def _host_docs(self) -> Optional[Tensor]:
+        """CPU copy of the document ids, or None if they can't be used for skipping."""
+        if self.document_ids is None:
+            return None
+        if self._docs_cpu is None:
+            self._docs_cpu = self.document_ids.detach().to("cpu", torch.long)
+            diffs = self._docs_cpu[:, 1:] - self._docs_cpu[:, :-1]
+            self._docs_sorted = bool((diffs >= 0).all())
+        return self._docs_cpu if self._docs_sorted else None
+
+    def block_key_range(
+        self, q_start: int, q_end: int, k_start: int, k_end: int
+    ) -> Tuple[int, int]:
+        """
+        Return the sub-range ``[lo, hi)`` of the key block ``[k_start, k_end)``
+        that may contain keys visible to queries ``[q_start, q_end)``. Keys
+        outside the range are guaranteed to be masked. The block is fully
+        masked when ``lo >= hi``.
+        """
+        lo, hi = k_start, k_end
+        if q_start >= q_end or k_start >= k_end:
+            return lo, lo
+
+        # positional constraints; the prefix is exempt from both
+        if self.causal:
+            hi = min(hi, max(q_end, self.prefix_len))
+        if self.sliding_window is not None and k_start >= self.prefix_len:
+            lo = max(lo, q_start - self.sliding_window + 1)
+            if not self.causal:
+                hi = min(hi, q_end - 1 + self.sliding_window)
+        if lo >= hi:
+            return lo, lo
+
+        docs = self._host_docs()
+        if docs is not None:
+            # sorted ids: queries see [first pos of doc(q_start), last pos of doc(q_end - 1)]
+            q_docs = docs[:, [q_start, q_end - 1]]
+            doc_lo = torch.searchsorted(docs, q_docs[:, :1].contiguous(), right=False)
+            doc_hi = torch.searchsorted(docs, q_docs[:, 1:].contiguous(), right=True)
+            lo = max(lo, int(doc_lo.min()))
+            hi = min(hi, int(doc_hi.max()))
+            if lo >= hi:
+                return lo, lo
+
+        if self.has_padding:
+            pad_lo, pad_hi = hi, lo
+            for v_start, v_end in self._host_valid_spans():
+                has_real_q = q_start < v_end and q_end > v_start
+                has_pad_q = q_start < v_start or q_end > v_end
+                if has_real_q and max(lo, v_start) < min(hi, v_end):
+                    pad_lo = min(pad_lo, max(lo, v_start))
+                    pad_hi = max(pad_hi, min(hi, v_end))
+                if has_pad_q:
+                    # pad keys are [lo, v_start) and [v_end, hi)
+                    if lo < v_start:
+                        pad_lo = min(pad_lo, lo)
+                        pad_hi = max(pad_hi, min(hi, v_start))
+                    if v_end < hi:
+                        pad_lo = min(pad_lo, max(lo, v_end))
+                        pad_hi = max(pad_hi, hi)
+            lo, hi = pad_lo, pad_hi
+            if lo >= hi:
+                return lo, lo
+
+        return lo, hi
+
+    def is_block_masked(self, q_start: int, q_end: int, k_start: int, k_end: int) -> bool:
+        """True if every (query, key) pair of the block is masked."""
+        lo, hi = self.block_key_range(q_start, q_end, k_start, k_end)
+        return lo >= hi
+
+    def block_mask(self, query_indices: Tensor, key_indices: Tensor) -> Tensor:
+        """
+        Materialize the mask of a single block.
+
+        Args:
+            query_indices: ``[Q]`` global positions of the queries
+            key_indices: ``[K]`` global positions of the keys
+
+        Returns:
+            boolean ``[B, 1, Q, K]`` (or ``[1, 1, Q, K]`` without per-sequence
+            structure) tensor, True where attention is allowed
+        """
+        qi = query_indices[:, None]
+        kj = key_indices[None, :]
+        allowed = torch.ones(
+            (query_indices.numel(), key_indices.numel()),
+            dtype=torch.bool,
+            device=query_indices.device,
+        )
+        if self.causal:
+            allowed = kj <= qi
+        if self.sliding_window is not None:
+            allowed = allowed & ((qi - kj).abs() < self.sliding_window)
+        if self.prefix_len > 0:
+            allowed = allowed | (kj < self.prefix_len)
+        allowed = allowed[None, None]
+
+        if self.document_ids is not None:
+            docs = self.document_ids.to(query_indices.device)
+            q_docs = docs[:, query_indices]
+            k_docs = docs[:, key_indices]
+            allowed = allowed & (q_docs[:, None, :, None] == k_docs[:, None, None, :])
+
+        if self.has_padding:
+            assert self.valid_start is not None and self.valid_end is not None
+            v_start = self.valid_start.to(query_indices.device)[:, None]
+            v_end = self.valid_end.to(query_indices.device)[:, None]
+            q_real = (query_indices[None, :] >= v_start) & (
+                query_indices[None, :] < v_end
+            )
+            k_real = (key_indices[None, :] >= v_start) & (key_indices[None, :] < v_end)
+            allowed = allowed & (q_real[:, None, :, None] == k_real[:, None, None, :])
+
+        return allowed
@@ -0,0 +1,94 @@
+"""
+Per-rank idle time and straggler metrics of a context parallel ring.
+
+Overall latency (the slowest rank) says a ring is slow, not which rank makes it
+so. While `RingAttentionStrategy.profile` is set, every rank accumulates its busy
+time per forward pass and the time it sat blocked on the others, per ring step
+(`RingTimings`). `collect_ring_metrics` gathers them from every rank into
+`RingMetrics`, whose `straggler_score` is the max / mean of the ranks' busy times:
+1 for a perfectly balanced split, and the factor by which the slowest rank holds
+the others back otherwise. It is what a rebalancer minimizes and what an operator
+alerts on when it drifts. `MetricReporter(ring_strategy=...)` reports them during
+training.
+"""
+
+import dataclasses
+from typing import Dict, List, Optional
+
+import torch.distributed as dist
+
+
+@dataclasses.dataclass
+class RingMetrics:
+    """
+    Per-forward averages of every rank of a ring, in group rank order.
+
+    busy_ms: time not spent waiting on other ranks
+    wait_ms: time blocked on other ranks (ring receives and collectives)
+    hop_wait_ms: the part of `wait_ms` spent receiving KV blocks during each ring
+        step, summed over layers
+    """
+
+    forwards: int
+    busy_ms: List[float]
+    wait_ms: List[float]
+    hop_wait_ms: List[List[float]]
+
+    @property
+    def world_size(self) -> int:
+        return len(self.busy_ms)
+
+    @property
+    def straggler_score(self) -> float:
+        """max / mean busy time, 1 when the ranks are balanced."""
+        mean = sum(self.busy_ms) / self.world_size
+        return max(self.busy_ms) / mean if mean > 0 else 1.0
+
+    @property
+    def straggler(self) -> int:
+        """The rank with the most busy time."""
+        return max(range(self.world_size), key=lambda r: self.busy_ms[r])
+
+    @property
+    def idle_fraction(self) -> List[float]:
+        """Share of every rank's forward time spent waiting."""
+        return [
+            wait / (busy + wait) if busy + wait > 0 else 0.0
+            for busy, wait in zip(self.busy_ms, self.wait_ms)
+        ]
+
+    def as_dict(self) -> Dict[str, float]:
+        """Flat metrics, e.g. for a metrics logger."""
+        metrics: Dict[str, float] = {
+            "ring_straggler_score": self.straggler_score,
+            "ring_straggler_rank": self.straggler,
+        }
+        for rank in range(self.world_size):
+            metrics[f"ring_busy_ms/{rank}"] = self.busy_ms[rank]
+            metrics[f"ring_wait_ms/{rank}"] = self.wait_ms[rank]
+        return metrics
+
+
+def collect_ring_metrics(strategy, reset: bool = True) -> Optional[RingMetrics]:
+    """
+    Gather the profiled timings of every rank of `strategy`'s group (see
+    `RingTimings`) into `RingMetrics`, None if no forward pass was profiled since
+    the last reset. Collective. With `reset`, the strategy's timings start over.
+    """
+    timings = strategy.timings
+    local = (timings.forwards, timings.busy_ms, timings.wait_ms, list(timings.hop_wait_ms))
+    gathered: List = [local]
+    if strategy.world_size > 1:
+        gathered = [None] * strategy.world_size
+        dist.all_gather_object(gathered, local, group=strategy.group)
+    if reset:
+        timings.reset()
+
+    if any(forwards == 0 for forwards, *_ in gathered):
+        return None
+    return RingMetrics(
+        forwards=min(forwards for forwards, *_ in gathered),
+        busy_ms=[busy / forwards for forwards, busy, _, _ in gathered],
+        wait_ms=[wait / forwards for forwards, _, wait, _ in gathered],
+        hop_wait_ms=[[w / forwards for w in hops] for forwards, _, _, hops in gathered],
+    )
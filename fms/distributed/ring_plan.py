@@ -0,0 +1,169 @@
+"""
+Precomputed schedule of the pass-KV ring for one forward pass.
+
+Which block a rank holds at each hop, its global offset, the part of it the mask
+leaves visible (or that it is skipped), the index tensors and mask slices the
+block is attended with, the peers and message lengths of every hop only depend
+on the shard layout and the mask, so they are the same for every layer. A
+`RingPlan` computes them once, on the first layer of a forward pass, and the
+ring loop of every other layer reuses it: no per-layer index tensors,
+`block_key_range()` calls (which may read mask tensors back from the device) or
+mask conversions, and the receive buffers are reused across hops and layers.
+
+Only the whole-block one-way rings use it (the eager pass-KV loop and its
+compiled form); the chunked, prefetching, hierarchical and bidirectional loops
+follow other schedules and compute their block spans per layer.
+"""
+
+import dataclasses
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+
+
+@dataclasses.dataclass
+class RingBlock:
+    """
+    The KV block a rank attends to at one hop.
+
+    source: ring position the block comes from
+    offset: global position of the block's first key
+    key_range: visible global key range [lo, hi), empty if the block is skipped
+    key_indices: device tensor of the visible key positions
+    mask_slice: additive dense mask for the visible keys, if a dense mask is used
+    """
+
+    source: int
+    offset: int
+    key_range: Tuple[int, int]
+    key_indices: Optional[Tensor] = None
+    mask_slice: Optional[Tensor] = None
+
+    @property
+    def skipped(self) -> bool:
+        return self.key_range[0] >= self.key_range[1]
+
+
+@dataclasses.dataclass
+class RingPlan:
+    """
+    q_start, q_len: this rank's global query span
+    window: causal sliding window that shortens the ring, see
+        `RingAttentionStrategy.ring_steps()`
+    query_indices: device tensor of this rank's query positions
+    blocks: the block attended to at each hop, `len(blocks)` hops in total
+    send_span: global (start, length) of the local keys sent at the first hop
+    recv_lens: tokens received after each hop (0 after the last)
+    msg_len: padded length of every ring message
+    send_to, recv_from: global ranks of the next and previous ring position
+    """
+
+    q_start: int
+    q_len: int
+    window: Optional[int]
+    query_indices: Tensor
+    blocks: List[RingBlock]
+    send_span: Tuple[int, int]
+    recv_lens: List[int]
+    msg_len: int
+    send_to: int
+    recv_from: int
+    # identifies the mask the plan was built for, see `matches()`
+    key: Tuple = ()
+    _buffers: Dict[Tuple, Tuple[Tensor, Tensor]] = dataclasses.field(
+        default_factory=dict, repr=False
+    )
+
+    @property
+    def num_steps(self) -> int:
+        return len(self.blocks)
+
+    def matches(self, key: Tuple) -> bool:
+        """Whether the plan was built for the mask and shard layout `key` identifies."""
+        return self.key == key
+
+    def recv_buffers(
+        self, step: int, k: Tensor, v: Tensor
+    ) -> Tuple[Tensor, Tensor]:
+        """
+        Receive buffers for hop `step`, padded to `msg_len`. Two sets alternate:
+        the block received at one hop is attended to (and forwarded) while the
+        next one arrives in the other set.
+        """
+        shape = (k.shape[0], k.shape[1], self.msg_len)
+        key = (step % 2, shape, k.shape[-1], v.shape[-1], k.dtype, k.device)
+        if key not in self._buffers:
+            self._buffers[key] = (
+                k.new_empty(shape + (k.shape[-1],)),
+                v.new_empty(shape + (v.shape[-1],)),
+            )
+        return self._buffers[key]
+
+
+def build_ring_plan(
+    strategy: RingAttentionStrategy,
+    ring_mask: RingMask,
+    dense_mask: Optional[Tensor],
+    device: torch.device,
+    dtype: torch.dtype = torch.float32,
+    key: Tuple = (),
+) -> RingPlan:
+    """
+    Plan the pass-KV ring of `strategy`'s current shard layout under `ring_mask`
+    (and the 4D `dense_mask`, whose slices are converted to additive `dtype`
+    masks).
+    """
+    # the ring implementation imports this module
+    from fms.distributed.ring_attention import _MASK_VALUE
+
+    rank, world_size = strategy.rank, strategy.world_size
+    q_start, q_len = strategy.local_q_start, strategy.local_q_len
+
+    window = None
+    if ring_mask.causal and ring_mask.prefix_len == 0:
+        window = ring_mask.sliding_window
+    num_steps = strategy.ring_steps(window)
+
+    blocks = []
+    for step in range(num_steps):
+        source = (rank - step) % world_size
+        if step == 0:
+            offset, length = q_start, q_len
+        else:
+            offset, length = strategy.kv_span(source, window)
+        k_lo, k_hi = ring_mask.block_key_range(
+            q_start, q_start + q_len, offset, offset + length
+        )
+        block = RingBlock(source, offset, (k_lo, k_hi))
+        if not block.skipped:
+            block.key_indices = torch.arange(k_lo, k_hi, device=device)
+            if dense_mask is not None:
+                mask_slice = dense_mask[..., q_start : q_start + q_len, k_lo:k_hi]
+                if mask_slice.dtype == torch.bool:
+                    mask_slice = torch.zeros(
+                        mask_slice.shape, device=device, dtype=dtype
+                    ).masked_fill(~mask_slice, _MASK_VALUE)
+                block.mask_slice = mask_slice
+        blocks.append(block)
+
+    recv_lens = [
+        strategy.kv_span((rank - step - 1) % world_size, window)[1]
+        for step in range(num_steps - 1)
+    ] + [0]
+    return RingPlan(
+        q_start=q_start,
+        q_len=q_len,
+        window=window,
+        query_indices=torch.arange(q_start, q_start + q_len, device=device),
+        blocks=blocks,
+        send_span=strategy.kv_span(rank, window),
+        recv_lens=recv_lens,
+        msg_len=max(strategy.kv_span(r, window)[1] for r in range(world_size)),
+        send_to=strategy._global_rank((rank + 1) % world_size),
+        recv_from=strategy._global_rank((rank - 1) % world_size),
+        key=key,
+    )
@@ -1,4 +1,8 @@
+import contextlib
+import dataclasses
+import functools
 import os
+import time
 from abc import abstractmethod
 from typing import List, Optional, Tuple, Any
 
@@ -7,8 +11,10 @@ import math
 from torch import nn
 import torch.distributed
 import torch.distributed as dist
+import torch.distributed._functional_collectives as funcol
 from torch.distributed import P2POp
 
+from fms.distributed import kv_compression as kvc
 from fms.utils import tp_wrapping
 
 
@@ -164,27 +170,197 @@ class TensorParallelStrategy(DistributedStrategy):
         return tp_wrapping.apply_tp(block, self.group)
 
 
+@dataclasses.dataclass
+class RingTimings:
+    """
+    Ring timings of one rank, accumulated while `RingAttentionStrategy.profile` is
+    set. `compute_ms` and `comm_ms` are CUDA event times of the pass-KV loop; the
+    others are wall times of every mode: `busy_ms` is the time of `forwards`
+    forward passes not spent in `wait_ms`, blocked on other ranks, and
+    `hop_wait_ms[i]` the part of the wait for KV blocks during ring step i of a
+    layer (waits on sends count toward `wait_ms` only).
+    """
+
+    layers: int = 0
+    compute_ms: float = 0.0
+    comm_ms: float = 0.0
+    bytes: int = 0
+    forwards: int = 0
+    busy_ms: float = 0.0
+    wait_ms: float = 0.0
+    hop_wait_ms: List[float] = dataclasses.field(default_factory=list)
+
+    def reset(self) -> None:
+        self.layers, self.compute_ms, self.comm_ms, self.bytes = 0, 0.0, 0.0, 0
+        self.forwards, self.busy_ms, self.wait_ms = 0, 0.0, 0.0
+        self.hop_wait_ms = []
+
+
 class RingAttentionStrategy(DistributedStrategy):
     """
     Distributed strategy for heterogeneity-aware ring attention.
     Supports uneven token partitioning via `block_lens` for load balancing.
+
+    The model itself is not modified. Forward hooks on the distributed layers
+    shard the hidden states along the sequence before the first layer, route every
+    layer's attention through the "ring" attention op with this rank's position
+    ids, and gather the full sequence again from the output of the last layer.
+    Set `gather_output=False` to keep the last layer's output sharded, e.g. to
+    pool encoder outputs with `first_token()` instead of gathering every token.
+
+    `ring_order` lists the ranks of `group` in the order KV travels around the
+    ring (see `fms.distributed.topology.optimize_ring_order`). `rank` is this
+    process's position in that order, and `block_lens` / `block_starts` follow it:
+    position i holds the i-th block of the sequence.
+
+    With `bidirectional=True` KV blocks travel clockwise and counter-clockwise at
+    the same time, each direction over about half of the ring
+    (`bidirectional_steps()`), so both directions of every link are used and the
+    ring takes about half as many hops.
+
+    `mode="allgather"` replaces the pass-KV ring with one all-gather of the
+    (compact) K/V shards per layer, overlapped with the local block's attention.
+    `fms.distributed.planner` picks between the two from a cost model.
+
+    `chunk_size` pipelines every hop of the pass-KV ring: KV blocks are sent in
+    sub-chunks of that many tokens, each its own P2P op, and a rank forwards and
+    attends to each sub-chunk as soon as it arrives, so compute on one sub-chunk
+    overlaps the transfer of the next (see `CostModel.chunk_size` to pick it from
+    the links).
+
+    `prefetch_depth` > 1 decouples ranks instead: receives for the next
+    `prefetch_depth` hops are posted ahead into their own buffers, and every block
+    is forwarded as soon as it arrives rather than after the rank's compute, so a
+    fast rank runs ahead of a momentarily slow neighbour instead of advancing in
+    lockstep with it.
+
+    `kv_compression` ("int8" or "fp8") quantizes every whole-block hop of the
+    pass-KV, bidirectional and hierarchical rings with per-head scales carried in
+    the same message (see `fms.distributed.kv_compression`); blocks are
+    dequantized on receipt. Sub-chunked, prefetched and compiled hops are sent
+    uncompressed.
+
+    With `calibrate=True` (or the `CalibrationShapes` of the model) every rank
+    runs a short block attention and GEMM micro-benchmark at construction (cached
+    on disk, see `fms.distributed.calibration`); the measured `speed_profile` replaces any
+    guess at the ranks' speeds, and `block_lens` is re-split in proportion to it.
+    `balance(seq_len)` splits later requests the same way.
+
+    Under `torch.compile` the pass-KV ring shifts KV with a functional all-to-all
+    that Dynamo traces (see `functional_shift_kv`), and the all-gathers are
+    functional too, so the ring compiles without graph breaks. Set `profile` to
+    time compute and comm per layer with CUDA events into `timings`, along with
+    every forward's busy time and its waits on other ranks per hop (eager only;
+    it synchronizes every layer and wait). `fms.distributed.ring_metrics`
+    compares them across ranks.
+
+    `sliding_window` restricts every layer's attention to that many keys back and
+    shortens the ring to the ranks overlapping each window (see `ring_steps()`);
+    `True` takes the window from the layer's config (e.g. `MistralConfig`). It is
+    off by default, since the non-distributed models attend over the full causal
+    context whatever their config says, and a ring run should match them.
+
+    An `emulator` (`fms.distributed.emulation.HeteroEmulator`) slows this rank's
+    compute and shapes its ring sends, to emulate a heterogeneous group on CPU.
+    A `tracer` (`fms.distributed.tracing.Tracer`) records a timeline of the
+    ring's compute, sends and waits per layer and hop.
     """
 
+    # attention op the layer hooks select
+    _attn_name = "ring"
+
     def __init__(
-        self, block_lens: List[int], block_size: Optional[int] = None, group: Optional[dist.ProcessGroup] = None, from_meta: bool = False
+        self,
+        block_lens: List[int],
+        block_size: Optional[int] = None,
+        group: Optional[dist.ProcessGroup] = None,
+        from_meta: bool = False,
+        gather_output: bool = True,
+        ring_order: Optional[List[int]] = None,
+        bidirectional: bool = False,
+        mode: str = "pass_kv",
+        chunk_size: Optional[int] = None,
+        prefetch_depth: int = 1,
+        profile: bool = False,
+        kv_compression: Optional[str] = None,
+        calibrate: Any = False,
+        emulator: Optional[Any] = None,
+        tracer: Optional[Any] = None,
+        sliding_window: Any = False,
     ):
         super().__init__(from_meta)
 
         if torch.distributed.is_available() and torch.distributed.is_initialized():
             self.group = group
-            self.rank = torch.distributed.get_rank(group=self.group)
+            group_rank = torch.distributed.get_rank(group=self.group)
             self.world_size = torch.distributed.get_world_size(group=self.group)
         else:
             self.group = None
-            self.rank = 0
+            group_rank = 0
             self.world_size = 1
 
+        # logical ring position -> rank in the group
+        self.ring_order = list(range(self.world_size)) if ring_order is None else list(ring_order)
+        if sorted(self.ring_order) != list(range(self.world_size)):
+            raise ValueError(
+                f"ring_order {self.ring_order} is not a permutation of the {self.world_size} ranks"
+            )
+        self.rank = self.ring_order.index(group_rank)
+
+        self.speed_profile = None
+        if calibrate:
+            from fms.distributed.calibration import calibrate_speeds
+
+            # True benchmarks the default shapes, a `CalibrationShapes` those given
+            shapes = None if calibrate is True else calibrate
+            self.speed_profile = calibrate_speeds(group=self.group, shapes=shapes)
+            block_lens = proportional_block_lens(
+                sum(block_lens), self.speed_profile.weights(self.ring_order)
+            )
+        self.set_block_lens(block_lens)
+        self._original_seq_len: Optional[int] = None
+
+        # set by the first layer's hook and reused by the others
+        self._local_position_ids: Optional[torch.Tensor] = None
+        # `fms.distributed.ring_plan.RingPlan`s of the current forward pass, built
+        # by the first layer's attention and reused by the others
+        self._ring_plans: dict = {}
+        # layers are distributed in order, the output of the last one is gathered
+        self._num_layers = 0
+        self.gather_output = gather_output
+        self.sliding_window = sliding_window
+        self.bidirectional = bidirectional
+        self.set_mode(mode)
+        self.set_chunk_size(chunk_size)
+        self.set_prefetch_depth(prefetch_depth)
+        self.set_kv_compression(kv_compression)
+        self.profile = profile
+        self.timings = RingTimings()
+        self.emulator = emulator
+        self.tracer = tracer
+        # wall clock of the current forward pass while profiling, and its hop
+        self._forward_start: Optional[float] = None
+        self._forward_wait_ms = 0.0
+        self._hop = 0
+
+        # Dedicated CUDA stream for async communication overlap; on CPU (gloo) the
+        # P2P ops are issued directly
+        self._comm_stream = (
+            torch.cuda.Stream(priority=-1) if torch.cuda.is_available() else None
+        )
+        # counter-clockwise blocks of the bidirectional ring
+        self._reverse_stream = (
+            torch.cuda.Stream(priority=-1)
+            if bidirectional and torch.cuda.is_available()
+            else None
+        )
+
+        # registers the "ring" attention op; imported here because the ring
+        # implementation depends on this module
+        from fms.distributed import ring_attention  # noqa: F401
 
+    def set_block_lens(self, block_lens: List[int]) -> None:
+        """Repartition the sequence, e.g. per request from a planner."""
         # Hetero block lengths
         block_lens = list(block_lens)
         assert len(block_lens) == self.world_size, (
@@ -204,19 +380,57 @@ class RingAttentionStrategy(DistributedStrategy):
         # common block_size for padding in ring_shift_start/_pad_to_block_size
         # All ranks will pad up to this.
         self.block_size = max(self.block_lens)
-        self._original_seq_len: Optional[int] = None
-    
-        # Dedicated CUDA stream for async communication overlap (CUDA required for ring attention)
-        self._comm_stream = torch.cuda.Stream(priority=-1)
 
+    def balance(self, seq_len: int) -> None:
+        """Split `seq_len` tokens in proportion to the calibrated rank speeds."""
+        if self.speed_profile is None:
+            raise ValueError("balance() needs a strategy built with calibrate=True")
+        self.set_block_lens(
+            proportional_block_lens(seq_len, self.speed_profile.weights(self.ring_order))
+        )
+
+    def set_mode(self, mode: str) -> None:
+        """Select the context-parallel algorithm, "pass_kv" or "allgather"."""
+        if mode not in ("pass_kv", "allgather"):
+            raise ValueError(f"unknown context parallel mode {mode!r}")
+        self.mode = mode
 
+    def set_chunk_size(self, chunk_size: Optional[int]) -> None:
+        """Tokens per pipelined sub-chunk of a ring hop, None to send whole blocks."""
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+        if chunk_size is not None and getattr(self, "prefetch_depth", 1) > 1:
+            raise ValueError("chunk_size can't be combined with prefetch_depth > 1")
+        self.chunk_size = chunk_size
 
-    def _pad_to_block_size(self, tensor: torch.Tensor, dim: int = 1) -> torch.Tensor:
+    def set_prefetch_depth(self, prefetch_depth: int) -> None:
+        """Number of ring hops whose KV receives are posted ahead of compute."""
+        if prefetch_depth < 1:
+            raise ValueError(f"prefetch_depth must be at least 1, got {prefetch_depth}")
+        if prefetch_depth > 1 and getattr(self, "chunk_size", None) is not None:
+            raise ValueError("chunk_size can't be combined with prefetch_depth > 1")
+        self.prefetch_depth = prefetch_depth
+
+    def set_kv_compression(self, kv_compression: Optional[str]) -> None:
+        """Wire format of ring KV hops: None, "int8" or "fp8"."""
+        kvc.check_compression(kv_compression)
+        self.kv_compression = kv_compression
+
+    def apply_plan(self, plan) -> None:
+        """Apply a `fms.distributed.planner.ContextParallelPlan` for the next request."""
+        self.set_block_lens(plan.block_lens)
+        self.set_mode(plan.mode)
+        self.set_kv_compression(plan.kv_compression)
+
+    def _pad_to_block_size(
+        self, tensor: torch.Tensor, dim: int = 1, size: Optional[int] = None
+    ) -> torch.Tensor:
+        size = self.block_size if size is None else size
         length = tensor.size(dim)
-        if length == self.block_size:
+        if length == size:
             return tensor
         pad_shape = list(tensor.shape)
-        pad_shape[dim] = self.block_size - length
+        pad_shape[dim] = size - length
         padding = torch.zeros(*pad_shape, dtype=tensor.dtype, device=tensor.device)
         return torch.cat([tensor, padding], dim=dim)
 
@@ -224,8 +438,106 @@ class RingAttentionStrategy(DistributedStrategy):
         return module
 
     def _distribute_layer(self, block: nn.Module, layer: int) -> nn.Module:
+        self._num_layers = max(self._num_layers, layer + 1)
+        block.register_forward_pre_hook(
+            functools.partial(self._layer_pre_hook, layer=layer), with_kwargs=True
+        )
+        block.register_forward_hook(functools.partial(self._layer_hook, layer=layer))
         return block
 
+    def _layer_pre_hook(self, module: nn.Module, args, kwargs, layer: int):
+        """Shard the sequence at the first layer and select the ring attention op."""
+        if args:
+            x, args = args[0], args[1:]
+        else:
+            x = kwargs.pop("x")
+
+        if self.tracer is not None:
+            self.tracer.begin_layer(layer)
+        self._hop = 0
+        if layer == 0:
+            self._begin_forward()
+            self._ring_plans.clear()
+            x = self.shard_input(x)
+            self._local_position_ids = self.local_position_ids(
+                kwargs.get("position_ids"), x.size(0), x.device
+            )
+
+        kwargs["x"] = x
+        kwargs["position_ids"] = self._local_position_ids
+        # encoders select the bidirectional op, keep them non-causal
+        if kwargs.get("attn_name") == "sdpa_bidirectional":
+            kwargs.setdefault("is_causal_mask", False)
+        kwargs["attn_name"] = self._attn_name
+        kwargs["ring_strategy"] = self
+        sliding_window = self.sliding_window
+        if sliding_window is True:
+            sliding_window = getattr(getattr(module, "config", None), "sliding_window", None)
+        if sliding_window:
+            kwargs.setdefault("sliding_window", sliding_window)
+        return args, kwargs
+
+    def _layer_hook(self, module: nn.Module, args, output, layer: int):
+        """Gather the sequence from the output of the last layer."""
+        if self.tracer is not None:
+            self.tracer.end_layer()
+        if layer == self._num_layers - 1:
+            self._end_forward()
+        if layer != self._num_layers - 1 or not self.gather_output:
+            return None
+        if isinstance(output, tuple):
+            return (self.gather_tensor(output[0], dim=1),) + output[1:]
+        return self.gather_tensor(output, dim=1)
+
+    def shard_len(self, rank: int) -> int:
+        """Number of tokens `rank` holds for the current input."""
+        if self._original_seq_len is None:
+            return self.block_lens[rank]
+        start = self.block_starts[rank]
+        end = min(start + self.block_lens[rank], self._original_seq_len)
+        return max(0, end - start)
+
+    def kv_span(self, rank: int, sliding_window: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Global (start, length) of the part of `rank`'s KV block passed around the ring.
+
+        Under a causal sliding window the ranks after `rank` only see its keys within
+        one window of the next rank's first query, so only that tail is sent (nothing
+        for the last rank, whose keys are in everyone else's future).
+        """
+        start, length = self.block_starts[rank], self.shard_len(rank)
+        if sliding_window is None:
+            return start, length
+        if rank == self.world_size - 1:
+            skip = length
+        else:
+            first_needed = self.block_starts[rank + 1] - sliding_window + 1
+            skip = min(max(first_needed - start, 0), length)
+        return start + skip, length - skip
+
+    def ring_steps(self, sliding_window: Optional[int] = None) -> int:
+        """
+        Number of ring iterations (KV blocks each rank computes on, its own included).
+
+        Without a window every block visits every rank. Under a causal sliding window
+        a rank only needs the blocks of the preceding ranks that intersect its first
+        query's window, so the ring stops once the farthest such block has arrived.
+        The result only depends on the shard layout, so it agrees on all ranks.
+        """
+        if sliding_window is None:
+            return self.world_size
+        steps = 1
+        for rank in range(self.world_size):
+            if self.shard_len(rank) == 0:
+                continue
+            first_visible = self.block_starts[rank] - sliding_window + 1
+            for source in range(rank):
+                start, length = self.kv_span(source, sliding_window)
+                if length > 0 and start + length > first_visible:
+                    steps = max(steps, rank - source + 1)
+                    break
+        return steps
+
     def shard_input(self, x: torch.Tensor) -> torch.Tensor:
         seq_len = x.size(1)
         self._original_seq_len = seq_len
@@ -244,9 +556,7 @@ class RingAttentionStrategy(DistributedStrategy):
                 f"block_size={self.block_size} < max(block_lens)={max(self.block_lens)}"
             )
         start = self.block_starts[self.rank]
-        length = self.block_lens[self.rank]
-        end = min(start + length, seq_len)
-        self._local_valid_len = max(0, end - start)
+        self._local_valid_len = self.shard_len(self.rank)
         if self._local_valid_len > 0:
             return x.narrow(1, start, self._local_valid_len)
         shp = list(x.shape)
@@ -260,32 +570,283 @@ class RingAttentionStrategy(DistributedStrategy):
         valid_len: int,
         iteration: int,
         enable_timing: bool = False,
+        sliding_window: Optional[int] = None,
+        plan: Optional[Any] = None,
     ) -> Tuple[Any, torch.Tensor, torch.Tensor, int, Optional[torch.cuda.Event]]:
-        """Start async P2P send/recv of KV tensors to next/from prev rank."""
+        """
+        Start async P2P send/recv of KV tensors to next/from prev rank.
+
+        With `sliding_window`, blocks are the `kv_span()` tails and messages are only
+        padded to the longest tail instead of `block_size`. A `RingPlan` supplies
+        the peers, lengths and receive buffers precomputed instead.
+        """
+        if plan is not None:
+            recv_len = plan.recv_lens[iteration]
+            if self.world_size == 1:
+                return None, k, v, recv_len, None
+            return self._shift_kv_async(
+                k, v, valid_len, plan.send_to, plan.recv_from, recv_len,
+                plan.msg_len, self._comm_stream, enable_timing,
+                recv_buffers=plan.recv_buffers(iteration, k, v),
+            )
+
         # After iteration i, we receive from rank (self.rank - (i+1)) % world_size
         source_rank = (self.rank - (iteration + 1)) % self.world_size
-        recv_len = self.block_lens[source_rank]
+        recv_len = self.kv_span(source_rank, sliding_window)[1]
+        msg_len = max(
+            self.kv_span(r, sliding_window)[1] for r in range(self.world_size)
+        )
 
         if self.world_size == 1:
             return None, k, v, recv_len, None
 
         # Ring shift: always send to next, receive from previous
-        send_to = (self.rank + 1) % self.world_size
-        recv_from = (self.rank - 1 + self.world_size) % self.world_size
+        send_to = self._global_rank((self.rank + 1) % self.world_size)
+        recv_from = self._global_rank((self.rank - 1 + self.world_size) % self.world_size)
+        return self._shift_kv_async(
+            k, v, valid_len, send_to, recv_from, recv_len, msg_len,
+            self._comm_stream, enable_timing,
+        )
+
+    def bidirectional_steps(self) -> Tuple[int, int]:
+        """
+        Hops of the clockwise and the counter-clockwise ring in bidirectional mode:
+        the blocks of the preceding `world_size // 2` ranks arrive clockwise and
+        those of the following `(world_size - 1) // 2` counter-clockwise.
+        """
+        return self.world_size // 2, (self.world_size - 1) // 2
+
+    def bidirectional_shift_kv_async(
+        self,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        valid_len: int,
+        iteration: int,
+        reverse: bool,
+        enable_timing: bool = False,
+    ) -> Tuple[Any, torch.Tensor, torch.Tensor, int, Optional[torch.cuda.Event]]:
+        """
+        Pass a block one hop: clockwise (to the next rank), or counter-clockwise
+        (to the previous rank) with `reverse`.
+        """
+        step = -1 if reverse else 1
+        # After iteration i, we hold the block from rank (self.rank -/+ (i+1))
+        source_rank = (self.rank - step * (iteration + 1)) % self.world_size
+        recv_len = self.shard_len(source_rank)
+        msg_len = max(self.shard_len(r) for r in range(self.world_size))
+        if self.world_size == 1:
+            return None, k, v, recv_len, None
+        return self._shift_kv_async(
+            k, v, valid_len,
+            self._global_rank((self.rank + step) % self.world_size),
+            self._global_rank((self.rank - step) % self.world_size),
+            recv_len,
+            msg_len,
+            self._reverse_stream if reverse else self._comm_stream,
+            enable_timing,
+        )
+
+    def kv_chunks(self, length: int) -> List[Tuple[int, int]]:
+        """(offset, length) of the sub-chunks a KV block of `length` tokens is sent in."""
+        size = self.chunk_size or max(length, 1)
+        return [(start, min(size, length - start)) for start in range(0, length, size)]
+
+    def chunk_shift_kv_async(
+        self,
+        send_k: torch.Tensor,
+        send_v: torch.Tensor,
+        recv_len: int,
+        enable_timing: bool = False,
+    ) -> Tuple[Any, torch.Tensor, torch.Tensor, int, Optional[torch.cuda.Event]]:
+        """
+        Send one sub-chunk to the next rank and receive `recv_len` tokens of the
+        next block from the previous one, as their own P2P ops. Both sides derive
+        the chunk lengths from `kv_chunks()`, so nothing is padded and empty sends
+        or receives are skipped; `send_k` may be empty.
+        """
+        seq_dim = 2
+        recv_shape = list(send_k.shape)
+        recv_shape[seq_dim] = recv_len
+        recv_k = send_k.new_empty(recv_shape)
+        recv_v = send_v.new_empty(recv_shape[:-1] + [send_v.size(-1)])
+        if self.world_size == 1:
+            return None, recv_k, recv_v, recv_len, None
+
+        send_to = self._global_rank((self.rank + 1) % self.world_size)
+        recv_from = self._global_rank((self.rank - 1) % self.world_size)
+        ops = []
+        if send_k.size(seq_dim) > 0:
+            ops.append(P2POp(dist.isend, send_k.contiguous(), send_to))
+            ops.append(P2POp(dist.isend, send_v.contiguous(), send_to))
+        if recv_len > 0:
+            ops.append(P2POp(dist.irecv, recv_k, recv_from))
+            ops.append(P2POp(dist.irecv, recv_v, recv_from))
+        if not ops:
+            return None, recv_k, recv_v, recv_len, None
+        reqs, comm_start_event = self._batch_p2p(ops, self._comm_stream, enable_timing)
+        return reqs, recv_k, recv_v, recv_len, comm_start_event
+
+    def functional_shift_kv(
+        self, k: torch.Tensor, v: torch.Tensor, valid_len: int, msg_len: int
+    ) -> torch.Tensor:
+        """
+        Ring shift as a functional all-to-all in which only the next rank gets
+        data, for torch.compile: Dynamo traces it into the graph instead of
+        breaking on P2P request handles. K and V (padded to `msg_len`) travel in
+        one flat message; the result is only waited on at its first use, so
+        compute issued before `functional_unpack_kv` overlaps the transfer.
+        """
+        seq_dim = 2
+        send_k = self._pad_to_block_size(k[:, :, :valid_len], dim=seq_dim, size=msg_len)
+        send_v = self._pad_to_block_size(v[:, :, :valid_len], dim=seq_dim, size=msg_len)
+        message = torch.cat([send_k.flatten(), send_v.flatten()])
+        input_splits = [0] * self.world_size
+        output_splits = [0] * self.world_size
+        input_splits[self.ring_order[(self.rank + 1) % self.world_size]] = message.numel()
+        output_splits[self.ring_order[(self.rank - 1) % self.world_size]] = message.numel()
+        return funcol.all_to_all_single(message, output_splits, input_splits, self._pg)
+
+    def functional_unpack_kv(
+        self, message: torch.Tensor, k: torch.Tensor, v: torch.Tensor, msg_len: int, recv_len: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """K and V (shaped like `k` and `v`) of the first `recv_len` tokens of a `functional_shift_kv` message."""
+        shape_k = k.shape[:2] + (msg_len, k.shape[-1])
+        shape_v = v.shape[:2] + (msg_len, v.shape[-1])
+        recv_k, recv_v = message.split([shape_k.numel(), shape_v.numel()])
+        return (
+            recv_k.view(shape_k)[:, :, :recv_len],
+            recv_v.view(shape_v)[:, :, :recv_len],
+        )
+
+    def prefetch_kv_send(self, k: torch.Tensor, v: torch.Tensor) -> Any:
+        """
+        Send a whole KV block to the next rank, on its own rather than batched with
+        a receive, for the prefetching ring (`prefetch_depth`). Returns the
+        requests to wait on before the buffers are reused, None if `k` is empty.
+        """
+        if self.world_size == 1 or k.size(2) == 0:
+            return None
+        send_to = self._global_rank((self.rank + 1) % self.world_size)
+        ops = [
+            P2POp(dist.isend, k.contiguous(), send_to),
+            P2POp(dist.isend, v.contiguous(), send_to),
+        ]
+        return self._batch_p2p(ops, self._comm_stream, batched=False)[0]
+
+    def prefetch_kv_recv(
+        self, like_k: torch.Tensor, like_v: torch.Tensor, recv_len: int
+    ) -> Tuple[Any, torch.Tensor, torch.Tensor, int]:
+        """
+        Post the receive of a `recv_len`-token KV block from the previous rank into
+        its own buffers, ahead of the hop it is needed at. Returns (reqs, recv_k,
+        recv_v, recv_len) for `ring_shift_kv_wait`.
+        """
+        seq_dim = 2
+        shape_k, shape_v = list(like_k.shape), list(like_v.shape)
+        shape_k[seq_dim] = shape_v[seq_dim] = recv_len
+        recv_k, recv_v = like_k.new_empty(shape_k), like_v.new_empty(shape_v)
+        if self.world_size == 1 or recv_len == 0:
+            return None, recv_k, recv_v, recv_len
+        recv_from = self._global_rank((self.rank - 1) % self.world_size)
+        ops = [
+            P2POp(dist.irecv, recv_k, recv_from),
+            P2POp(dist.irecv, recv_v, recv_from),
+        ]
+        reqs = self._batch_p2p(ops, self._comm_stream, batched=False)[0]
+        return reqs, recv_k, recv_v, recv_len
+
+    def _shift_kv_async(
+        self,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        valid_len: int,
+        send_to: int,
+        recv_from: int,
+        recv_len: int,
+        msg_len: int,
+        stream: Optional[Any],
+        enable_timing: bool = False,
+        group: Optional[dist.ProcessGroup] = None,
+        recv_buffers: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+    ) -> Tuple[Any, torch.Tensor, torch.Tensor, int, Optional[torch.cuda.Event]]:
+        """
+        Send the first `valid_len` KV tokens to global rank `send_to`, padded to
+        `msg_len`, and receive from `recv_from` on `stream` (into `recv_buffers` if
+        given). With `kv_compression` the blocks travel quantized and the receive
+        side is returned as `CompressedKV`s for `ring_shift_kv_wait` to decode.
+        """
         seq_dim = 2
 
         # Slice and pad KV to block_size
         if valid_len > 0:
             idx = [slice(None)] * k.ndim
             idx[seq_dim] = slice(0, valid_len)
-            send_k = self._pad_to_block_size(k[tuple(idx)], dim=seq_dim).contiguous()
-            send_v = self._pad_to_block_size(v[tuple(idx)], dim=seq_dim).contiguous()
+            send_k = self._pad_to_block_size(k[tuple(idx)], dim=seq_dim, size=msg_len).contiguous()
+            send_v = self._pad_to_block_size(v[tuple(idx)], dim=seq_dim, size=msg_len).contiguous()
         else:
-            send_k = self._pad_to_block_size(k.new_zeros(*k.shape[:seq_dim], 0, k.shape[-1]), dim=seq_dim).contiguous()
-            send_v = self._pad_to_block_size(v.new_zeros(*v.shape[:seq_dim], 0, v.shape[-1]), dim=seq_dim).contiguous()
+            send_k = self._pad_to_block_size(k.new_zeros(*k.shape[:seq_dim], 0, k.shape[-1]), dim=seq_dim, size=msg_len).contiguous()
+            send_v = self._pad_to_block_size(v.new_zeros(*v.shape[:seq_dim], 0, v.shape[-1]), dim=seq_dim, size=msg_len).contiguous()
+
+        if self.kv_compression is not None:
+            recv_k = kvc.CompressedKV.empty_like(send_k, self.kv_compression)
+            recv_v = kvc.CompressedKV.empty_like(send_v, self.kv_compression)
+            ops = [
+                P2POp(dist.isend, kvc.quantize_kv(send_k, self.kv_compression), send_to, group),
+                P2POp(dist.irecv, recv_k.message, recv_from, group),
+                P2POp(dist.isend, kvc.quantize_kv(send_v, self.kv_compression), send_to, group),
+                P2POp(dist.irecv, recv_v.message, recv_from, group),
+            ]
+            reqs, comm_start_event = self._batch_p2p(ops, stream, enable_timing)
+            return reqs, recv_k, recv_v, recv_len, comm_start_event
+
+        if recv_buffers is not None:
+            recv_k, recv_v = recv_buffers
+        else:
+            recv_k = torch.empty_like(send_k)
+            recv_v = torch.empty_like(send_v)
+
+        ops = [
+            P2POp(dist.isend, send_k, send_to, group),
+            P2POp(dist.irecv, recv_k, recv_from, group),
+            P2POp(dist.isend, send_v, send_to, group),
+            P2POp(dist.irecv, recv_v, recv_from, group),
+        ]
+        reqs, comm_start_event = self._batch_p2p(ops, stream, enable_timing)
+        return reqs, recv_k, recv_v, recv_len, comm_start_event
+
+    def _batch_p2p(
+        self,
+        ops: List[P2POp],
+        stream: Optional[Any],
+        enable_timing: bool = False,
+        batched: bool = True,
+    ) -> Tuple[Any, Optional[torch.cuda.Event]]:
+        """
+        Issue `ops` on `stream` once the current stream has produced the send
+        buffers. With `batched=False` every op is issued on its own, so sends and
+        receives to different peers don't complete (or block) as one group.
+        """
+
+        def issue():
+            if self.tracer is not None:
+                sent = sum(
+                    op.tensor.numel() * op.tensor.element_size()
+                    for op in ops
+                    if op.op is dist.isend
+                )
+                with self.tracer.span("send", "comm", bytes=sent):
+                    return issue_ops()
+            return issue_ops()
+
+        def issue_ops():
+            if self.emulator is not None and self.emulator.shapes_links:
+                return self.emulator.issue(ops)
+            if batched:
+                return dist.batch_isend_irecv(ops)
+            return [op.op(op.tensor, op.peer, op.group) for op in ops]
 
-        recv_k = torch.empty_like(send_k)
-        recv_v = torch.empty_like(send_v)
+        if stream is None or not ops[0].tensor.is_cuda:
+            return issue(), None
 
         # Record event so comm stream waits for send buffers to be ready
         ready_event = torch.cuda.Event()
@@ -294,22 +855,69 @@ class RingAttentionStrategy(DistributedStrategy):
         # Create start timing event if requested
         comm_start_event = torch.cuda.Event(enable_timing=True) if enable_timing else None
 
-        with torch.cuda.stream(self._comm_stream):
-            self._comm_stream.wait_event(ready_event)
+        with torch.cuda.stream(stream):
+            stream.wait_event(ready_event)
 
             # Record start time on comm stream
             if comm_start_event:
                 comm_start_event.record()
 
-            ops = [
-                P2POp(dist.isend, send_k, send_to),
-                P2POp(dist.irecv, recv_k, recv_from),
-                P2POp(dist.isend, send_v, send_to),
-                P2POp(dist.irecv, recv_v, recv_from),
-            ]
-            reqs = dist.batch_isend_irecv(ops)
+            reqs = issue()
 
-        return reqs, recv_k, recv_v, recv_len, comm_start_event
+        return reqs, comm_start_event
+
+    def _begin_forward(self) -> None:
+        if self.emulator is not None:
+            self.emulator.start()
+        if self.profile:
+            self._synchronize()
+            self._forward_start = time.perf_counter()
+            self._forward_wait_ms = 0.0
+
+    def _end_forward(self) -> None:
+        if self.emulator is not None:
+            self.emulator.stop()
+        if self._forward_start is not None:
+            self._synchronize()
+            elapsed_ms = (time.perf_counter() - self._forward_start) * 1000
+            self.timings.forwards += 1
+            self.timings.busy_ms += elapsed_ms - self._forward_wait_ms
+            self._forward_start = None
+
+    def _synchronize(self) -> None:
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+
+    def _wait(self, works: List[Any], name: str = "recv_wait") -> None:
+        """Wait on communication; an emulated slow rank first finishes its compute."""
+        with contextlib.ExitStack() as stack:
+            if self.emulator is not None:
+                stack.enter_context(self.emulator.waiting())
+            if self.tracer is not None:
+                stack.enter_context(self.tracer.span(name, "comm"))
+            if self.profile:
+                # queued compute is busy time, only the stall after it is waiting
+                self._synchronize()
+                start = time.perf_counter()
+            for work in works:
+                work.wait()
+            if self.profile:
+                self._synchronize()
+                self._record_wait((time.perf_counter() - start) * 1000, name)
+
+    def _record_wait(self, wait_ms: float, name: str) -> None:
+        self.timings.wait_ms += wait_ms
+        self._forward_wait_ms += wait_ms
+        if name == "recv_wait":
+            hops = self.timings.hop_wait_ms
+            hops.extend([0.0] * (self._hop + 1 - len(hops)))
+            hops[self._hop] += wait_ms
+
+    def _next_hop(self) -> None:
+        """Move on to the next ring step; every ring loop calls this once per step."""
+        self._hop += 1
+        if self.tracer is not None:
+            self.tracer.next_hop()
 
     def ring_shift_kv_wait(
         self,
@@ -318,23 +926,38 @@ class RingAttentionStrategy(DistributedStrategy):
         recv_v: torch.Tensor,
         recv_len: int,
         enable_timing: bool = False,
+        stream: Optional[Any] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor, int, Optional[torch.cuda.Event], Optional[torch.cuda.Event]]:
         """Wait for async KV shift to complete and return received tensors."""
         if reqs is None:
             return recv_k, recv_v, recv_len, None, None
 
-        for req in reqs:
-            req.wait()
+        self._wait(reqs)
+
+        stream = self._comm_stream if stream is None else stream
+        compressed = isinstance(recv_k, kvc.CompressedKV)
+        if stream is None or not (recv_k.message if compressed else recv_k).is_cuda:
+            if compressed:
+                recv_k, recv_v = recv_k.dequantize(), recv_v.dequantize()
+            if recv_len == 0:
+                return recv_k[:, :, :0], recv_v[:, :, :0], 0, None, None
+            return recv_k, recv_v, recv_len, None, None
 
         # Record events on comm stream AFTER transfers complete
         comm_end_event = None
         sync_event = torch.cuda.Event()
 
-        with torch.cuda.stream(self._comm_stream):
+        with torch.cuda.stream(stream):
+            if compressed:
+                recv_k, recv_v = recv_k.dequantize(), recv_v.dequantize()
             if enable_timing:
                 comm_end_event = torch.cuda.Event(enable_timing=True)
                 comm_end_event.record()
             sync_event.record()
+        if compressed:
+            # decoded on the comm stream, consumed on the current one
+            recv_k.record_stream(torch.cuda.current_stream())
+            recv_v.record_stream(torch.cuda.current_stream())
 
         # No synchronize() needed - recv_len is already known from block_lens
         if recv_len == 0:
@@ -344,10 +967,108 @@ class RingAttentionStrategy(DistributedStrategy):
     @property
     def local_q_len(self) -> int:
         return self._local_valid_len or 0
+
     @property
     def local_q_start(self) -> int:
-      """Global start index of tokens for this rank."""
-      return self.block_starts[self.rank]
+        """Global start index of tokens for this rank."""
+        return self.block_starts[self.rank]
+
+    def local_position_ids(
+        self,
+        position_ids: Optional[torch.Tensor],
+        batch_size: int,
+        device: torch.device,
+    ) -> torch.Tensor:
+        """
+        Position ids of this rank's tokens, sliced from the global `position_ids`
+        or, if None, the global positions of the shard.
+        """
+        start, length = self.local_q_start, self.local_q_len
+        if position_ids is not None:
+            return position_ids[:, start : start + length]
+        return torch.arange(start, start + length, device=device).expand(
+            batch_size, -1
+        )
+
+    def _global_rank(self, position: int) -> int:
+        """Global rank of the process at ring `position`, as P2P ops expect."""
+        group_rank = self.ring_order[position]
+        if self.group is None:
+            return group_rank
+        return dist.get_global_rank(self.group, group_rank)
+
+    @property
+    def _pg(self) -> dist.ProcessGroup:
+        return self.group if self.group is not None else dist.group.WORLD
+
+    def _all_gather(self, tensor: torch.Tensor) -> List[torch.Tensor]:
+        """All-gather `tensor`, returned in ring order."""
+        if torch.compiler.is_compiling():
+            gathered = funcol.all_gather_tensor(tensor, 0, self._pg).chunk(self.world_size)
+        else:
+            gathered = [torch.empty_like(tensor) for _ in range(self.world_size)]
+            torch.distributed.all_gather(gathered, tensor, group=self.group)
+        return [gathered[group_rank] for group_rank in self.ring_order]
+
+    def all_gather_kv_async(
+        self, k: torch.Tensor, v: torch.Tensor
+    ) -> Tuple[List[Any], List[torch.Tensor], List[torch.Tensor]]:
+        """
+        Start all-gathers of every rank's K/V shard (b x h x len x d), padded to
+        `block_size`. Returns the work handles and the K and V lists in ring order,
+        filled once `all_gather_kv_wait` returns. Under torch.compile these are
+        functional all-gathers, waited on at first use, and there are no handles.
+        """
+        seq_dim = 2
+        k = self._pad_to_block_size(k, dim=seq_dim).contiguous()
+        v = self._pad_to_block_size(v, dim=seq_dim).contiguous()
+        if torch.compiler.is_compiling():
+            return [], self._all_gather(k), self._all_gather(v)
+        gathered_k = [torch.empty_like(k) for _ in range(self.world_size)]
+        gathered_v = [torch.empty_like(v) for _ in range(self.world_size)]
+        works = [
+            dist.all_gather(gathered_k, k, group=self.group, async_op=True),
+            dist.all_gather(gathered_v, v, group=self.group, async_op=True),
+        ]
+        return (
+            works,
+            [gathered_k[r] for r in self.ring_order],
+            [gathered_v[r] for r in self.ring_order],
+        )
+
+    def all_gather_kv_wait(
+        self, works: List[Any], gathered_k: List[torch.Tensor], gathered_v: List[torch.Tensor]
+    ) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        """Wait for `all_gather_kv_async` and trim each rank's padding."""
+        self._wait(works, "allgather_wait")
+        return (
+            [g[:, :, : self.shard_len(r)] for r, g in enumerate(gathered_k)],
+            [g[:, :, : self.shard_len(r)] for r, g in enumerate(gathered_v)],
+        )
+
+    def gather_boundary(self, tensor: torch.Tensor) -> List[torch.Tensor]:
+        """
+        All-gather a small tensor of the same shape on every rank, e.g. the state a
+        recurrent layer carries across the shard boundary. Returned in ring order.
+        """
+        if self.world_size == 1:
+            return [tensor]
+        return self._all_gather(tensor.contiguous())
+
+    def first_token(self, tensor: torch.Tensor) -> torch.Tensor:
+        """
+        The hidden state of global position 0 (e.g. CLS), broadcast from the rank
+        holding it, as a [bsz, 1, ...] tensor on every rank.
+        """
+        if self.world_size == 1:
+            return tensor[:, :1]
+        owner = next(r for r in range(self.world_size) if self.shard_len(r) > 0)
+        if self.rank == owner:
+            token = tensor[:, :1].contiguous()
+        else:
+            token = tensor.new_empty((tensor.size(0), 1) + tuple(tensor.shape[2:]))
+        dist.broadcast(token, src=self._global_rank(owner), group=self.group)
+        return token
 
     def gather_tensor(self, tensor: torch.Tensor, dim: int = 1) -> torch.Tensor:
         if self.world_size == 1:
@@ -355,9 +1076,353 @@ class RingAttentionStrategy(DistributedStrategy):
         t = tensor.contiguous()
         if t.size(dim) != self.block_size:
             t = self._pad_to_block_size(t, dim)
-        gathered = [torch.empty_like(t) for _ in range(self.world_size)]
-        torch.distributed.all_gather(gathered, t, group=self.group)
-        result = torch.cat(gathered, dim=dim)
-        if dim == 1 and self._original_seq_len is not None:
-            result = result.narrow(dim, 0, self._original_seq_len)
-        return result
\ No newline at end of file
+        gathered = self._all_gather(t)
+        # drop each rank's padding before concatenating, shards may be uneven
+        return torch.cat(
+            [g.narrow(dim, 0, self.shard_len(r)) for r, g in enumerate(gathered)],
+            dim=dim,
+        )
+
+class UlyssesStrategy(RingAttentionStrategy):
+    """
+    DeepSpeed-Ulysses sequence parallelism. Hidden states are sharded along the
+    sequence by `block_lens` exactly like `RingAttentionStrategy` (same hooks,
+    gathering and position ids), but attention runs through the "ulysses" op: an
+    all-to-all turns the sequence-sharded Q/K/V from the `MultiHeadAttention`
+    projections into head-sharded ones over the full sequence, each rank runs
+    full attention for its heads, and a second all-to-all shards the output by
+    sequence again. Communication per rank does not grow with world size.
+
+    `head_weights` assigns heads unevenly (in proportion), so slower ranks can be
+    given fewer heads; by default heads are split evenly.
+    """
+
+    _attn_name = "ulysses"
+
+    def __init__(
+        self,
+        block_lens: List[int],
+        head_weights: Optional[List[float]] = None,
+        group: Optional[dist.ProcessGroup] = None,
+        from_meta: bool = False,
+        gather_output: bool = True,
+    ):
+        super().__init__(
+            block_lens, group=group, from_meta=from_meta, gather_output=gather_output
+        )
+        if head_weights is not None and len(head_weights) != self.world_size:
+            raise ValueError(
+                f"{len(head_weights)} head weights for {self.world_size} ranks"
+            )
+        self.head_weights = (
+            [1.0] * self.world_size if head_weights is None else list(head_weights)
+        )
+
+        # registers the "ulysses" attention op
+        from fms.distributed import ulysses  # noqa: F401
+
+    def head_counts(self, nheads: int, kvheads: int) -> Tuple[List[int], List[int], bool]:
+        """
+        Query and KV heads of every rank, and whether K/V have to be expanded to
+        `nheads` first. Whole KV groups are assigned when there are at least as
+        many KV heads as ranks, so K/V stay compact; otherwise query heads are.
+        """
+        group_size = nheads // kvheads
+        if kvheads >= self.world_size:
+            kv_counts = proportional_block_lens(kvheads, self.head_weights)
+            return [c * group_size for c in kv_counts], kv_counts, False
+        q_counts = proportional_block_lens(nheads, self.head_weights)
+        return q_counts, q_counts, group_size != 1
+
+    def all_to_all(
+        self, tensors: List[torch.Tensor], recv_shapes: List[Tuple[int, ...]]
+    ) -> List[torch.Tensor]:
+        """
+        Send `tensors[r]` to ring position r and receive a tensor of
+        `recv_shapes[r]` from it, with P2P ops so uneven shapes work on any backend.
+        """
+        received = [
+            tensors[r] if r == self.rank else tensors[r].new_empty(recv_shapes[r])
+            for r in range(self.world_size)
+        ]
+        ops = []
+        for r in range(self.world_size):
+            if r == self.rank:
+                continue
+            peer = self._global_rank(r)
+            if tensors[r].numel() > 0:
+                ops.append(P2POp(dist.isend, tensors[r].contiguous(), peer))
+            if received[r].numel() > 0:
+                ops.append(P2POp(dist.irecv, received[r], peer))
+        if ops:
+            self._wait(dist.batch_isend_irecv(ops), "all_to_all_wait")
+        return received
+
+    def seq_to_heads(self, x: torch.Tensor, counts: List[int]) -> torch.Tensor:
+        """b x local_len x heads x d -> b x seq_len x counts[rank] x d"""
+        if self.world_size == 1:
+            return x
+        starts = [sum(counts[:r]) for r in range(self.world_size)]
+        send = [x[:, :, starts[r] : starts[r] + counts[r]] for r in range(self.world_size)]
+        shapes = [
+            (x.size(0), self.shard_len(r), counts[self.rank], x.size(-1))
+            for r in range(self.world_size)
+        ]
+        return torch.cat(self.all_to_all(send, shapes), dim=1)
+
+    def heads_to_seq(self, x: torch.Tensor, counts: List[int]) -> torch.Tensor:
+        """b x seq_len x counts[rank] x d -> b x local_len x heads x d"""
+        if self.world_size == 1:
+            return x
+        send = [
+            x[:, self.block_starts[r] : self.block_starts[r] + self.shard_len(r)]
+            for r in range(self.world_size)
+        ]
+        shapes = [
+            (x.size(0), self.local_q_len, counts[r], x.size(-1))
+            for r in range(self.world_size)
+        ]
+        return torch.cat(self.all_to_all(send, shapes), dim=2)
+
+
+def proportional_block_lens(total: int, weights: List[float]) -> List[int]:
+    """Split `total` tokens into integers proportional to `weights` (largest remainder)."""
+    weight_sum = float(sum(weights))
+    exact = [total * w / weight_sum for w in weights]
+    lens = [int(math.floor(e)) for e in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - lens[i], reverse=True)
+    for i in by_remainder[: total - sum(lens)]:
+        lens[i] += 1
+    return lens
+
+
+def hierarchical_block_lens(
+    seq_len: int, weights: List[float], ranks_per_node: int
+) -> List[int]:
+    """
+    `block_lens` for `HierarchicalRingAttentionStrategy` from per-rank speed
+    weights: the sequence is split across nodes by their total weight, then within
+    each node by the weights of its ranks.
+    """
+    assert len(weights) % ranks_per_node == 0, (
+        f"{len(weights)} weights for nodes of {ranks_per_node} ranks"
+    )
+    node_weights = [
+        weights[n : n + ranks_per_node] for n in range(0, len(weights), ranks_per_node)
+    ]
+    node_lens = proportional_block_lens(seq_len, [sum(w) for w in node_weights])
+    return [
+        block_len
+        for node_len, w in zip(node_lens, node_weights)
+        for block_len in proportional_block_lens(node_len, w)
+    ]
+
+
+class HierarchicalRingAttentionStrategy(RingAttentionStrategy):
+    """
+    Two-level ring attention for multi-node runs. Ranks are grouped into nodes of
+    `ranks_per_node` consecutive ranks. KV blocks circulate in an inner ring over
+    the fast links within each node while, in parallel, each rank forwards the
+    block it started the inner ring with to the same local rank on the next node
+    (the outer ring). Each inner ring therefore runs over one node's blocks, and
+    the slow inter-node hop overlaps with a whole inner ring instead of gating
+    every step.
+
+    Blocks are laid out node-major: node n holds a contiguous span of the sequence
+    split across its ranks, so uneven `block_lens` (e.g. from
+    `hierarchical_block_lens`) balance both between and within nodes. The inner
+    and outer rings use their own process groups (`torch.distributed.new_group`)
+    and streams, so they don't serialize on one communicator. `ranks_per_node` need
+    not match the hardware, which lets a single machine emulate several nodes.
+
+    Other keyword arguments are those of `RingAttentionStrategy`. Nodes are
+    consecutive positions of `ring_order`, if given. The bidirectional, chunked
+    and prefetching rings are one-level only and are rejected.
+    """
+
+    def __init__(
+        self,
+        block_lens: List[int],
+        ranks_per_node: int,
+        block_size: Optional[int] = None,
+        group: Optional[dist.ProcessGroup] = None,
+        from_meta: bool = False,
+        gather_output: bool = True,
+        **kwargs,
+    ):
+        super().__init__(
+            block_lens, block_size, group, from_meta, gather_output=gather_output, **kwargs
+        )
+        if self.bidirectional or self.chunk_size is not None or self.prefetch_depth > 1:
+            raise ValueError(
+                "the hierarchical ring can't be combined with bidirectional, chunk_size "
+                "or prefetch_depth > 1"
+            )
+        if self.world_size % ranks_per_node != 0:
+            raise ValueError(
+                f"world_size {self.world_size} is not a multiple of ranks_per_node {ranks_per_node}"
+            )
+        self.ranks_per_node = ranks_per_node
+        self.num_nodes = self.world_size // ranks_per_node
+        self.node, self.local_rank = divmod(self.rank, ranks_per_node)
+
+        # every rank has to create every group, in the same order
+        self._intra_group = None
+        self._inter_group = None
+        if self.world_size > 1:
+            for node in range(self.num_nodes):
+                ranks = [self._global_rank(node * ranks_per_node + r) for r in range(ranks_per_node)]
+                intra = dist.new_group(ranks)
+                if node == self.node:
+                    self._intra_group = intra
+            for local in range(ranks_per_node):
+                ranks = [self._global_rank(n * ranks_per_node + local) for n in range(self.num_nodes)]
+                inter = dist.new_group(ranks)
+                if local == self.local_rank:
+                    self._inter_group = inter
+
+        self._outer_stream = (
+            torch.cuda.Stream(priority=-1) if torch.cuda.is_available() else None
+        )
+
+    def _position(self, node: int, local_rank: int) -> int:
+        return (node % self.num_nodes) * self.ranks_per_node + local_rank % self.ranks_per_node
+
+    def block_source(self, step: int) -> int:
+        """Ring position whose KV block this rank holds at `step` of the schedule."""
+        outer_step, inner_step = divmod(step, self.ranks_per_node)
+        return self._position(self.node - outer_step, self.local_rank - inner_step)
+
+    def ring_steps(self, sliding_window: Optional[int] = None) -> int:
+        # every block is visited; a window only masks (and skips compute of) blocks
+        return self.world_size
+
+    def _msg_len(self) -> int:
+        return max(self.shard_len(r) for r in range(self.world_size))
+
+    def inner_shift_kv_async(
+        self, k: torch.Tensor, v: torch.Tensor, valid_len: int, step: int, enable_timing: bool = False
+    ) -> Tuple[Any, torch.Tensor, torch.Tensor, int, Optional[torch.cuda.Event]]:
+        """Pass the block held at `step` to the next rank of this node."""
+        return self._shift_kv_async(
+            k, v, valid_len,
+            self._global_rank(self._position(self.node, self.local_rank + 1)),
+            self._global_rank(self._position(self.node, self.local_rank - 1)),
+            self.shard_len(self.block_source(step + 1)),
+            self._msg_len(),
+            self._comm_stream,
+            enable_timing,
+            self._intra_group,
+        )
+
+    def outer_shift_kv_async(
+        self, k: torch.Tensor, v: torch.Tensor, valid_len: int, outer_step: int, enable_timing: bool = False
+    ) -> Tuple[Any, torch.Tensor, torch.Tensor, int, Optional[torch.cuda.Event]]:
+        """
+        Forward the block this rank started inner ring `outer_step` with to the
+        same local rank on the next node; it is needed at the next inner ring.
+        """
+        next_start = (outer_step + 1) * self.ranks_per_node
+        return self._shift_kv_async(
+            k, v, valid_len,
+            self._global_rank(self._position(self.node + 1, self.local_rank)),
+            self._global_rank(self._position(self.node - 1, self.local_rank)),
+            self.shard_len(self.block_source(next_start)),
+            self._msg_len(),
+            self._outer_stream,
+            enable_timing,
+            self._inter_group,
+        )
+
+    def outer_shift_kv_wait(
+        self, reqs: Any, recv_k: torch.Tensor, recv_v: torch.Tensor, recv_len: int, enable_timing: bool = False
+    ):
+        return self.ring_shift_kv_wait(
+            reqs, recv_k, recv_v, recv_len, enable_timing, stream=self._outer_stream
+        )
+
+
+class RingTensorParallelStrategy(RingAttentionStrategy):
+    """
+    2D context x tensor parallelism, for models whose weights and context both
+    don't fit on one device. The ranks form a `cp_size x tp_size` mesh: the
+    `tp_size` consecutive ranks of each row (usually one node) are a tensor
+    parallel group and shard the weights and heads like `TensorParallelStrategy`,
+    and the ranks with the same TP rank across rows form a context parallel ring
+    over the sequence.
+
+    Every rank of a TP group holds the same sequence shard, so `block_lens` has
+    one entry per TP group (ring position) and heterogeneous groups are balanced
+    as a whole. The ring runs over the local head shard the TP projections
+    produce; `ring_order`, `bidirectional`, `mode`, `chunk_size`,
+    `prefetch_depth`, `profile`, `kv_compression` and `sliding_window` apply to
+    the rings as in `RingAttentionStrategy`. `ring_order` lists ring positions
+    (TP groups); see `fms.distributed.topology.row_links` to order them from a
+    per-rank topology. `calibrate` is not supported: each ring would measure its
+    own speeds and split the sequence differently from the other rings, while
+    the ranks of a TP group must hold the same shard.
+    """
+
+    def __init__(
+        self,
+        block_lens: List[int],
+        tp_size: int,
+        from_meta: bool = False,
+        gather_output: bool = True,
+        ring_order: Optional[List[int]] = None,
+        bidirectional: bool = False,
+        mode: str = "pass_kv",
+        chunk_size: Optional[int] = None,
+        prefetch_depth: int = 1,
+        profile: bool = False,
+        kv_compression: Optional[str] = None,
+        calibrate: Any = False,
+        sliding_window: Any = False,
+    ):
+        if calibrate:
+            raise ValueError(
+                "calibrate is not supported with tensor parallel rings; pass block_lens"
+            )
+        assert torch.distributed.is_initialized(), "must initialize a process group"
+        world_size = torch.distributed.get_world_size()
+        if world_size % tp_size != 0:
+            raise ValueError(
+                f"world_size {world_size} is not a multiple of tp_size {tp_size}"
+            )
+        self.tp_size = tp_size
+        self.cp_size = world_size // tp_size
+        cp_rank, tp_rank = divmod(torch.distributed.get_rank(), tp_size)
+
+        # every rank has to create every group, in the same order
+        for row in range(self.cp_size):
+            tp_group = dist.new_group([row * tp_size + r for r in range(tp_size)])
+            if row == cp_rank:
+                self.tp_group = tp_group
+        for col in range(tp_size):
+            cp_group = dist.new_group([r * tp_size + col for r in range(self.cp_size)])
+            if col == tp_rank:
+                self.cp_group = cp_group
+
+        super().__init__(
+            block_lens,
+            group=self.cp_group,
+            from_meta=from_meta,
+            gather_output=gather_output,
+            ring_order=ring_order,
+            bidirectional=bidirectional,
+            mode=mode,
+            chunk_size=chunk_size,
+            prefetch_depth=prefetch_depth,
+            profile=profile,
+            kv_compression=kv_compression,
+            sliding_window=sliding_window,
+        )
+
+    def _distribute_module(
+        self, module: nn.Module, final_layers: bool = False
+    ) -> nn.Module:
+        return tp_wrapping.apply_tp(module, self.tp_group)
+
+    def _distribute_layer(self, block: nn.Module, layer: int) -> nn.Module:
+        block = tp_wrapping.apply_tp(block, self.tp_group)
+        return super()._distribute_layer(block, layer)
@@ -0,0 +1,180 @@
+"""
+Resumable multi-rank benchmark sweeps.
+
+A sweep is a list of configs (dataclasses with a `world_size`), each run by a
+function `fn(rank, config)` on every rank of a fresh process group. `run_sweep`
+launches the ranks with torch.multiprocessing, hands each one the config as an
+object and returns rank 0's result as an object, so nothing is parsed from
+stdout. Completed (config, result) entries are appended to a JSON lines cache as
+they finish, and configs already in it are skipped: an interrupted sweep picks up
+where it stopped, and a nightly rerun of a full sweep only runs what's new. Under
+torchrun, the launched group runs the configs of its own size instead.
+"""
+
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+logger = logging.getLogger(__name__)
+
+
+def config_key(config) -> str:
+    """Stable hash of a dataclass config, its cache key."""
+    data = [type(config).__name__, dataclasses.asdict(config)]
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class SweepCache:
+    """Completed (config, result) entries of a sweep, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.results: Dict[str, Any] = {}
+        self._needs_newline = False
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                text = f.read()
+            for line in text.splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a sweep killed mid-write
+                    continue
+                self.results[entry["key"]] = entry["result"]
+            self._needs_newline = bool(text) and not text.endswith("\n")
+
+    def __contains__(self, config) -> bool:
+        return config_key(config) in self.results
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def get(self, config) -> Any:
+        return self.results.get(config_key(config))
+
+    def add(self, config, result: Any) -> None:
+        key = config_key(config)
+        entry = {"key": key, "config": dataclasses.asdict(config), "result": result}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a") as f:
+            if self._needs_newline:
+                f.write("\n")
+                self._needs_newline = False
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.results[key] = result
+
+
+def _sweep_worker(rank, fn, config, workdir, backend, env):
+    if env is not None:
+        # before the group (and any CUDA context) exists, e.g. for MPS limits
+        os.environ.update({k: str(v) for k, v in env(config, rank).items()})
+    if backend == "nccl":
+        torch.cuda.set_device(rank % torch.cuda.device_count())
+    dist.init_process_group(
+        backend,
+        init_method=f"file://{os.path.join(workdir, 'init')}",
+        rank=rank,
+        world_size=config.world_size,
+    )
+    try:
+        result = fn(rank, config)
+        if rank == 0:
+            with open(os.path.join(workdir, "result.json"), "w") as f:
+                json.dump(result, f, default=str)
+    finally:
+        dist.destroy_process_group()
+
+
+def run_config(
+    fn: Callable[[int, Any], Any],
+    config,
+    backend: str = "gloo",
+    env: Optional[Callable[[Any, int], Dict[str, Any]]] = None,
+) -> Any:
+    """
+    Run `fn(rank, config)` on `config.world_size` spawned ranks and return rank 0's
+    result, which must be JSON serializable.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        mp.start_processes(
+            _sweep_worker,
+            args=(fn, config, workdir, backend, env),
+            nprocs=config.world_size,
+            start_method="spawn",
+        )
+        with open(os.path.join(workdir, "result.json"), "r") as f:
+            return json.load(f)
+
+
+def run_sweep(
+    configs: Sequence,
+    fn: Callable[[int, Any], Any],
+    cache_path: str,
+    backend: str = "gloo",
+    env: Optional[Callable[[Any, int], Dict[str, Any]]] = None,
+    on_result: Optional[Callable[[Any, Any], None]] = None,
+) -> List[Tuple[Any, Any]]:
+    """
+    Run every config of `configs` not yet in the cache at `cache_path` (see
+    `run_config`), caching each result as it completes and passing it to
+    `on_result`. Configs that fail are logged and left out, so the next run retries
+    them. `env(config, rank)` gives environment variables to set in a rank's
+    process before it initializes anything, e.g. CUDA_MPS_ACTIVE_THREAD_PERCENTAGE.
+
+    Called from a process group that is already initialized (torchrun), every
+    rank must call it; the configs of the group's size run on that group, and
+    `env` is ignored.
+
+    Returns the (config, result) pairs of `configs` that have a result, in order.
+    """
+    if dist.is_initialized():
+        return _run_sweep_launched(configs, fn, cache_path, on_result)
+
+    cache = SweepCache(cache_path)
+    for config in configs:
+        if config in cache:
+            continue
+        try:
+            result = run_config(fn, config, backend=backend, env=env)
+        except Exception:
+            logger.exception(f"sweep config {config} failed")
+            continue
+        cache.add(config, result)
+        if on_result is not None:
+            on_result(config, result)
+    return [(config, cache.get(config)) for config in configs if config in cache]
+
+
+def _run_sweep_launched(configs, fn, cache_path, on_result) -> List[Tuple[Any, Any]]:
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    cache = SweepCache(cache_path) if rank == 0 else None
+    todo = [None]
+    if rank == 0:
+        todo = [[i for i, c in enumerate(configs) if c.world_size == world_size and c not in cache]]
+    # rank 0 owns the cache, the others follow its list
+    dist.broadcast_object_list(todo, src=0)
+    for i in todo[0]:
+        config = configs[i]
+        result = fn(rank, config)
+        if rank == 0:
+            cache.add(config, result)
+            if on_result is not None:
+                on_result(config, result)
+        dist.barrier()
+
+    done: List = [None]
+    if rank == 0:
+        done = [[(config, cache.get(config)) for config in configs if config in cache]]
+    dist.broadcast_object_list(done, src=0)
+    return done[0]
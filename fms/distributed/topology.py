@@ -0,0 +1,175 @@
+"""
+Ring ordering from a measured link topology.
+
+The ring sends KV from each position to the next, so its throughput is set by the
+slowest hop. Given a pairwise bandwidth (and optionally latency) matrix between the
+ranks of a group, `optimize_ring_order` picks the order of ranks around the ring
+whose slowest hop is fastest. The order is passed to `RingAttentionStrategy` as
+`ring_order`.
+
+Topology files are JSON:
+
+    {"bandwidth": [[...], ...], "latency": [[...], ...]}
+
+with `bandwidth[i][j]` the measured bandwidth from rank i to rank j in GB/s and the
+optional `latency[i][j]` in microseconds. The diagonal is ignored.
+"""
+
+import itertools
+import json
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+
+
+Matrix = Sequence[Sequence[float]]
+
+# exhaustive search up to this many ranks, (n - 1)! orders
+_EXHAUSTIVE_MAX_RANKS = 9
+
+
+def load_topology(path: str) -> Tuple[List[List[float]], Optional[List[List[float]]]]:
+    """Read the (bandwidth, latency) matrices of a topology file."""
+    with open(path, "r") as f:
+        topology = json.load(f)
+    bandwidth = _as_matrix(topology["bandwidth"])
+    latency = topology.get("latency", None)
+    if latency is not None:
+        latency = _as_matrix(latency)
+        if len(latency) != len(bandwidth):
+            raise ValueError(
+                f"latency is {len(latency)}x{len(latency)} but bandwidth is {len(bandwidth)}x{len(bandwidth)}"
+            )
+    return bandwidth, latency
+
+
+def save_topology(
+    path: str, bandwidth: Matrix, latency: Optional[Matrix] = None
+) -> None:
+    """Write a topology file readable by `load_topology`."""
+    topology = {"bandwidth": _as_matrix(bandwidth)}
+    if latency is not None:
+        topology["latency"] = _as_matrix(latency)
+    with open(path, "w") as f:
+        json.dump(topology, f, indent=2)
+
+
+def hop_times(
+    order: Sequence[int],
+    bandwidth: Matrix,
+    latency: Optional[Matrix] = None,
+    message_bytes: Optional[int] = None,
+) -> List[float]:
+    """
+    Cost of every hop `order[i] -> order[i + 1]` of the ring, wrapping around.
+
+    With `message_bytes`, the cost is the transfer time in seconds (latency plus
+    bytes over bandwidth); otherwise it is the inverse bandwidth, which ranks hops
+    the same way for large messages.
+    """
+    costs = []
+    for src, dst in zip(order, list(order[1:]) + list(order[:1])):
+        bw = float(bandwidth[src][dst])
+        if bw <= 0:
+            costs.append(float("inf"))
+            continue
+        if message_bytes is None:
+            costs.append(1.0 / bw)
+            continue
+        lat = float(latency[src][dst]) * 1e-6 if latency is not None else 0.0
+        costs.append(lat + message_bytes / (bw * 1e9))
+    return costs
+
+
+def optimize_ring_order(
+    bandwidth: Matrix,
+    latency: Optional[Matrix] = None,
+    message_bytes: Optional[int] = None,
+) -> List[int]:
+    """
+    The order of ranks around the ring that minimizes the slowest hop (see
+    `hop_times`), ties broken by the total. Starts at rank 0.
+
+    Exact up to 9 ranks; larger rings are built greedily from every start and
+    improved by reversing segments while the slowest hop gets faster.
+    """
+    bandwidth = _as_matrix(bandwidth)
+    n = len(bandwidth)
+    if n <= 2:
+        return list(range(n))
+
+    def cost(order):
+        times = hop_times(order, bandwidth, latency, message_bytes)
+        return max(times), sum(times)
+
+    if n <= _EXHAUSTIVE_MAX_RANKS:
+        # rotations are the same ring, fix rank 0 first
+        return min(
+            ([0] + list(rest) for rest in itertools.permutations(range(1, n))),
+            key=cost,
+        )
+
+    best = None
+    for start in range(n):
+        order = [start]
+        while len(order) < n:
+            last = order[-1]
+            order.append(
+                min(
+                    (r for r in range(n) if r not in order),
+                    key=lambda r: hop_times([last, r], bandwidth, latency, message_bytes)[0],
+                )
+            )
+        order = _improve(order, cost)
+        if best is None or cost(order) < cost(best):
+            best = order
+    zero = best.index(0)
+    return best[zero:] + best[:zero]
+
+
+def row_links(
+    bandwidth: Matrix, latency: Optional[Matrix], row_size: int
+) -> Tuple[List[List[float]], Optional[List[List[float]]]]:
+    """
+    Links between rows of `row_size` consecutive ranks, for rings whose positions
+    are whole groups (e.g. `RingTensorParallelStrategy`, one TP group per row).
+    Every column of a row sends to the same column of the next row at once, so a
+    row-to-row hop gets the slowest bandwidth and the highest latency of them.
+    """
+    bandwidth = _as_matrix(bandwidth)
+    if len(bandwidth) % row_size != 0:
+        raise ValueError(f"{len(bandwidth)} ranks are not rows of {row_size}")
+    rows = len(bandwidth) // row_size
+
+    def reduce(matrix, pick):
+        return [
+            [
+                pick(matrix[a * row_size + c][b * row_size + c] for c in range(row_size))
+                for b in range(rows)
+            ]
+            for a in range(rows)
+        ]
+
+    if latency is not None:
+        latency = reduce(_as_matrix(latency), max)
+    return reduce(bandwidth, min), latency
+
+
+def _improve(order: List[int], cost) -> List[int]:
+    """Reverse segments (2-opt) while it lowers the cost."""
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(order) - 1):
+            for j in range(i + 1, len(order)):
+                candidate = order[:i] + order[i : j + 1][::-1] + order[j + 1 :]
+                if cost(candidate) < cost(order):
+                    order, improved = candidate, True
+    return order
+
+
+def _as_matrix(matrix) -> List[List[float]]:
+    matrix = torch.as_tensor(matrix, dtype=torch.float64)
+    if matrix.ndim != 2 or matrix.size(0) != matrix.size(1):
+        raise ValueError(f"expected a square matrix, got shape {tuple(matrix.shape)}")
+    return matrix.tolist()
@@ -0,0 +1,227 @@
+"""
+Timeline traces of distributed forward passes, in the Chrome trace event format
+that Perfetto (ui.perfetto.dev) and chrome://tracing open.
+
+A `Tracer` given to a `RingAttentionStrategy` (`tracer=`) records, per layer and
+ring hop:
+
+- compute: attention of this rank's queries over one KV block
+- merge: folding that block into the online softmax accumulators
+- send: issuing a ring send (with its bytes)
+- recv_wait: blocking until a ring receive has landed (and other collective
+  waits: allgather_wait, all_to_all_wait)
+- layer: the whole decoder layer
+
+Any other strategy (tensor or model parallel) is traced at module granularity
+by `trace_modules`, which hooks the model's layers and their submodules.
+
+Every rank saves its own trace (`Tracer.save`) and the traces are merged into
+one timeline, one process per rank, with
+
+    python -m fms.distributed.tracing merged.json trace_rank*.json
+
+Timestamps are wall clock; `align_clocks` estimates each rank's offset from rank
+0's clock (over barriers), and merging removes it, so ranks on different hosts
+line up. A span measures host time: on GPU, construct the tracer with
+`synchronize=True` to wait for the device at every span boundary (which
+serializes the streams the ring overlaps, so only the shape of the timeline is
+meaningful there). Tracing is for eager runs, not under `torch.compile`.
+"""
+
+import argparse
+import contextlib
+import json
+import re
+import statistics
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+import torch.distributed as dist
+from torch import nn
+
+
+# timeline row of each span category
+_THREADS = {"layer": 0, "compute": 1, "comm": 2}
+
+
+class Tracer:
+    """Spans of one rank, see the module docstring."""
+
+    def __init__(self, rank: Optional[int] = None, synchronize: bool = False):
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        self.rank = rank
+        self.synchronize = synchronize
+        self.events: List[Dict[str, Any]] = []
+        # this rank's clock minus rank 0's, in microseconds
+        self.clock_offset_us = 0.0
+        self.layer = -1
+        self.hop = 0
+        self._layer_start: Optional[float] = None
+
+    def now_us(self) -> float:
+        return time.time_ns() / 1000
+
+    def _sync(self) -> None:
+        if self.synchronize and torch.cuda.is_available():
+            for device in range(torch.cuda.device_count()):
+                torch.cuda.synchronize(device)
+
+    def add(self, name: str, cat: str, start_us: float, end_us: float, **args) -> None:
+        self.events.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": start_us,
+                "dur": end_us - start_us,
+                "pid": self.rank,
+                "tid": _THREADS[cat],
+                "args": {"layer": self.layer, "hop": self.hop, **args},
+            }
+        )
+
+    @contextlib.contextmanager
+    def span(self, name: str, cat: str, **args):
+        self._sync()
+        start = self.now_us()
+        try:
+            yield
+        finally:
+            self._sync()
+            self.add(name, cat, start, self.now_us(), **args)
+
+    def begin_layer(self, layer: Optional[int] = None) -> None:
+        """Start of a layer (the next one if not given); hops count from 0 again."""
+        self.layer = self.layer + 1 if layer is None else layer
+        self.hop = 0
+        self._sync()
+        self._layer_start = self.now_us()
+
+    def end_layer(self) -> None:
+        if self._layer_start is None:
+            return
+        self._sync()
+        self.add(f"layer {self.layer}", "layer", self._layer_start, self.now_us())
+        self._layer_start = None
+
+    def next_hop(self) -> None:
+        self.hop += 1
+
+    def reset(self) -> None:
+        self.events.clear()
+        self.layer, self.hop, self._layer_start = -1, 0, None
+
+    def align_clocks(self, group: Optional[dist.ProcessGroup] = None, rounds: int = 5) -> float:
+        """
+        Estimate this rank's clock offset from rank 0 of `group`: every rank reads
+        its clock as a barrier releases, and the median difference over `rounds`
+        is kept. Collective. Returns the offset in microseconds.
+        """
+        offsets = []
+        for _ in range(rounds):
+            dist.barrier(group=group)
+            now = self.now_us()
+            gathered: List[Optional[float]] = [None] * dist.get_world_size(group)
+            dist.all_gather_object(gathered, now, group=group)
+            offsets.append(now - gathered[0])
+        self.clock_offset_us = statistics.median(offsets)
+        return self.clock_offset_us
+
+    def trace(self) -> Dict[str, Any]:
+        """This rank's trace as a Chrome trace JSON object."""
+        metadata = [
+            {"name": "process_name", "ph": "M", "pid": self.rank, "args": {"name": f"rank {self.rank}"}},
+            {"name": "process_sort_index", "ph": "M", "pid": self.rank, "args": {"sort_index": self.rank}},
+        ]
+        metadata += [
+            {"name": "thread_name", "ph": "M", "pid": self.rank, "tid": tid, "args": {"name": cat}}
+            for cat, tid in _THREADS.items()
+        ]
+        return {
+            "traceEvents": metadata + self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {"rank": self.rank, "clock_offset_us": self.clock_offset_us},
+        }
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+
+
+def trace_span(tracer: Optional[Tracer], name: str, cat: str, **args):
+    """`tracer.span(...)`, or a no-op without a tracer."""
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.span(name, cat, **args)
+
+
+def trace_modules(
+    model: nn.Module, tracer: Tracer, pattern: str = r"(.*\.)?layers\.\d+(\.[^.]+)?"
+) -> List[Any]:
+    """
+    Trace every module of `model` whose qualified name fully matches `pattern` (by
+    default the numbered layers and their direct submodules) with forward hooks,
+    for strategies the ring hooks don't cover. Layers go on the layer row,
+    submodules on the compute row. Returns the hook handles.
+    """
+    handles = []
+    regex = re.compile(pattern)
+    for name, module in model.named_modules():
+        if not name or not regex.fullmatch(name):
+            continue
+        cat = "layer" if re.search(r"layers\.\d+$", name) else "compute"
+        starts: List[float] = []
+
+        def pre_hook(module, args, starts=starts):
+            tracer._sync()
+            starts.append(tracer.now_us())
+
+        def hook(module, args, output, name=name, cat=cat, starts=starts):
+            tracer._sync()
+            tracer.add(name, cat, starts.pop(), tracer.now_us())
+
+        handles.append(module.register_forward_pre_hook(pre_hook))
+        handles.append(module.register_forward_hook(hook))
+    return handles
+
+
+def merge_traces(traces: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge per-rank traces into one timeline: each rank's clock offset is removed
+    and time starts at the earliest span.
+    """
+    events = []
+    for trace in traces:
+        offset = trace.get("otherData", {}).get("clock_offset_us", 0.0)
+        for event in trace["traceEvents"]:
+            if "ts" in event:
+                event = dict(event, ts=event["ts"] - offset)
+            events.append(event)
+    timed = [e["ts"] for e in events if "ts" in e]
+    origin = min(timed) if timed else 0.0
+    for event in events:
+        if "ts" in event:
+            event["ts"] -= origin
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Merge per-rank traces into one Chrome/Perfetto trace."
+    )
+    parser.add_argument("output", help="merged trace to write")
+    parser.add_argument("traces", nargs="+", help="per-rank traces (Tracer.save)")
+    args = parser.parse_args(argv)
+
+    traces = []
+    for path in args.traces:
+        with open(path, "r") as f:
+            traces.append(json.load(f))
+    with open(args.output, "w") as f:
+        json.dump(merge_traces(traces), f)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,20 @@ Provides GPU-accelerated kernels for computing partial attention statistics
 that can be merged using online softmax. Used by ring attention to compute
 attention over KV blocks received from other ranks.
 """
+from typing import Optional
+
 import triton  # type: ignore[import-untyped]
 import triton.language as tl  # type: ignore[import-untyped]
 import torch
 
+from fms.distributed.ring_mask import RingMask
+
 
 @triton.jit
 def _offdiag_block_stats_kernel(
     Q_ptr, K_ptr, V_ptr,
     query_idx_ptr, key_idx_ptr,
+    doc_ptr, valid_start_ptr, valid_end_ptr,
     Z_ptr, M_ptr, L_ptr,
     B: tl.constexpr, H: tl.constexpr,
     Q_LEN: tl.constexpr, K_LEN: tl.constexpr,
@@ -24,13 +29,25 @@ def _offdiag_block_stats_kernel(
     stride_zb, stride_zh, stride_zq, stride_zd,
     stride_mb, stride_mh, stride_mq,
     stride_lb, stride_lh, stride_lq,
+    stride_db,
     scale,
+    window,
+    prefix_len,
     causal: tl.constexpr,
+    HAS_WINDOW: tl.constexpr,
+    HAS_PREFIX: tl.constexpr,
+    HAS_DOCS: tl.constexpr,
+    HAS_PAD: tl.constexpr,
+    KV_GROUP: tl.constexpr,
     BLOCK_Q: tl.constexpr,
     BLOCK_K: tl.constexpr,
 ):
     """
     Each program handles BLOCK_Q queries for a fixed (b, h), and loops over K in BLOCK_K tiles.
+    Query and key indices are contiguous global positions, so the range of K tiles that
+    can be visible under causality / sliding window is computed up front and fully
+    masked tiles are never loaded. With grouped-query attention, KV_GROUP query heads
+    share each K/V head, so compact K/V are read without expanding them first.
     """
     # print("actually Entering triton kernel")
     # How many query blocks per (b,h)
@@ -44,6 +61,7 @@ def _offdiag_block_stats_kernel(
     rem = pid % bh_blocks
     h_idx = rem // Q_BLOCKS
     q_block_idx = rem % Q_BLOCKS
+    kv_h_idx = h_idx // KV_GROUP
 
     if b_idx >= B:
         return
@@ -78,8 +96,34 @@ def _offdiag_block_stats_kernel(
     l_acc = tl.zeros((BLOCK_Q,), tl.float32)
     z = tl.zeros((BLOCK_Q, D_V), tl.float32)
 
+    if HAS_DOCS:
+        q_doc = tl.load(doc_ptr + b_idx * stride_db + q_pos, mask=q_mask, other=-1)
+    if HAS_PAD:
+        v_start = tl.load(valid_start_ptr + b_idx)
+        v_end = tl.load(valid_end_ptr + b_idx)
+        q_real = (q_pos >= v_start) & (q_pos < v_end)
+
+    # Range of K tiles that may hold visible keys for this query tile
+    k_first = tl.load(key_idx_ptr)
+    q_lo = tl.load(query_idx_ptr) + q_block_idx * BLOCK_Q
+    q_hi = q_lo + tl.minimum(BLOCK_Q, Q_LEN - q_block_idx * BLOCK_Q) - 1
+    k_begin = 0
+    k_end = K_LEN
+    if causal:
+        last_visible = q_hi
+        if HAS_PREFIX:
+            last_visible = tl.maximum(last_visible, prefix_len - 1)
+        k_end = tl.minimum(k_end, last_visible - k_first + 1)
+    if HAS_WINDOW:
+        if not causal:
+            k_end = tl.minimum(k_end, q_hi + window - k_first)
+        first_visible = q_lo - window + 1
+        if HAS_PREFIX:
+            first_visible = tl.where(k_first < prefix_len, k_first, first_visible)
+        k_begin = (tl.maximum(first_visible - k_first, 0) // BLOCK_K) * BLOCK_K
+
     # Loop over K in BLOCK_K tiles
-    for k_start in range(0, K_LEN, BLOCK_K):
+    for k_start in range(k_begin, k_end, BLOCK_K):
         k_offsets = k_start + tl.arange(0, BLOCK_K)
         k_mask = k_offsets < K_LEN
 
@@ -87,7 +131,7 @@ def _offdiag_block_stats_kernel(
         K_tile_ptr = (
             K_ptr
             + b_idx * stride_kb
-            + h_idx * stride_kh
+            + kv_h_idx * stride_kh
             + k_offsets[:, None] * stride_kk
             + d_offsets[None, :] * stride_kd
         )
@@ -101,7 +145,7 @@ def _offdiag_block_stats_kernel(
         V_tile_ptr = (
             V_ptr
             + b_idx * stride_vb
-            + h_idx * stride_vh
+            + kv_h_idx * stride_vh
             + k_offsets[:, None] * stride_vk
             + dv_offsets[None, :] * stride_vd
         )
@@ -114,13 +158,27 @@ def _offdiag_block_stats_kernel(
         # scores_tile: [BLOCK_Q, BLOCK_K] = Q_tile @ K_tile^T / scale
         scores = tl.dot(Q_tile, tl.trans(K_tile)) / scale
 
-        # Causal mask: key_pos > query_pos → -inf
+        # Positional mask (causal / sliding window / prefix-LM)
+        # shapes: q_pos: [BLOCK_Q], key_pos: [BLOCK_K], broadcast to [BLOCK_Q, BLOCK_K]
+        key_pos = tl.load(key_idx_ptr + k_offsets, mask=k_mask, other=0)
+        visible = (q_pos[:, None] >= 0) & (key_pos[None, :] >= 0)
         if causal:
-            key_pos = tl.load(key_idx_ptr + k_offsets, mask=k_mask, other=0)
-            # shapes: q_pos: [BLOCK_Q], key_pos: [BLOCK_K]
-            # broadcast to [BLOCK_Q, BLOCK_K]
-            is_future = (key_pos[None, :] > q_pos[:, None])
-            scores = tl.where(is_future & q_mask[:, None] & k_mask[None, :], NEG_INF, scores)
+            visible = visible & (key_pos[None, :] <= q_pos[:, None])
+        if HAS_WINDOW:
+            rel = q_pos[:, None] - key_pos[None, :]
+            visible = visible & (rel < window) & (rel > -window)
+        if HAS_PREFIX:
+            visible = visible | (key_pos[None, :] < prefix_len)
+
+        # Per-sequence structure (packed documents / padding)
+        if HAS_DOCS:
+            k_doc = tl.load(doc_ptr + b_idx * stride_db + key_pos, mask=k_mask, other=-2)
+            visible = visible & (q_doc[:, None] == k_doc[None, :])
+        if HAS_PAD:
+            k_real = (key_pos >= v_start) & (key_pos < v_end)
+            visible = visible & (q_real[:, None] == k_real[None, :])
+
+        scores = tl.where(visible, scores, NEG_INF)
 
         # Mask out invalid (q,k) pairs
         scores = tl.where(q_mask[:, None] & k_mask[None, :], scores, NEG_INF)
@@ -175,12 +233,12 @@ def _offdiag_block_stats_kernel(
 
 def block_softmax_stats_triton(
     Q: torch.Tensor,           # [B,H,Q_len,D_k]
-    K: torch.Tensor,           # [B,H,K_len,D_k]
-    V: torch.Tensor,           # [B,H,K_len,D_v]
+    K: torch.Tensor,           # [B,H_kv,K_len,D_k]
+    V: torch.Tensor,           # [B,H_kv,K_len,D_v]
     query_indices: torch.Tensor,
     key_indices: torch.Tensor,
     scale: float,
-    mask: torch.Tensor | None,
+    mask: Optional[RingMask],
     causal: bool,
     block_q: int = 32,
     block_k: int = 64,
@@ -188,17 +246,24 @@ def block_softmax_stats_triton(
     """
     Triton kernel for block-wise attention stats (z, l, m) used in online softmax.
     Returns partial results that can be merged across ring iterations.
+
+    `query_indices` and `key_indices` must be contiguous ranges of global positions.
+    The optional `RingMask` is evaluated inside the kernel, so no dense mask is built;
+    when it is given, its `causal` flag takes precedence over `causal`.
+    K and V may have fewer heads than Q (grouped-query attention).
     """
     assert Q.is_cuda and K.is_cuda and V.is_cuda
     B, H, Q_len, D_k = Q.shape
-    _, _, K_len, D_v = V.shape
+    _, H_kv, K_len, D_v = V.shape
+    assert H % H_kv == 0, f"{H} query heads can't share {H_kv} kv heads"
 
     device = Q.device
 
-    # ensure contiguous for nicer strides
-    Q = Q.contiguous()
-    K = K.contiguous()
-    V = V.contiguous()
+    # the kernel takes explicit strides, so only the head dim needs to be dense
+    # (slices along the sequence dim are used without a copy)
+    Q = Q if Q.stride(-1) == 1 else Q.contiguous()
+    K = K if K.stride(-1) == 1 else K.contiguous()
+    V = V if V.stride(-1) == 1 else V.contiguous()
     # outputs in fp32 accum dtype
     z_block = torch.zeros((B, H, Q_len, D_v), dtype=torch.float32, device=device)
     l_block = torch.zeros((B, H, Q_len, 1),  dtype=torch.float32, device=device)
@@ -206,6 +271,23 @@ def block_softmax_stats_triton(
     query_indices = query_indices.to(device=device, dtype=torch.long)
     key_indices   = key_indices.to(device=device, dtype=torch.long)
 
+    window, prefix_len = 0, 0
+    has_docs = has_pad = False
+    doc_ids, valid_start, valid_end = query_indices, query_indices, query_indices
+    stride_db = 0
+    if mask is not None:
+        causal = mask.causal
+        window = mask.sliding_window or 0
+        prefix_len = mask.prefix_len
+        if mask.document_ids is not None:
+            has_docs = True
+            doc_ids = mask.document_ids.to(device=device, dtype=torch.long).expand(B, -1).contiguous()
+            stride_db = doc_ids.stride(0)
+        if mask.valid_start is not None and mask.valid_end is not None:
+            has_pad = True
+            valid_start = mask.valid_start.to(device=device, dtype=torch.long)
+            valid_end = mask.valid_end.to(device=device, dtype=torch.long)
+
     stride_qb, stride_qh, stride_qq, stride_qd = Q.stride()
     stride_kb, stride_kh, stride_kk, stride_kd = K.stride()
     stride_vb, stride_vh, stride_vk, stride_vd = V.stride()
@@ -218,6 +300,7 @@ def block_softmax_stats_triton(
     _offdiag_block_stats_kernel[grid](
         Q, K, V,
         query_indices, key_indices,
+        doc_ids, valid_start, valid_end,
         z_block, m_block, l_block,
         B, H, Q_len, K_len, D_k, D_v,
         stride_qb, stride_qh, stride_qq, stride_qd,
@@ -226,8 +309,16 @@ def block_softmax_stats_triton(
         stride_zb, stride_zh, stride_zq, stride_zd,
         stride_mb, stride_mh, stride_mq,
         stride_lb, stride_lh, stride_lq,
+        stride_db,
         scale,
+        window,
+        prefix_len,
         causal=causal,
+        HAS_WINDOW=window > 0,
+        HAS_PREFIX=prefix_len > 0,
+        HAS_DOCS=has_docs,
+        HAS_PAD=has_pad,
+        KV_GROUP=H // H_kv,
         BLOCK_Q=block_q,
         BLOCK_K=block_k,
         num_warps=4,
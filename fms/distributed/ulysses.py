@@ -0,0 +1,117 @@
+"""
+DeepSpeed-Ulysses sequence parallel attention, registered as the "ulysses"
+attention op.
+
+`UlyssesStrategy` shards the sequence before the first distributed layer and routes
+every layer's attention through this op. Q/K/V arrive sharded by sequence; an
+all-to-all regroups them by head over the full sequence, attention runs locally
+with the sdpa op, and a second all-to-all returns the output sharded by sequence.
+Heads can be assigned unevenly across ranks (`UlyssesStrategy.head_counts`).
+"""
+
+from typing import Optional
+
+import torch
+from torch import Tensor
+from typing_extensions import Unpack
+
+from fms.distributed.ring_attention import (
+    _MASK_VALUE,
+    RingAttentionKwargs,
+    _ring_masks,
+    _ring_store_op,
+)
+from fms.modules.attention import get_attention_type, register_attention_op
+
+
+def _ulysses_compute_op(
+    query: Tensor,
+    key_cache: Tensor,
+    value_cache: Tensor,
+    nheads: int,
+    kvheads: int,
+    p_dropout: float,
+    scale_factor: Optional[float],
+    **attn_kwargs: Unpack[RingAttentionKwargs],
+) -> Tensor:
+    strategy = attn_kwargs["ring_strategy"]
+
+    # no transpose in the store op without a cache, same check as sdpa
+    if key_cache.shape[1] != kvheads and key_cache.shape[2] == kvheads:
+        key_cache = key_cache.transpose(2, 1)
+        value_cache = value_cache.transpose(2, 1)
+    # b x h x len x d -> b x len x h x d, the layout the all-to-all splits heads of
+    keys = key_cache.transpose(2, 1)
+    values = value_cache.transpose(2, 1)
+
+    q_counts, kv_counts, expand = strategy.head_counts(nheads, kvheads)
+    if expand:
+        keys = keys.repeat_interleave(nheads // kvheads, dim=2)
+        values = values.repeat_interleave(nheads // kvheads, dim=2)
+
+    queries = strategy.seq_to_heads(query, q_counts)
+    keys = strategy.seq_to_heads(keys, kv_counts)
+    values = strategy.seq_to_heads(values, kv_counts)
+
+    local_heads, local_kvheads = q_counts[strategy.rank], kv_counts[strategy.rank]
+    if local_heads == 0:
+        attn = query.new_empty(query.size(0), queries.size(1), 0, values.size(-1))
+        return strategy.heads_to_seq(attn, q_counts)
+
+    mask, causal = _full_mask(
+        queries, local_heads, q_counts, strategy.rank, **attn_kwargs
+    )
+    attn = get_attention_type(attn_name="sdpa_causal")["compute_prefill"](
+        queries,
+        keys.transpose(2, 1),
+        values.transpose(2, 1),
+        local_heads,
+        local_kvheads,
+        p_dropout,
+        scale_factor,
+        mask=mask,
+        is_causal_mask=causal,
+    )
+    return strategy.heads_to_seq(attn, q_counts)
+
+
+def _full_mask(queries, local_heads, q_counts, rank, **attn_kwargs):
+    """
+    The (mask, is_causal) to run this rank's heads over the full sequence with:
+    plain causal or bidirectional attention needs no mask, anything else (padding,
+    windows, position bias) becomes one additive b x heads x len x len mask.
+    """
+    mask = attn_kwargs.get("mask", None)
+    causal = attn_kwargs.get("is_causal_mask", mask is None)
+    sliding_window = attn_kwargs.get("sliding_window", None)
+    position_bias = attn_kwargs.get("position_bias", None)
+
+    ring_mask, dense_mask = _ring_masks(mask, causal, sliding_window)
+    plain = (
+        ring_mask.valid_start is None
+        and ring_mask.document_ids is None
+        and ring_mask.sliding_window is None
+        and ring_mask.prefix_len == 0
+    )
+    if plain and dense_mask is None and position_bias is None:
+        return None, ring_mask.causal
+
+    seq_len = queries.size(1)
+    idx = torch.arange(seq_len, device=queries.device)
+    allowed = ring_mask.block_mask(idx, idx)
+    full = torch.zeros(allowed.shape, device=queries.device, dtype=queries.dtype)
+    full = full.masked_fill(~allowed, _MASK_VALUE)
+    if dense_mask is not None:
+        if dense_mask.dtype == torch.bool:
+            dense_mask = torch.zeros(
+                dense_mask.shape, device=full.device, dtype=full.dtype
+            ).masked_fill(~dense_mask, _MASK_VALUE)
+        full = full + dense_mask.to(full.dtype)
+    if position_bias is not None:
+        head_start = sum(q_counts[:rank])
+        bias = position_bias(idx, idx)[:, head_start : head_start + local_heads]
+        full = full + bias.to(full.dtype)
+    return full, False
+
+
+register_attention_op("ulysses", _ring_store_op, _ulysses_compute_op)
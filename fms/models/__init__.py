@@ -19,7 +19,12 @@ from fms.distributed.strategy import (
     TensorParallelStrategy,
     UniformModelParallelStrategy,
     RingAttentionStrategy,
+    HierarchicalRingAttentionStrategy,
+    UlyssesStrategy,
+    RingTensorParallelStrategy,
 )
+from fms.distributed.link_probe import probe_links
+from fms.distributed.topology import load_topology, optimize_ring_order, row_links
 from fms.modules import UninitializedModule
 from fms.utils import gptq, serialization
 
@@ -324,7 +329,11 @@ def get_model(
                 the variant will refer to the hf model_id_or_path.
     model_path: the path to the state_dict of weights. If None, don't load.
     device_type: where to load the model
-    distributed_strategy: None, 'fsdp', 'hsdp', 'tp', or 'mp'.
+    distributed_strategy: None, 'fsdp', 'hsdp', 'tp', 'mp', 'ring', 'ulysses' or
+                'ring_tp'. The context parallel strategies ('ring', 'ulysses',
+                'ring_tp') need `block_lens`; 'ring' and 'ring_tp' only run
+                prefill, a forward pass with a KV cache to decode from raises a
+                ValueError.
     checkpoint_sharding: how the checkpoint files are sharded: None, 'tp',
                 'fsdp', or 'layer'. If None, guess based on files.
     source: If the weights in the state dict didn't come from an FMS model,
@@ -411,12 +420,72 @@ def get_model(
             extra_args["distributed_strategy"] = UniformModelParallelStrategy(
                 devices, _guess_num_layers(lazy_sd)
             )
-        elif distributed_strategy == "ring":
-            print("using ring attention")
+        elif distributed_strategy in ("ring", "ring_tp"):
             block_lens = kwargs.pop("block_lens", None)
             if block_lens is None:
-                raise ValueError("block_lens required for ring attention strategy")
-            extra_args["distributed_strategy"] = RingAttentionStrategy(block_lens=block_lens,group=group)
+                raise ValueError(
+                    f"block_lens required for {distributed_strategy} strategy"
+                )
+            # a ring_tp ring runs over rows of tp_size ranks, one TP group each
+            tp_size = 1
+            if distributed_strategy == "ring_tp":
+                tp_size = kwargs.pop("tp_size", None)
+                if tp_size is None:
+                    raise ValueError("tp_size required for ring_tp strategy")
+            ring_order = kwargs.pop("ring_order", None)
+            ring_topology = kwargs.pop("ring_topology", None)
+            if ring_order is None and ring_topology is not None:
+                if ring_topology == "probe":
+                    links = probe_links(group)
+                    bandwidth, latency = links.bandwidth, links.latency
+                else:
+                    bandwidth, latency = load_topology(ring_topology)
+                ring_order = optimize_ring_order(
+                    *row_links(bandwidth, latency, tp_size)
+                )
+            # popped before choosing the strategy, so none reach the model
+            ring_kwargs = dict(
+                ring_order=ring_order,
+                bidirectional=kwargs.pop("ring_bidirectional", False),
+                mode=kwargs.pop("ring_mode", "pass_kv"),
+                chunk_size=kwargs.pop("ring_chunk_size", None),
+                prefetch_depth=kwargs.pop("ring_prefetch_depth", 1),
+                profile=kwargs.pop("ring_profile", False),
+                kv_compression=kwargs.pop("ring_kv_compression", None),
+                calibrate=kwargs.pop("ring_calibrate", False),
+                sliding_window=kwargs.pop("ring_sliding_window", False),
+            )
+            ranks_per_node = kwargs.pop("ranks_per_node", None)
+            if distributed_strategy == "ring_tp":
+                if ranks_per_node is not None:
+                    raise ValueError("ranks_per_node does not apply to ring_tp")
+                print("using ring attention over tensor parallel groups")
+                extra_args["distributed_strategy"] = RingTensorParallelStrategy(
+                    block_lens=block_lens, tp_size=tp_size, **ring_kwargs
+                )
+            elif ranks_per_node is not None:
+                print("using ring attention")
+                extra_args["distributed_strategy"] = HierarchicalRingAttentionStrategy(
+                    block_lens=block_lens,
+                    ranks_per_node=ranks_per_node,
+                    group=group,
+                    **ring_kwargs,
+                )
+            else:
+                print("using ring attention")
+                extra_args["distributed_strategy"] = RingAttentionStrategy(
+                    block_lens=block_lens, group=group, **ring_kwargs
+                )
+        elif distributed_strategy == "ulysses":
+            print("using ulysses sequence parallel")
+            block_lens = kwargs.pop("block_lens", None)
+            if block_lens is None:
+                raise ValueError("block_lens required for ulysses strategy")
+            extra_args["distributed_strategy"] = UlyssesStrategy(
+                block_lens=block_lens,
+                head_weights=kwargs.pop("head_weights", None),
+                group=group,
+            )
 
     # Create the model on meta device to allocate weights lazily
     fms_model = _get_model_instance(
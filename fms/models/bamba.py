@@ -152,6 +152,7 @@ class BambaBlock(nn.Module):
                 use_cache=use_cache,
                 cache_position=cache_position,
                 mask=attn_kwargs.get("mask", None),
+                ring_strategy=attn_kwargs.get("ring_strategy", None),
             )
         else:
             x = self.attn(
@@ -26,7 +26,11 @@ from torch import nn
 
 from fms.utils.config import ModelConfig
 from fms import models
-from fms.distributed.strategy import DistributedStrategy, NoOpStrategy
+from fms.distributed.strategy import (
+    DistributedStrategy,
+    NoOpStrategy,
+    RingAttentionStrategy,
+)
 from fms.modules.attention import (
     AttentionKwargs,
     MultiHeadAttention,
@@ -195,20 +199,27 @@ class MpnetHeadless(nn.Module):
         ret += torch.where(is_small, n, val_if_large)
         return ret
 
-    def compute_position_bias(self, x, num_buckets=32):
-        bsz, qlen, klen = x.size(0), x.size(1), x.size(1)
-        device = x.device
-        context_position = torch.arange(qlen, dtype=torch.long, device=device)[:, None]
-        memory_position = torch.arange(klen, dtype=torch.long, device=device)[None, :]
-
-        relative_position = memory_position - context_position
+    def relative_position_bias(
+        self, query_positions: torch.Tensor, key_positions: torch.Tensor, num_buckets=32
+    ) -> torch.Tensor:
+        """1 x nheads x len(query_positions) x len(key_positions) attention bias"""
+        relative_position = key_positions[None, :] - query_positions[:, None]
 
         rp_bucket = self.relative_position_bucket(
             relative_position, num_buckets=num_buckets
         )
-        rp_bucket = rp_bucket.to(x.device)
         values = self.relative_attention_bias(rp_bucket)
-        values = values.permute([2, 0, 1]).unsqueeze(0)
+        return values.permute([2, 0, 1]).unsqueeze(0)
+
+    def compute_position_bias(self, x, num_buckets=32):
+        bsz, qlen, klen = x.size(0), x.size(1), x.size(1)
+        device = x.device
+        context_position = torch.arange(qlen, dtype=torch.long, device=device)
+        memory_position = torch.arange(klen, dtype=torch.long, device=device)
+
+        values = self.relative_position_bias(
+            context_position, memory_position, num_buckets=num_buckets
+        )
         values = values.expand((bsz, -1, qlen, klen)).contiguous()
         return values
 
@@ -254,13 +265,23 @@ class MpnetHeadless(nn.Module):
         embeddings = self.enc_norm(embeddings)
         embeddings = self.dropout(embeddings)
 
+        if isinstance(self.distributed_strategy, RingAttentionStrategy):
+            # the ring evaluates the bias per KV block, the mask stays as given
+            kwargs["position_bias"] = self.relative_position_bias
+            attn_mask = kwargs.get("mask")
+        else:
+            attn_mask = self._sdpa_mask(embeddings, kwargs.get("mask"))
+        kwargs["mask"] = attn_mask
+
+        x = embeddings
+        for layer in self.layers:
+            x = layer(x, position_ids=position_ids, **kwargs)
+        return x
+
+    def _sdpa_mask(self, embeddings, attn_mask):
         position_bias = self.compute_position_bias(embeddings)
         # injecting position_bias as part of sdpa attn_mask
         # FIXME for other attentions
-        if kwargs.get("mask") is not None:
-            attn_mask = kwargs.get("mask")
-        else:
-            attn_mask = None
         if attn_mask is not None:
             while len(attn_mask.size()) != 4:
                 # expects bs (x nheads) x q_len x kv_len
@@ -272,12 +293,7 @@ class MpnetHeadless(nn.Module):
                 attn_mask = attn_mask + position_bias
         else:
             attn_mask = position_bias
-        kwargs["mask"] = attn_mask
-
-        x = embeddings
-        for layer in self.layers:
-            x = layer(x, position_ids=position_ids, **kwargs)
-        return x
+        return attn_mask
 
 
 class Mpnet(nn.Module):
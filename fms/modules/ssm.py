@@ -3,6 +3,7 @@ from typing import Optional
 import torch
 import torch.nn as nn
 
+from fms.distributed.ring_mask import RingMask
 from fms.utils.activation import str_to_activation
 
 
@@ -156,6 +157,33 @@ def apply_mask_to_padding_states(hidden_states, attention_mask):
     return hidden_states
 
 
+def shard_padding_keep(mask, start: int, length: int) -> Optional[torch.Tensor]:
+    """
+    [bsz, length] boolean that is False on the pad tokens of a context parallel
+    shard starting at global position `start`, or None without padding. `mask`
+    covers the global sequence (a `RingMask` or a dense mask as above).
+    """
+    if isinstance(mask, RingMask):
+        if not mask.has_padding:
+            return None
+        assert mask.valid_start is not None and mask.valid_end is not None
+        positions = torch.arange(start, start + length, device=mask.valid_start.device)
+        return (positions >= mask.valid_start[:, None]) & (
+            positions < mask.valid_end[:, None]
+        )
+    if mask is None or mask.shape[1] <= 1 or mask.shape[0] <= 1:
+        return None
+    return mask[:, -1, start : start + length] == 0
+
+
+def apply_keep_to_padding_states(hidden_states, keep):
+    """Same as `apply_mask_to_padding_states` for a `shard_padding_keep` mask"""
+    if keep is None:
+        return hidden_states
+    dtype = hidden_states.dtype
+    return (hidden_states * keep[..., None].to(hidden_states.device)).to(dtype)
+
+
 class SSM(nn.Module):
     def __init__(
         self,
@@ -223,19 +251,137 @@ class SSM(nn.Module):
         self.time_step_max = 0.1
         self.out_proj = nn.Linear(self.intermediate_size, self.emb_dim, bias=use_bias)
 
+    def _context_parallel_conv_prefix(self, hidden_states_B_C_transposed, strategy):
+        """
+        The conv_kernel - 1 (pre-conv) inputs preceding this rank's shard, taken from
+        the tails of the preceding ranks (more than one if shards are short).
+        """
+        width = self.conv_kernel_size - 1
+        seq_len = hidden_states_B_C_transposed.size(-1)
+        tail = hidden_states_B_C_transposed[..., max(seq_len - width, 0) :]
+        tail = nn.functional.pad(tail, (0, width - tail.size(-1)))
+        tails = strategy.gather_boundary(tail)
+
+        prefix = torch.zeros_like(tail)
+        for rank in range(strategy.rank):
+            rank_tail = tails[rank][..., : min(width, strategy.shard_len(rank))]
+            prefix = torch.cat([prefix, rank_tail], dim=-1)[..., -width:]
+        return prefix
+
+    def _context_parallel_state_in(self, ssm_state, shard_decay, strategy):
+        """
+        The SSM state entering this rank's shard, from the final states and total
+        decays of the preceding ranks (one all-gather for both).
+
+        ssm_state: [bsz, num_heads, head_dim, state_size]
+        shard_decay: [bsz, num_heads]
+        """
+        boundary = torch.cat([ssm_state.flatten(1), shard_decay], dim=1)
+        boundaries = strategy.gather_boundary(boundary)
+        state_in = torch.zeros_like(ssm_state)
+        for rank in range(strategy.rank):
+            prev_state, prev_decay = boundaries[rank].split(
+                [boundary.size(1) - self.nheads, self.nheads], dim=1
+            )
+            state_in = state_in * torch.exp(prev_decay)[..., None, None]
+            state_in = state_in + prev_state.view_as(ssm_state)
+        return state_in
+
+    def _context_parallel_empty_shard(self, input_states, past_key_value_state, strategy):
+        """
+        A rank with an empty shard adds no inputs, state or decay, but still takes
+        part in the boundary exchanges, so the conv context and the SSM state of the
+        preceding ranks pass through it unchanged.
+        """
+        batch_size = input_states.size(0)
+        conv_input = input_states.new_zeros(batch_size, self.conv_dim, 0)
+        if self.conv_kernel_size > 1:
+            conv_input = self._context_parallel_conv_prefix(conv_input, strategy)
+        ssm_state = torch.zeros(
+            batch_size,
+            self.nheads,
+            self.head_dim,
+            self.ssm_state_size,
+            device=input_states.device,
+            dtype=torch.float32,
+        )
+        shard_decay = ssm_state.new_zeros(batch_size, self.nheads)
+        ssm_state = self._context_parallel_state_in(ssm_state, shard_decay, strategy)
+
+        if past_key_value_state is not None:
+            conv_states = nn.functional.pad(
+                conv_input, (self.conv_kernel_size - conv_input.shape[-1], 0)
+            )
+            past_key_value_state.conv_state.copy_(conv_states)
+            past_key_value_state.ssm_state.copy_(ssm_state)
+        return input_states.new_zeros(batch_size, 0, self.emb_dim), past_key_value_state
+
+    def _context_parallel_fixup(self, y, C, A_cumsum, ssm_state, strategy):
+        """
+        The chunked scan of a shard starts from a zero state. Exchange each rank's
+        final state and total decay, build the state entering this shard from those
+        of the preceding ranks, and add its contribution to `y` and the final state.
+
+        y: [bsz, (padded) seq_len, num_heads, head_dim]
+        C: [bsz, -1, chunk_size, num_heads, state_size]
+        A_cumsum: [bsz, num_heads, -1, chunk_size]
+        ssm_state: [bsz, num_heads, head_dim, state_size]
+        """
+        batch_size = y.size(0)
+
+        # inclusive decay from the start of the shard to each position
+        chunk_decay = A_cumsum[..., -1]
+        chunk_offset = torch.cumsum(chunk_decay, dim=-1) - chunk_decay
+        decay_from_start = (A_cumsum + chunk_offset[..., None]).flatten(2)
+        shard_decay = decay_from_start[..., -1]  # padded positions add no decay
+
+        state_in = self._context_parallel_state_in(ssm_state, shard_decay, strategy)
+
+        # C_t . (decay_t * state_in), [bsz, seq_len, num_heads, head_dim]
+        C = C.reshape(batch_size, -1, self.nheads, self.ssm_state_size)
+        y_in = (C[..., None, :] * state_in[:, None, ...]).sum(dim=-1)
+        y_in = y_in * torch.exp(decay_from_start).transpose(1, 2)[..., None]
+
+        ssm_state = state_in * torch.exp(shard_decay)[..., None, None] + ssm_state
+        return y + y_in, ssm_state
+
     def forward(
         self,
         input_states,
         mask,
         past_key_value_state: Optional[SSMCacheUnit] = None,
         cache_position: Optional[torch.Tensor] = None,
+        ring_strategy=None,
         **kwargs,
     ):
+        """
+        ring_strategy: Optional[RingAttentionStrategy]
+            if given with more than one rank, `input_states` is this rank's shard of
+            the sequence: the conv reads its left context from the preceding ranks
+            and the scan is fixed up with the state carried in from them (prefill
+            only)
+        """
         batch_size, seq_len, _ = input_states.shape
         dtype = input_states.dtype
 
+        context_parallel = ring_strategy is not None and ring_strategy.world_size > 1
+        keep = None
+        if context_parallel:
+            if past_key_value_state is not None and past_key_value_state.has_previous_state:
+                raise ValueError(
+                    "context parallel SSM layers only support prefill; decode with a "
+                    "model that is not context parallel"
+                )
+            if seq_len == 0:
+                return self._context_parallel_empty_shard(
+                    input_states, past_key_value_state, ring_strategy
+                )
+            keep = shard_padding_keep(mask, ring_strategy.local_q_start, seq_len)
+            mask = None
+
         # 1. Gated MLP's linear projection
         input_states = apply_mask_to_padding_states(input_states, mask)
+        input_states = apply_keep_to_padding_states(input_states, keep)
         projected_states = self.in_proj(input_states)
         gate, hidden_states_B_C, dt = projected_states.split(
             [self.intermediate_size, self.conv_dim, self.nheads], dim=-1
@@ -274,6 +420,18 @@ class SSM(nn.Module):
             hidden_states_B_C = self.act(hidden_states_B_C)
         else:
             hidden_states_B_C_transposed = hidden_states_B_C.transpose(1, 2)
+            conv_offset = 0
+            if context_parallel and self.conv_kernel_size > 1:
+                hidden_states_B_C_transposed = torch.cat(
+                    [
+                        self._context_parallel_conv_prefix(
+                            hidden_states_B_C_transposed, ring_strategy
+                        ),
+                        hidden_states_B_C_transposed,
+                    ],
+                    dim=-1,
+                )
+                conv_offset = self.conv_kernel_size - 1
 
             # Init cache
             if past_key_value_state is not None:
@@ -284,10 +442,13 @@ class SSM(nn.Module):
                 past_key_value_state.conv_state.copy_(conv_states)
 
             hidden_states_B_C = self.act(
-                self.conv1d(hidden_states_B_C_transposed)[..., :seq_len].transpose(1, 2)
+                self.conv1d(hidden_states_B_C_transposed)[
+                    ..., conv_offset : conv_offset + seq_len
+                ].transpose(1, 2)
             )
 
         hidden_states_B_C = apply_mask_to_padding_states(hidden_states_B_C, mask)
+        hidden_states_B_C = apply_keep_to_padding_states(hidden_states_B_C, keep)
         hidden_states, B, C = torch.split(
             hidden_states_B_C,
             [
@@ -459,6 +620,11 @@ class SSM(nn.Module):
             # [bsz, -1, self.chunk_size, num_heads, head_dim] -> [bsz, (padded) seq_len, num_heads, head_dim]
             y = y.reshape(batch_size, -1, self.nheads, self.head_dim)
 
+            if context_parallel:
+                y, ssm_state = self._context_parallel_fixup(
+                    y, C, A_cumsum, ssm_state, ring_strategy
+                )
+
             y = y + D_residual
             # Cutting off padded chunks
             if pad_size > 0:
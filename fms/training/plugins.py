@@ -1,3 +1,4 @@
+import math
 import os
 from abc import abstractmethod
 from datetime import datetime
@@ -14,6 +15,7 @@ from torch.optim import Optimizer
 
 from fms import utils
 from fms.datasets.util import SavableDataset
+from fms.distributed.ring_metrics import collect_ring_metrics
 from fms.utils import generation, print0
 from fms.utils.tokenizers import BaseTokenizer
 
@@ -115,6 +117,13 @@ class MetricReporter(TrainerPlugin):
     A training plugin to periodically log metrics. Logs every `seconds`
     seconds by calling `writer` with the log message. A custom writer
     should accept `*args` similar to `print`.
+
+    With a profiled `ring_strategy` (`RingAttentionStrategy(profile=True)`),
+    also reports the ring's straggler score and its most idle rank's share of
+    time spent waiting (see `fms.distributed.ring_metrics`). The ranks of the
+    ring then report at the same steps, as decided by its first rank, which
+    also schedules the next step worth asking it about; the ranks only
+    synchronize at those steps.
     """
 
     # TODO: add optional validation dataloader and validation loss.
@@ -128,6 +137,7 @@ class MetricReporter(TrainerPlugin):
         cumulative_tokens: int = 0,
         device="cpu",
         writer=print0,
+        ring_strategy=None,
     ):
         super().__init__(1)
         self.seconds = seconds
@@ -140,6 +150,9 @@ class MetricReporter(TrainerPlugin):
         self.last_step = -1
         self.group = group
         self.writer = writer
+        self.ring_strategy = ring_strategy
+        # the first step the ring's ranks agree on whether to report, see `_ring_agree`
+        self._ring_next_check = 0
 
     def step(
         self, epoch: int, step: int, metrics: Dict = {}, end_of_epoch: bool = False
@@ -157,12 +170,14 @@ class MetricReporter(TrainerPlugin):
             self.last_step = 0
             steps = step - self.last_reported_step
             self.last_reported_step = 0
+            self._ring_next_check = 0
         else:
             self.last_step = step
-            if step == self.last_reported_step:
-                return
-            steps_taken = step - self.last_reported_step
-            if steps_taken * self.time_per_step < self.seconds:
+            report = step != self.last_reported_step
+            if report:
+                steps_taken = step - self.last_reported_step
+                report = bool(steps_taken * self.time_per_step >= self.seconds)
+            if not self._ring_agree(step, report, elapsed):
                 return
             time_per_step = elapsed / (step - self.last_reported_step)
             self.time_per_step.fill_(time_per_step)
@@ -197,6 +212,11 @@ class MetricReporter(TrainerPlugin):
                 "gpu_utzn": f"{torch.cuda.utilization()}%",
             }
             more_metrics.update(nvidia_metrics)
+        if self.ring_strategy is not None:
+            ring_metrics = collect_ring_metrics(self.ring_strategy)
+            if ring_metrics is not None:
+                more_metrics["ring_straggler"] = f"{ring_metrics.straggler_score:.3f}"
+                more_metrics["ring_idle"] = f"{max(ring_metrics.idle_fraction):.1%}"
 
         self.last_reported_time = current_time
 
@@ -206,6 +226,39 @@ class MetricReporter(TrainerPlugin):
         to_report.update(more_metrics)
         self.writer(epoch, step, current_time, to_report)
 
+    def _ring_agree(self, step: int, report: bool, elapsed: float) -> bool:
+        """
+        Whether every rank of the ring reports this step. Collecting the ring
+        metrics is collective, so the ranks follow the first rank's clock instead
+        of each deciding on its own. Along with its decision the first rank sends
+        the next step its clock could report at, and no rank reports (or asks)
+        before it.
+        """
+        strategy = self.ring_strategy
+        if strategy is None or strategy.world_size == 1:
+            return report
+        if step < self._ring_next_check:
+            return False
+
+        # the step after which `seconds` have passed at this rank's pace
+        last_step = step if report else self.last_reported_step
+        if report:
+            time_per_step = elapsed / (step - self.last_reported_step)
+        else:
+            time_per_step = self.time_per_step.item()
+        next_check = step + 1
+        if time_per_step > 0:
+            steps_needed = math.ceil(self.seconds / time_per_step)
+            next_check = max(next_check, last_step + steps_needed)
+        # negated if the first rank reports at this step
+        decision = torch.tensor(
+            -next_check if report else next_check, device=self.time_per_step.device
+        )
+        dist.broadcast(decision, src=strategy._global_rank(0), group=strategy.group)
+        agreed = int(decision.item())
+        self._ring_next_check = abs(agreed)
+        return agreed < 0
+
 
 class Checkpointer(TrainerPlugin):
     """
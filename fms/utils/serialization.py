@@ -528,7 +528,10 @@ def load_state_dict_into_model(
         adapter_kwargs["model_config"] = model.config
 
     # 2. Decide if model needs sharding and how (for now only TP)
-    needs_tp_sharding = checkpoint_sharding != "tp" and distributed_strategy == "tp"
+    needs_tp_sharding = checkpoint_sharding != "tp" and distributed_strategy in (
+        "tp",
+        "ring_tp",
+    )
 
     # 3. Iterate over the weights and load them into the model
     used_keys = set()
@@ -9,21 +9,29 @@ import os
 from fms.distributed.strategy import RingAttentionStrategy
 from fms.modules.attention import MultiHeadAttention
 from fms.modules.positions import RotaryEmbedding
-from fms.distributed.ring_attention import _ring_attention_pass_kv, reset_layer_counter
+from fms.distributed.ring_attention import ring_attention, reset_layer_counter
+from fms.distributed.performance_profile import PerformanceProfile
+from fms.distributed.perf_model import OnlinePerformanceModel, record_forward
+from fms.distributed.emulation import HeteroEmulator
+from fms.distributed.tracing import Tracer
+from fms.distributed.ring_metrics import collect_ring_metrics
 from empirical_normalized_perf import empirical_normalized_perf
 
-def setup_distributed(rank, world_size):
+def setup_distributed(rank, world_size, backend="nccl"):
     """Initializes torch.distributed."""
     dist.init_process_group(
-        backend="nccl",
+        backend=backend,
         rank=rank,
         world_size=world_size,
         init_method="tcp://127.0.0.1:29500"
     )
-    torch.cuda.set_device(rank)
+    if backend == "nccl":
+        torch.cuda.set_device(rank)
 
-def get_model_and_input(rank, world_size, seq_len, n_heads, emb_dim, block_lens):
+def get_model_and_input(rank, world_size, seq_len, n_heads, emb_dim, block_lens, device="cuda", emulator=None):
     """Creates a dummy attention module and input tensor."""
+    # bf16 matmuls on CPU are slow and not representative
+    dtype = torch.bfloat16 if device == "cuda" else torch.float32
     
     head_dim = emb_dim // n_heads
     
@@ -38,15 +46,15 @@ def get_model_and_input(rank, world_size, seq_len, n_heads, emb_dim, block_lens)
         nheads=n_heads,
         kvheads=n_heads,
         position_encoder=rope
-    ).cuda().to(torch.bfloat16)
+    ).to(device=device, dtype=dtype)
 
     # Create dummy input data for the entire sequence
     full_input = torch.randn(
-        1, seq_len, emb_dim, device="cuda", dtype=torch.bfloat16
+        1, seq_len, emb_dim, device=device, dtype=dtype
     )
     
     # The strategy will shard the input for us
-    strategy = RingAttentionStrategy(block_lens=block_lens)
+    strategy = RingAttentionStrategy(block_lens=block_lens, emulator=emulator)
     
     local_input = strategy.shard_input(full_input)
     
@@ -56,93 +64,189 @@ def run_benchmark(rank, world_size, n_steps, attn_module, local_input, strategy)
     """Runs the benchmark and returns the average latency."""
     # Warmup runs
     for _ in range(5):
-        _ring_attention_pass_kv(
+        ring_attention(
             x_norm=local_input,
             attn_module=attn_module,
             strategy=strategy,
-            valid_len=strategy.local_q_len,
             causal=True
         )
         dist.barrier()
 
-    torch.cuda.synchronize()
+    if local_input.is_cuda:
+        torch.cuda.synchronize()
     
     # start profiling
     start_time = time.time()
     for _ in range(n_steps):
-        _ring_attention_pass_kv(
+        ring_attention(
             x_norm=local_input,
             attn_module=attn_module,
             strategy=strategy,
-            valid_len=strategy.local_q_len,
             causal=True
         )
     
     dist.barrier()
-    torch.cuda.synchronize()
+    if local_input.is_cuda:
+        torch.cuda.synchronize()
     end_time = time.time()
 
     avg_latency_ms = (end_time - start_time) / n_steps * 1000
     return avg_latency_ms
 
-def load_performance_profile(profile_path, size):
+def run_profiled(n_steps, attn_module, local_input, strategy):
+    """Untimed profiled passes that fill `strategy.timings` for telemetry."""
+    strategy.profile = True
+    reset_layer_counter(strategy)
+    for _ in range(n_steps):
+        ring_attention(
+            x_norm=local_input,
+            attn_module=attn_module,
+            strategy=strategy,
+            causal=True
+        )
+    strategy.profile = False
+
+def compute_block_lens(seq_len, world_size, split_type, rank_mps, perf_profile=None, perf_model=None):
+    """Block lengths of every rank for `split_type`, given each rank's MPS percentage."""
+    if split_type == "even":
+        base_len = seq_len // world_size
+        block_lens = [base_len] * world_size
+        # Adjust for remainder
+        remainder = seq_len % world_size
+        for i in range(remainder):
+            block_lens[i] += 1
+        return block_lens
+
+    if len(rank_mps) != world_size:
+        raise ValueError("Number of MPS percentages must match world size.")
+
+    if split_type == "uneven":
+        # proportional to each rank's share of its GPU
+        weights = list(rank_mps)
+    elif split_type == "lut":
+        if not perf_profile:
+            raise ValueError("Performance profile must be specified for 'lut' split type.")
+
+        if perf_profile.endswith(".parquet"):
+            profile = PerformanceProfile.load(perf_profile)
+        else:
+            profile = PerformanceProfile.from_csv(perf_profile, seq_len=seq_len)
+        weights = profile.weights(seq_len, rank_mps, world_size=world_size)
+    else: # formula
+        rank_features = [[mps / 100] for mps in rank_mps]
+        if perf_model is not None and perf_model.count > 0:
+            weights = perf_model.weights(seq_len, rank_features)
+        else:
+            # no telemetry yet, start from the offline fit
+            weights = [empirical_normalized_perf(seq_len, mps) for mps in rank_mps]
+
+    total_weight = sum(weights)
+
+    block_lens = []
+    for i in range(world_size):
+        block_lens.append(int(round(seq_len * (weights[i] / total_weight))))
+
+    diff = sum(block_lens) - seq_len
+    block_lens[-1] -= diff
+    return block_lens
+
+
+def benchmark(
+    rank,
+    world_size,
+    seq_len,
+    split_type,
+    rank_mps,
+    n_heads=32,
+    emb_dim=4096,
+    n_steps=5,
+    perf_profile=None,
+    perf_model_path="results/perf_model.json",
+    emulate=False,
+    trace_dir=None,
+    ring_metrics=False,
+):
     """
-    Loads a performance profile from a CSV file.
-    Detects whether the profile is throughput (tflops) or latency (latency_ms) based.
-    If tflops-based, it finds the closest matrix size to the given size.
+    Run one configuration on an initialized process group. Returns the results of
+    every rank on rank 0, None elsewhere. With `emulate`, runs on CPU and slows
+    every rank to its MPS percentage with a `HeteroEmulator` instead of MPS.
+    With `trace_dir`, every rank writes a timeline of its ring there (merge them
+    with `python -m fms.distributed.tracing`). With `ring_metrics`, the ring is
+    profiled and every rank's busy and wait time is reported with a straggler
+    score. Profiling synchronizes every wait, so it runs in separate passes after
+    the timed ones and the latency of every split is measured the same way. Rank 0
+    computes the split (and loads the performance model) and broadcasts it.
     """
-    if not os.path.exists(profile_path):
-        raise FileNotFoundError(f"Performance profile not found: {profile_path}")
-    
-    df = pd.read_csv(profile_path)
-    
-    if 'latency_ms' in df.columns:
-        print(f"Loaded latency-based performance profile from {profile_path}")
-        return df.set_index('mps_pct')['latency_ms'].to_dict(), 'latency'
-    elif 'tflops' in df.columns:
-        print(f"Loaded throughput-based (tflops) performance profile from {profile_path}")
-        available_sizes = sorted(df['size'].unique())
-        closest_size = min(available_sizes, key=lambda x: abs(x - size))
-        
-        print(f"Using size {closest_size} from tflops profile for target sequence length {size}")
-        
-        df_filtered = df[df['size'] == closest_size]
-        if df_filtered.empty:
-            raise ValueError(f"No data found for size {closest_size} in the tflops profile.")
-            
-        return df_filtered.set_index('mps_pct')['tflops'].to_dict(), 'tflops'
-    else:
-        raise ValueError("Performance profile must contain either 'latency_ms' or 'tflops' column.")
+    split = [None, None]
+    if rank == 0:
+        perf_model = None
+        if split_type == "formula":
+            perf_model = OnlinePerformanceModel.load_or_create(perf_model_path, num_rank_features=1)
+        block_lens = compute_block_lens(seq_len, world_size, split_type, rank_mps, perf_profile, perf_model)
+        split = [block_lens, perf_model]
+    dist.broadcast_object_list(split, src=0)
+    block_lens, perf_model = split
+
+    device, emulator = "cuda", None
+    if emulate:
+        device, emulator = "cpu", HeteroEmulator(speed=rank_mps[rank] / 100)
+    attn_module, local_input, strategy = get_model_and_input(
+        rank, world_size, seq_len, n_heads, emb_dim, block_lens, device, emulator
+    )
+
+    if rank == 0:
+        print(f"Running benchmark with '{split_type}' split.")
+        print(f"Sequence Length: {seq_len}, Block lengths: {block_lens}")
+
+    if trace_dir is not None:
+        strategy.tracer = Tracer(rank, synchronize=device == "cuda")
+        strategy.tracer.align_clocks()
+
+    # Everyone resets their counters before the benchmark
+    reset_layer_counter(strategy)
+    dist.barrier()
+
+    latency = run_benchmark(rank, world_size, n_steps, attn_module, local_input, strategy)
+
+    if trace_dir is not None:
+        os.makedirs(trace_dir, exist_ok=True)
+        strategy.tracer.save(os.path.join(trace_dir, f"trace_rank{rank}.json"))
+
+    metrics = None
+    if ring_metrics or split_type == "formula":
+        run_profiled(n_steps, attn_module, local_input, strategy)
+    if ring_metrics:
+        metrics = collect_ring_metrics(strategy, reset=False)
+
+    if split_type == "formula":
+        record_forward(perf_model, strategy, [rank_mps[rank] / 100])
+        if rank == 0:
+            perf_model.save(perf_model_path)
+
+    # Gather results to rank 0
+    output = [None] * world_size
+    dist.gather_object(
+        {"rank": rank, "latency": latency, "tokens": strategy.local_q_len},
+        output if rank == 0 else None,
+        dst=0
+    )
+    if rank != 0:
+        return None
+    result = {
+        "split_type": split_type,
+        "seq_len": seq_len,
+        "block_lens": block_lens,
+        # The overall latency is the max latency of any rank
+        "overall_latency_ms": max(res["latency"] for res in output),
+        "ranks": output,
+    }
+    if metrics is not None:
+        result["straggler_score"] = metrics.straggler_score
+        for res in output:
+            res["busy_ms"] = metrics.busy_ms[res["rank"]]
+            res["wait_ms"] = metrics.wait_ms[res["rank"]]
+    return result
 
-def get_performance_for_mps(profile, mps_pct):
-    """Gets the performance for a given MPS percentage, using linear interpolation if needed."""
-    
-    # Sort the profile keys to allow for interpolation
-    sorted_mps = sorted(profile.keys())
-    
-    if mps_pct in profile:
-        return profile[mps_pct]
-    
-    # Handle edge cases: clamp to min/max if outside the range
-    if mps_pct > sorted_mps[-1]:
-        return profile[sorted_mps[-1]]
-    if mps_pct < sorted_mps[0]:
-        return profile[sorted_mps[0]]
-        
-    # Find bracketing values
-    for i, p in enumerate(sorted_mps):
-        if p > mps_pct:
-            high_p = p
-            low_p = sorted_mps[i-1]
-            break
-            
-    # Linear interpolation
-    high_val = profile[high_p]
-    low_val = profile[low_p]
-    
-    weight = (mps_pct - low_p) / (high_p - low_p)
-    
-    return low_val + weight * (high_val - low_val)
 
 def main():
     parser = argparse.ArgumentParser(description="Heterogeneous Ring Attention Benchmark")
@@ -154,95 +258,42 @@ def main():
     parser.add_argument("--n-steps", type=int, default=5, help="Number of benchmark iterations")
     parser.add_argument("--split-type", type=str, choices=["even", "uneven", "lut", "formula"], default="even", help="Workload split type")
     parser.add_argument("--slowdown-factor", type=float, default=0.5, help="Proportional slowdown of the weak GPU (e.g., 0.5 for 50%)")
-    parser.add_argument("--use-perf-profile", type=str, default=None, help="Path to the performance profile CSV file.")
+    parser.add_argument("--use-perf-profile", type=str, default=None, help="Path to the performance profile (Parquet, or a sweep CSV).")
     parser.add_argument("--rank-mps", type=str, default="100,50", help="Comma-separated list of MPS percentages for each rank.")
+    parser.add_argument("--perf-model", type=str, default="results/perf_model.json", help="Online performance model the 'formula' split uses and updates with this run's timings.")
+    parser.add_argument("--emulate", action="store_true", help="Run on CPU (gloo) and emulate the MPS percentages instead of using MPS.")
+    parser.add_argument("--trace", type=str, default=None, help="Directory to write per-rank Chrome/Perfetto traces to.")
+    parser.add_argument("--ring-metrics", action="store_true", help="Report every rank's busy and wait time per forward and a straggler score.")
 
     args = parser.parse_args()
 
-    setup_distributed(args.rank, args.world_size)
+    setup_distributed(args.rank, args.world_size, backend="gloo" if args.emulate else "nccl")
 
-    # Determine block lengths based on split type
-    if args.split_type == "even":
-        base_len = args.seq_len // args.world_size
-        block_lens = [base_len] * args.world_size
-        # Adjust for remainder
-        remainder = args.seq_len % args.world_size
-        for i in range(remainder):
-            block_lens[i] += 1
-    elif args.split_type == "uneven":
-        # We assume rank 1 is the slower GPU for simplicity in this theoretical model
-        weights = [1.0, args.slowdown_factor]
-        total_weight = sum(weights)
-        
-        block_lens = []
-        for i in range(args.world_size):
-            block_lens.append(int(round(args.seq_len * (weights[i] / total_weight))))
-        
-        diff = sum(block_lens) - args.seq_len
-        block_lens[-1] -= diff
-    elif args.split_type == "lut" or args.split_type == "formula":
-        rank_mps_list = [float(p) for p in args.rank_mps.split(',')]
-        if len(rank_mps_list) != args.world_size:
-            raise ValueError("Number of MPS percentages must match world size.")
-
-        weights = []
-        if args.split_type == "lut":
-            if not args.use_perf_profile:
-                raise ValueError("Performance profile must be specified for 'lut' split type.")
-            
-            perf_profile, metric_type = load_performance_profile(args.use_perf_profile, args.seq_len)
-            raw_perf = [get_performance_for_mps(perf_profile, mps) for mps in rank_mps_list]
-            
-            if metric_type == 'latency':
-                weights = [1 / p for p in raw_perf]
-            else: # tflops
-                weights = raw_perf
-        else: # formula
-            weights = [empirical_normalized_perf(args.seq_len, mps) for mps in rank_mps_list]
-
-        total_weight = sum(weights)
-
-        block_lens = []
-        for i in range(args.world_size):
-            block_lens.append(int(round(args.seq_len * (weights[i] / total_weight))))
-
-        diff = sum(block_lens) - args.seq_len
-        block_lens[-1] -= diff
-
-    attn_module, local_input, strategy = get_model_and_input(
-        args.rank, args.world_size, args.seq_len, args.n_heads, args.emb_dim, block_lens
-    )
-
-    if args.rank == 0:
-        print(f"Running benchmark with '{args.split_type}' split.")
-        print(f"Sequence Length: {args.seq_len}, Block lengths: {block_lens}")
-
-    # Everyone resets their counters before the benchmark
-    reset_layer_counter()
-    dist.barrier()
-
-    latency = run_benchmark(args.rank, args.world_size, args.n_steps, attn_module, local_input, strategy)
+    if args.split_type == "uneven":
+        # We assume the last rank is the slower GPU for simplicity in this theoretical model
+        rank_mps = [100.0] * (args.world_size - 1) + [100.0 * args.slowdown_factor]
+    else:
+        rank_mps = [float(p) for p in args.rank_mps.split(',')]
 
-    # Gather results to rank 0
-    output = [None] * args.world_size
-    dist.gather_object(
-        {"rank": args.rank, "latency": latency, "tokens": strategy.local_q_len},
-        output if args.rank == 0 else None,
-        dst=0
+    result = benchmark(
+        args.rank, args.world_size, args.seq_len, args.split_type, rank_mps,
+        n_heads=args.n_heads, emb_dim=args.emb_dim, n_steps=args.n_steps,
+        perf_profile=args.use_perf_profile, perf_model_path=args.perf_model,
+        emulate=args.emulate, trace_dir=args.trace, ring_metrics=args.ring_metrics,
     )
 
     if args.rank == 0:
-        total_latency = 0
         print("\n--- Results ---")
-        for res in output:
+        for res in result["ranks"]:
             print(f"Rank {res['rank']} ({res['tokens']} tokens): {res['latency']:.2f} ms")
-            # The overall latency is the max latency of any rank
-            total_latency = max(total_latency, res['latency'])
-        print(f"Overall Latency (max of ranks): {total_latency:.2f} ms")
+            if "busy_ms" in res:
+                print(f"  busy {res['busy_ms']:.2f} ms, waiting {res['wait_ms']:.2f} ms per forward")
+        print(f"Overall Latency (max of ranks): {result['overall_latency_ms']:.2f} ms")
+        if "straggler_score" in result:
+            print(f"Straggler score (max/mean busy): {result['straggler_score']:.3f}")
         print("-----------------\n")
 
     dist.destroy_process_group()
 
 if __name__ == "__main__":
     main()
-
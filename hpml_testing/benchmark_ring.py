@@ -63,6 +63,7 @@ def setup_model(args, strategy, dtype):
             device_type=args.device_type,
             distributed_strategy=strategy,
             block_lens=block_lens,
+            ring_profile=strategy == "ring",
             data_type=dtype
         )
     else:
@@ -74,6 +75,7 @@ def setup_model(args, strategy, dtype):
             source="hf",
             distributed_strategy=strategy,
             block_lens=block_lens,
+            ring_profile=strategy == "ring",
             data_type=dtype
         )
     model.eval()
@@ -88,7 +90,7 @@ def run_benchmark(model, input_ids, num_decode, label, device, is_ring=False):
 
     # Reset layer counter for ring attention profiling (if using ring)
     if is_ring:
-        reset_layer_counter()
+        reset_layer_counter(model.distributed_strategy)
 
     # Warmup pass 
     print0("Warmup pass")
@@ -97,7 +99,7 @@ def run_benchmark(model, input_ids, num_decode, label, device, is_ring=False):
     if device.type == "cuda":
         torch.cuda.synchronize()
     if is_ring:
-        reset_layer_counter()
+        reset_layer_counter(model.distributed_strategy)
     print0("Warmup done, starting timed run")
 
     if device.type == "cuda":
@@ -132,7 +134,7 @@ def run_benchmark(model, input_ids, num_decode, label, device, is_ring=False):
 
     # Print ring attention timing summary
     if is_ring:
-        print_timing_summary(rank)
+        print_timing_summary(model.distributed_strategy, rank)
 
     if rank == 0:
         print0(f"\n{label}:")
@@ -1,13 +1,15 @@
 import os
 import subprocess
 import re
-import pandas as pd
 import time
 
+from fms.distributed.performance_profile import PerformanceProfile, ProfilePoint
+
 # --- Configuration ---
-SEQ_LEN = 8192 # Use a representative sequence length for the profile
+SEQ_LENS = [4096, 8192, 16384, 32768, 65536, 131072] # the range we serve
 MPS_SWEEP = [100, 90, 80, 70, 60, 50, 40, 30, 20, 10]
-OUTPUT_CSV_PATH = "hpml_testing/results/ring_attention_profile.csv"
+N_HEADS, EMB_DIM = 32, 4096
+OUTPUT_PROFILE_PATH = "hpml_testing/results/ring_attention_profile.parquet"
 BENCHMARK_SCRIPT = "hpml_testing/benchmark_hetero_latency.py"
 
 def parse_latency_from_output(output_string):
@@ -25,7 +27,7 @@ def main():
     a latency-based performance profile (LUT).
     """
     print("Generating new latency-based performance profile (LUT)...")
-    print(f"Using fixed sequence length: {SEQ_LEN}")
+    print(f"Sequence lengths: {SEQ_LENS}")
     
     # Set CUDA_VISIBLE_DEVICES to ensure consistency
     os.environ['CUDA_VISIBLE_DEVICES'] = '0,1'
@@ -38,8 +40,8 @@ def main():
     # Assumes MPS daemon is already running
     print("Assuming CUDA MPS daemon is running.")
 
-    for mps_pct in MPS_SWEEP:
-        print(f"\n--- Profiling with {mps_pct}% capacity on Rank 1 ---")
+    for seq_len, mps_pct in [(s, m) for s in SEQ_LENS for m in MPS_SWEEP]:
+        print(f"\n--- Profiling {seq_len} tokens with {mps_pct}% capacity on Rank 1 ---")
         
         env_rank1 = os.environ.copy()
         if mps_pct < 100:
@@ -48,14 +50,14 @@ def main():
         p0 = subprocess.Popen(
             ["python3", BENCHMARK_SCRIPT, 
              "--rank", "0", "--world-size", "2", 
-             "--seq-len", str(SEQ_LEN), "--emb-dim", "4096", "--n-heads", "32", 
+             "--seq-len", str(seq_len), "--emb-dim", str(EMB_DIM), "--n-heads", str(N_HEADS), 
              "--split-type", "even"],
             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
         )
         p1 = subprocess.Popen(
             ["python3", BENCHMARK_SCRIPT, 
              "--rank", "1", "--world-size", "2", 
-             "--seq-len", str(SEQ_LEN), "--emb-dim", "4096", "--n-heads", "32", 
+             "--seq-len", str(seq_len), "--emb-dim", str(EMB_DIM), "--n-heads", str(N_HEADS), 
              "--split-type", "even"],
             env=env_rank1,
             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
@@ -75,7 +77,19 @@ def main():
         
         if latency is not None:
             print(f"  -> Measured Latency: {latency:.2f} ms")
-            profile_data.append({"mps_pct": mps_pct, "latency_ms": latency})
+            profile_data.append(
+                ProfilePoint(
+                    device="mps",
+                    slowdown=mps_pct,
+                    seq_len=seq_len,
+                    world_size=2,
+                    dtype="bfloat16",
+                    nheads=N_HEADS,
+                    kvheads=N_HEADS,
+                    head_dim=EMB_DIM // N_HEADS,
+                    throughput=seq_len / (latency / 1000),
+                )
+            )
         else:
             print("  -> Failed to parse latency from output.")
         
@@ -85,9 +99,8 @@ def main():
         print("\nNo profiling data was generated.")
         return
         
-    print(f"\nProfile generation complete. Saving results to {OUTPUT_CSV_PATH}")
-    df_results = pd.DataFrame(profile_data)
-    df_results.to_csv(OUTPUT_CSV_PATH, index=False)
+    print(f"\nProfile generation complete. Saving results to {OUTPUT_PROFILE_PATH}")
+    PerformanceProfile(profile_data).save(OUTPUT_PROFILE_PATH)
     print("New LUT saved.")
 
 if __name__ == "__main__":
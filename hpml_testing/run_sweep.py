@@ -1,50 +1,81 @@
+import argparse
+import dataclasses
 import os
-import subprocess
-import re
+from typing import Tuple
+
 import pandas as pd
-import math
-import time
-import argparse
 import wandb
+
+from fms.distributed.sweep import run_sweep
+from benchmark_hetero_latency import benchmark
 from plot_sweep_results import generate_and_log_plots
 
 # --- Configuration ---
-SEQLEN_SWEEP = [4096]#, 8192, 16384, 32768, 65536]
-SLOWDOWN_SWEEP = [90, 80]#, 70, 60, 50, 40, 30, 20, 10] # MPS percentage for the slower GPU 
+SEQLEN_SWEEP = [4096, 8192, 16384, 32768, 65536]
+SLOWDOWN_SWEEP = [90, 80, 70, 60, 50, 40, 30, 20, 10] # MPS percentage for the slower GPU
+WORLD_SIZE_SWEEP = [2]
+SPLIT_SWEEP = ["even", "uneven", "lut", "formula"]
 DEFAULT_PROFILE_PATH = "hpml_testing/results/ring_attention_profile.csv"
+DEFAULT_CACHE_PATH = "hpml_testing/results/sweep_cache.jsonl"
 OUTPUT_CSV_PATH = "hpml_testing/results/sweep_results.csv"
-BENCHMARK_SCRIPT = "hpml_testing/benchmark_hetero_latency.py"
 
-def parse_single_benchmark_output(output_string):
-    """
-    Parses the output of a single benchmark_hetero_latency.py execution (rank 0's output).
-    Extracts overall latency, individual rank latencies, and token counts.
-    """
-    results = {}
 
-    split_type_match = re.search(r"Running benchmark with '(\w+)' split.", output_string)
-    if split_type_match:
-        results['split_type'] = split_type_match.group(1)
-    else:
-        results['split_type'] = "unknown" 
+@dataclasses.dataclass(frozen=True)
+class HeteroConfig:
+    """One benchmark run: a split of `seq_len` over ranks with MPS percentages `rank_mps`."""
+
+    seq_len: int
+    split_type: str
+    rank_mps: Tuple[float, ...]
+    profile_path: str = DEFAULT_PROFILE_PATH
+    n_heads: int = 32
+    emb_dim: int = 4096
+    n_steps: int = 5
+    emulate: bool = False
+
+    @property
+    def world_size(self):
+        return len(self.rank_mps)
+
+
+def run_hetero_config(rank, config):
+    return benchmark(
+        rank, config.world_size, config.seq_len, config.split_type, list(config.rank_mps),
+        n_heads=config.n_heads, emb_dim=config.emb_dim, n_steps=config.n_steps,
+        perf_profile=config.profile_path, emulate=config.emulate,
+    )
+
+
+def rank_env(config, rank):
+    # CUDA reads the MPS limit when the rank's context is created
+    return {"CUDA_MPS_ACTIVE_THREAD_PERCENTAGE": int(config.rank_mps[rank])}
 
-    seq_len_match = re.search(r"Sequence Length: (\d+), Block lengths: [^]]*]", output_string)
-    if seq_len_match:
-        results['seq_len'] = int(seq_len_match.group(1))
 
-    overall_latency_match = re.search(r"Overall Latency \(max of ranks\): (\d+\.\d+) ms", output_string)
-    if overall_latency_match:
-        results['overall_latency_ms'] = float(overall_latency_match.group(1))
+def heterogeneity_vectors(args):
+    if args.rank_mps:
+        return [tuple(float(p) for p in v.split(",")) for v in args.rank_mps]
+    # one slow GPU among full ones
+    return [
+        (100.0,) * (world_size - 1) + (float(slowdown),)
+        for world_size in args.world_sizes
+        for slowdown in args.slowdowns
+    ]
+
+
+def result_row(config, result, split_type=None, slowdown_pct=None):
+    row = {
+        "seq_len": config.seq_len,
+        "slowdown_pct": min(config.rank_mps) if slowdown_pct is None else slowdown_pct,
+        "split_type": split_type or config.split_type,
+        "world_size": config.world_size,
+        "rank_mps": ",".join(f"{p:g}" for p in config.rank_mps),
+        "overall_latency_ms": result["overall_latency_ms"],
+    }
+    for res in result["ranks"]:
+        row[f"rank{res['rank']}_tokens"] = res["tokens"]
+        row[f"rank{res['rank']}_latency_ms"] = res["latency"]
+    return row
 
-    rank_latency_token_matches = re.findall(r"Rank (\d+) \((\d+) tokens\): (\d+\.\d+) ms", output_string)
-    for match in rank_latency_token_matches:
-        rank = int(match[0])
-        tokens = int(match[1])
-        latency = float(match[2])
-        results[f'rank{rank}_tokens'] = tokens
-        results[f'rank{rank}_latency_ms'] = latency
-        
-    return results
 
 def main():
     parser = argparse.ArgumentParser(description="Run a sweep of benchmarks for heterogeneous ring attention.")
@@ -54,222 +85,82 @@ def main():
         default=DEFAULT_PROFILE_PATH,
         help="Path to the performance profile (LUT) to use for the 'lut' strategy."
     )
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=SEQLEN_SWEEP)
+    parser.add_argument("--slowdowns", type=float, nargs="+", default=SLOWDOWN_SWEEP, help="MPS percentages of the slow GPU.")
+    parser.add_argument("--world-sizes", type=int, nargs="+", default=WORLD_SIZE_SWEEP)
+    parser.add_argument("--splits", type=str, nargs="+", default=SPLIT_SWEEP)
+    parser.add_argument(
+        "--rank-mps",
+        type=str,
+        action="append",
+        help="Comma-separated MPS percentages of every rank, repeatable; replaces the --slowdowns x --world-sizes grid."
+    )
+    parser.add_argument("--cache", type=str, default=DEFAULT_CACHE_PATH, help="Completed runs, reused when the sweep is rerun.")
+    parser.add_argument("--emulate", action="store_true", help="Run on CPU and emulate the MPS percentages (see fms.distributed.emulation).")
     args = parser.parse_args()
 
+    vectors = heterogeneity_vectors(args)
+    configs = []
+    for seq_len in args.seq_lens:
+        for rank_mps in vectors:
+            for split_type in args.splits:
+                configs.append(HeteroConfig(seq_len, split_type, rank_mps, args.profile_path, emulate=args.emulate))
+            # homogeneous reference: no MPS slowdown applied to any rank
+            configs.append(HeteroConfig(seq_len, "even", (100.0,) * len(rank_mps), args.profile_path, emulate=args.emulate))
+    configs = list(dict.fromkeys(configs))
+
     # --- WANDB Integration: Initialize Run ---
     wandb.init(
         project="heterogeneous-ring-attention",
         config={
-            "seq_len_sweep": SEQLEN_SWEEP,
-            "slowdown_sweep": SLOWDOWN_SWEEP,
+            "seq_len_sweep": args.seq_lens,
+            "heterogeneity": [list(v) for v in vectors],
+            "splits": args.splits,
             "profile_path": args.profile_path
         }
     )
 
-    print("Starting benchmark sweep...")
+    print(f"Starting benchmark sweep of {len(configs)} configurations...")
     print(f"Using performance profile for LUT strategy: {args.profile_path}")
-    
-    os.environ['CUDA_VISIBLE_DEVICES'] = '0,1'
+    print(f"Completed runs are cached in {args.cache}")
 
-    all_sweep_results = []
-
-    os.environ['PYTHONPATH'] = os.getcwd() + ':' + os.environ.get('PYTHONPATH', '')
-
-    try:
-        for seq_len in SEQLEN_SWEEP:
-            for slowdown_pct in SLOWDOWN_SWEEP:
-                print(f"\n--- Running: SEQ_LEN={seq_len}, SLOWDOWN_PCT={slowdown_pct} ---")
-                current_slowdown_factor = slowdown_pct / 100.0
+    def on_result(config, result):
+        print(f"{config}: {result['overall_latency_ms']:.2f} ms")
 
-                print("Running Even Split...")
-                p0_even = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT, 
-                     "--rank", "0", "--world-size", "2", 
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32", 
-                     "--split-type", "even"],
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
-                p1_even = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT, 
-                     "--rank", "1", "--world-size", "2", 
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32", 
-                     "--split-type", "even"],
-                    env={**os.environ, "CUDA_MPS_ACTIVE_THREAD_PERCENTAGE": str(slowdown_pct)},
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
-                stdout_even_rank0, stderr_even_rank0 = p0_even.communicate()
-                _, stderr_even_rank1 = p1_even.communicate() 
-                
-                if p0_even.returncode != 0:
-                    print(f"Error in even split (rank 0): {stderr_even_rank0}")
-                if p1_even.returncode != 0:
-                    print(f"Error in even split (rank 1): {stderr_even_rank1}")
+    results = dict(run_sweep(
+        configs, run_hetero_config, args.cache,
+        backend="gloo" if args.emulate else "nccl",
+        env=None if args.emulate else rank_env,
+        on_result=on_result,
+    ))
 
-                even_results = parse_single_benchmark_output(stdout_even_rank0)
-                even_results.update({
-                    "seq_len": seq_len,
-                    "slowdown_pct": slowdown_pct,
-                    "split_type": "even", 
-                })
-                all_sweep_results.append(even_results)
-
-
-                print("Running Uneven Split (factor-based)...")
-                p0_uneven = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT, 
-                     "--rank", "0", "--world-size", "2", 
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32", 
-                     "--split-type", "uneven", "--slowdown-factor", str(current_slowdown_factor)],
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
-                p1_uneven = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT, 
-                     "--rank", "1", "--world-size", "2", 
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32", 
-                     "--split-type", "uneven", "--slowdown-factor", str(current_slowdown_factor)],
-                    env={**os.environ, "CUDA_MPS_ACTIVE_THREAD_PERCENTAGE": str(slowdown_pct)},
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
-                stdout_uneven_rank0, stderr_uneven_rank0 = p0_uneven.communicate()
-                _, stderr_uneven_rank1 = p1_uneven.communicate()
-
-                if p0_uneven.returncode != 0:
-                    print(f"Error in uneven split (rank 0): {stderr_uneven_rank0}")
-                if p1_uneven.returncode != 0:
-                    print(f"Error in uneven split (rank 1): {stderr_uneven_rank1}")
-                
-                uneven_results = parse_single_benchmark_output(stdout_uneven_rank0)
-                uneven_results.update({
-                    "seq_len": seq_len,
-                    "slowdown_pct": slowdown_pct,
-                    "split_type": "uneven",
-                })
-                all_sweep_results.append(uneven_results)
-
-
-                print("Running LUT Split...")
-                p0_lut = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT, 
-                     "--rank", "0", "--world-size", "2", 
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32", 
-                     "--split-type", "lut", 
-                     "--use-perf-profile", args.profile_path, 
-                     "--rank-mps", f"100,{slowdown_pct}"],
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
-                p1_lut = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT, 
-                     "--rank", "1", "--world-size", "2", 
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32", 
-                     "--split-type", "lut", 
-                     "--use-perf-profile", args.profile_path, 
-                     "--rank-mps", f"100,{slowdown_pct}"],
-                    env={**os.environ, "CUDA_MPS_ACTIVE_THREAD_PERCENTAGE": str(slowdown_pct)},
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
-                stdout_lut_rank0, stderr_lut_rank0 = p0_lut.communicate()
-                _, stderr_lut_rank1 = p1_lut.communicate()
-
-                if p0_lut.returncode != 0:
-                    print(f"Error in lut split (rank 0): {stderr_lut_rank0}")
-                if p1_lut.returncode != 0:
-                    print(f"Error in lut split (rank 1): {stderr_lut_rank1}")
-                
-                lut_results = parse_single_benchmark_output(stdout_lut_rank0)
-                lut_results.update({
-                    "seq_len": seq_len,
-                    "slowdown_pct": slowdown_pct,
-                    "split_type": "lut",
-                })
-                all_sweep_results.append(lut_results)
-
-
-                # --- Run Formula Split ---
-                print("Running Formula Split...")
-                p0_formula = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT,
-                     "--rank", "0", "--world-size", "2",
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32",
-                     "--split-type", "formula",
-                     "--rank-mps", f"100,{slowdown_pct}"],
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
-                p1_formula = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT,
-                     "--rank", "1", "--world-size", "2",
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32",
-                     "--split-type", "formula",
-                     "--rank-mps", f"100,{slowdown_pct}"],
-                    env={**os.environ, "CUDA_MPS_ACTIVE_THREAD_PERCENTAGE": str(slowdown_pct)},
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
-                stdout_formula_rank0, stderr_formula_rank0 = p0_formula.communicate()
-                _, stderr_formula_rank1 = p1_formula.communicate()
-
-                if p0_formula.returncode != 0:
-                    print(f"Error in formula split (rank 0): {stderr_formula_rank0}")
-                if p1_formula.returncode != 0:
-                    print(f"Error in formula split (rank 1): {stderr_formula_rank1}")
-
-                formula_results = parse_single_benchmark_output(stdout_formula_rank0)
-                formula_results.update({
-                    "seq_len": seq_len,
-                    "slowdown_pct": slowdown_pct,
-                    "split_type": "formula",
-                })
-                all_sweep_results.append(formula_results)
-                
-
-                # --- Run Homogeneous Reference Split ---
-                print("Running Homogeneous Reference Split...")
-                p0_ref = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT, 
-                     "--rank", "0", "--world-size", "2", 
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32", 
-                     "--split-type", "even"],
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
-                p1_ref = subprocess.Popen(
-                    ["python3", BENCHMARK_SCRIPT, 
-                     "--rank", "1", "--world-size", "2", 
-                     "--seq-len", str(seq_len), "--emb-dim", "4096", "--n-heads", "32", 
-                     "--split-type", "even"],
-                    # NOTE: No MPS slowdown applied to either rank for the reference case
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    all_sweep_results = []
+    for seq_len in args.seq_lens:
+        for rank_mps in vectors:
+            for split_type in args.splits:
+                config = HeteroConfig(seq_len, split_type, rank_mps, args.profile_path, emulate=args.emulate)
+                if config in results:
+                    all_sweep_results.append(result_row(config, results[config]))
+            reference = HeteroConfig(seq_len, "even", (100.0,) * len(rank_mps), args.profile_path, emulate=args.emulate)
+            if reference in results:
+                # Keep the slowdown for grouping, though it's not applied
+                all_sweep_results.append(
+                    result_row(reference, results[reference], "reference_homogeneous", min(rank_mps))
                 )
-                stdout_ref_rank0, stderr_ref_rank0 = p0_ref.communicate()
-                _, stderr_ref_rank1 = p1_ref.communicate()
-
-                if p0_ref.returncode != 0:
-                    print(f"Error in reference split (rank 0): {stderr_ref_rank0}")
-                if p1_ref.returncode != 0:
-                    print(f"Error in reference split (rank 1): {stderr_ref_rank1}")
 
-                ref_results = parse_single_benchmark_output(stdout_ref_rank0)
-                ref_results.update({
-                    "seq_len": seq_len,
-                    "slowdown_pct": slowdown_pct, # Keep for grouping, though it's not applied
-                    "split_type": "reference_homogeneous",
-                })
-                all_sweep_results.append(ref_results)
-
-                time.sleep(1) # Small pause between configurations
-                
-    except Exception as e:
-        print(f"An error occurred during the sweep: {e}")
-    finally:
-        # --- WANDB Integration: Generate and Log Plot, then Finish Run ---
-        print("\nSweep finished. Generating plot, saving results, and closing wandb run...")
-        if all_sweep_results: # Only plot if there is data
-            df_results = pd.DataFrame(all_sweep_results)
-            df_results.to_csv(OUTPUT_CSV_PATH, index=False)
-            print(f"Results saved to {OUTPUT_CSV_PATH}")
-            wandb.save(OUTPUT_CSV_PATH) # Save the CSV as a wandb artifact
-            generate_and_log_plots(df_results) # New call to generate and log plot
-        else:
-            print("No results were generated, skipping CSV save and plotting.")
+    # --- WANDB Integration: Generate and Log Plot, then Finish Run ---
+    print("\nSweep finished. Generating plot, saving results, and closing wandb run...")
+    if all_sweep_results: # Only plot if there is data
+        df_results = pd.DataFrame(all_sweep_results)
+        os.makedirs(os.path.dirname(OUTPUT_CSV_PATH), exist_ok=True)
+        df_results.to_csv(OUTPUT_CSV_PATH, index=False)
+        print(f"Results saved to {OUTPUT_CSV_PATH}")
+        wandb.save(OUTPUT_CSV_PATH) # Save the CSV as a wandb artifact
+        generate_and_log_plots(df_results) # New call to generate and log plot
+    else:
+        print("No results were generated, skipping CSV save and plotting.")
 
-        wandb.finish()
+    wandb.finish()
 
 if __name__ == "__main__":
     main()
@@ -37,21 +37,13 @@ def main():
     from fms.distributed.strategy import RingAttentionStrategy
     from fms.distributed.ring_attention import _compute_attention_ring_pass_kv
     # -----------------------------
-    # Per-rank "speed" from MPS
+    # Per-rank "speed" from a calibration micro-benchmark (cached on disk)
     # -----------------------------
-    mps_str = os.environ.get("CUDA_MPS_ACTIVE_THREAD_PERCENTAGE")
-    if mps_str is None:
-        local_speed = 1.0
-    else:
-        local_speed = float(mps_str)
-
-    speed_tensor = torch.tensor([local_speed], device=device)
-    all_speeds = [torch.zeros_like(speed_tensor) for _ in range(world_size)]
-    dist.all_gather(all_speeds, speed_tensor)
+    from fms.distributed.calibration import calibrate_speeds
 
-    all_speeds = torch.stack(all_speeds)[:, 0].cpu().tolist()
+    all_speeds = calibrate_speeds().layer
     if rank == 0:
-        print(f"[calib] per-rank speeds: {all_speeds}")
+        print(f"[calib] per-rank speeds (tokens/s per layer): {all_speeds}")
 
     # -----------------------------
     # Sharding mode: EVEN vs PROP
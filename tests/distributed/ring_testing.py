@@ -0,0 +1,103 @@
+"""
+Shared scaffolding of the multi-process ring tests: spawning a gloo process
+group per rank, random attention inputs, and the dense attention a ring loop
+is checked against.
+"""
+
+import math
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.tracing import Tracer
+
+HEAD_DIM = 8
+
+
+def _run_worker(rank, fn, world_size, init_file, args):
+    dist.init_process_group(
+        "gloo", init_method=f"file://{init_file}", rank=rank, world_size=world_size
+    )
+    try:
+        fn(rank, world_size, *args)
+    finally:
+        dist.destroy_process_group()
+
+
+def run_ring_workers(fn, world_size, tmp_path, *args):
+    """
+    Run `fn(rank, world_size, *args)` on `world_size` processes, each joined to
+    one gloo process group. `fn` must be a module-level function.
+    """
+    mp.spawn(
+        _run_worker,
+        args=(fn, world_size, str(tmp_path / "init"), args),
+        nprocs=world_size,
+    )
+
+
+def random_qkv(seq_len, batch_size=1, nheads=4, kvheads=2, dtype=torch.float32):
+    """Seeded full-sequence q [B, nheads, N, HEAD_DIM] and k, v with `kvheads`."""
+    torch.manual_seed(0)
+    q = torch.randn(batch_size, nheads, seq_len, HEAD_DIM)
+    k = torch.randn(batch_size, kvheads, seq_len, HEAD_DIM)
+    v = torch.randn(batch_size, kvheads, seq_len, HEAD_DIM)
+    return q.to(dtype), k.to(dtype), v.to(dtype)
+
+
+def dense_reference(q, k, v, ring_mask: RingMask):
+    """Attention of full-sequence q, k, v under the dense form of `ring_mask`."""
+    k = k.repeat_interleave(q.size(1) // k.size(1), 1)
+    v = v.repeat_interleave(q.size(1) // v.size(1), 1)
+    idx = torch.arange(q.size(2))
+    scores = q @ k.transpose(-2, -1) / math.sqrt(q.size(-1))
+    scores = scores.masked_fill(~ring_mask.block_mask(idx, idx), float("-inf"))
+    return torch.softmax(scores, dim=-1) @ v
+
+
+def run_ring_loop(loop, strategy, ring_mask, q, k, v, **loop_kwargs):
+    """
+    Run the ring `loop` (e.g. `_compute_attention_chunked_ring`) on this rank's
+    shard of full-sequence q, k, v. Returns the output and the shard's slice.
+    """
+    strategy.shard_input(torch.empty(q.size(0), q.size(2)))
+    shard = slice(strategy.local_q_start, strategy.local_q_start + strategy.local_q_len)
+    out = loop(
+        q[:, :, shard],
+        k[:, :, shard],
+        v[:, :, shard],
+        ring_mask,
+        strategy,
+        shard.start,
+        strategy.local_q_len,
+        math.sqrt(q.size(-1)),
+        torch.float32,
+        ring_mask.causal,
+        **loop_kwargs,
+    )
+    return out, shard
+
+
+def check_ring_loop(loop, strategy, ring_mask, batch_size=1, kvheads=2, **loop_kwargs):
+    """Check the ring `loop` against dense attention on every rank."""
+    q, k, v = random_qkv(sum(strategy.block_lens), batch_size, kvheads=kvheads)
+    out, shard = run_ring_loop(loop, strategy, ring_mask, q, k, v, **loop_kwargs)
+    torch.testing.assert_close(out, dense_reference(q, k, v, ring_mask)[:, :, shard])
+
+
+def check_kv_dtype_on_wire(loop, strategy, ring_mask, batch_size=1):
+    """
+    Check the ring `loop` sends K/V in their own dtype: half precision inputs put
+    half the bytes of float32 ones on the wire.
+    """
+    sent = []
+    for dtype in (torch.float32, torch.float16):
+        strategy.tracer = Tracer()
+        q, k, v = random_qkv(sum(strategy.block_lens), batch_size, dtype=dtype)
+        run_ring_loop(loop, strategy, ring_mask, q, k, v)
+        events = strategy.tracer.events
+        sent.append(sum(e["args"]["bytes"] for e in events if e["name"] == "send"))
+        strategy.tracer = None
+    assert sent[1] * 2 == sent[0]
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+import torch.distributed as dist
+
+from fms.distributed.calibration import CalibrationShapes, SpeedProfile, calibrate_speeds
+from fms.distributed.strategy import RingAttentionStrategy
+from ring_testing import run_ring_workers
+
+
+_SHAPES = CalibrationShapes(
+    block_len=64, nheads=4, kvheads=2, head_dim=16, emb_dim=64, hidden_dim=128, dtype="float32"
+)
+
+
+def _calibration_worker(rank, world_size, cache_dir):
+    profile = calibrate_speeds(shapes=_SHAPES, iters=2, warmup=1, cache_dir=cache_dir)
+    assert profile.world_size == world_size
+    for speeds in (profile.attention, profile.gemm, profile.layer):
+        assert all(s > 0 for s in speeds)
+    assert sum(profile.weights()) == pytest.approx(1.0)
+
+    # the CPU ranks of one host share a cache entry, which later calls load
+    dist.barrier()
+    assert len(os.listdir(cache_dir)) == 1
+    cached = calibrate_speeds(shapes=_SHAPES, cache_dir=cache_dir)
+    assert len(set(cached.layer)) == 1
+
+    os.environ["FMS_CALIBRATION_CACHE"] = cache_dir
+    strategy = RingAttentionStrategy(block_lens=[10, 30], calibrate=_SHAPES)
+    assert strategy.speed_profile == cached
+    assert strategy.block_lens == [20, 20]
+    strategy.balance(7)
+    assert sum(strategy.block_lens) == 7
+
+
+def test_calibration_is_cached(tmp_path):
+    world_size = 2
+    run_ring_workers(_calibration_worker, world_size, tmp_path, str(tmp_path / "cache"))
+
+
+def test_weights_follow_ring_order():
+    profile = SpeedProfile(attention=[1.0, 1.0, 1.0], gemm=[1.0, 1.0, 1.0], layer=[3.0, 1.0, 4.0])
+    assert profile.weights() == pytest.approx([0.375, 0.125, 0.5])
+    assert profile.weights([2, 0, 1]) == pytest.approx([0.5, 0.375, 0.125])
+
+
+def test_balance_needs_calibration():
+    strategy = RingAttentionStrategy(block_lens=[4])
+    with pytest.raises(ValueError):
+        strategy.balance(8)
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+import torch
+
+from fms.distributed.emulation import HeteroEmulator
+from fms.distributed.ring_attention import _compute_attention_ring_pass_kv
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from ring_testing import dense_reference, random_qkv, run_ring_loop, run_ring_workers
+
+
+@pytest.mark.parametrize("mode", ["sleep", "spin"])
+def test_throttle_stretches_compute(mode):
+    emulator = HeteroEmulator(speed=0.5, mode=mode)
+    emulator.start()
+    time.sleep(0.02)
+    start = time.perf_counter()
+    emulator.throttle()
+    # at half speed, a span takes twice as long
+    assert time.perf_counter() - start >= 0.02
+    assert emulator.injected_s == pytest.approx(emulator.compute_s)
+
+    # waits aren't compute, and nothing is throttled outside a forward pass
+    emulator.resume()
+    with emulator.waiting():
+        time.sleep(0.05)
+    emulator.stop()
+    assert emulator.compute_s < 0.045
+    emulator.throttle()
+    assert not emulator.active
+
+
+def test_threads_restored_after_forward():
+    threads = torch.get_num_threads()
+    emulator = HeteroEmulator(speed=0.5, mode="threads")
+    emulator.start()
+    assert torch.get_num_threads() == max(1, round(threads * 0.5))
+    emulator.stop()
+    assert torch.get_num_threads() == threads
+    assert emulator.injected_s == 0.0
+
+
+def test_speed_schedule_and_links():
+    emulator = HeteroEmulator(speed=[(3600.0, 0.25), (0.0, 0.5)])
+    assert emulator.current_speed() == 0.5
+    assert HeteroEmulator(speed=lambda t: 0.75).current_speed() == 0.75
+    with pytest.raises(ValueError):
+        HeteroEmulator(speed=2.0)
+    with pytest.raises(ValueError):
+        HeteroEmulator(mode="mps")
+
+    assert not emulator.shapes_links
+    link = HeteroEmulator(bandwidth=1e6, latency=0.001)
+    assert link.shapes_links
+    assert link.transfer_time(2000) == pytest.approx(0.003)
+
+
+def test_from_env(monkeypatch):
+    assert HeteroEmulator.from_env(0) is None
+    monkeypatch.setenv("FMS_EMULATE_SPEEDS", "1,0.5")
+    monkeypatch.setenv("FMS_EMULATE_MODE", "spin")
+    monkeypatch.setenv("FMS_EMULATE_BANDWIDTH", "1e9")
+    emulator = HeteroEmulator.from_env(1)
+    assert emulator.speed == 0.5
+    assert emulator.mode == "spin"
+    assert emulator.bandwidth == 1e9
+
+
+def _emulated_worker(rank, world_size, block_lens):
+    # the last rank is slow, and every rank sends over a slow link
+    emulator = HeteroEmulator(
+        speed=0.25 if rank == world_size - 1 else 1.0, bandwidth=1e6, latency=0.001
+    )
+    strategy = RingAttentionStrategy(block_lens=block_lens, emulator=emulator)
+    q, k, v = random_qkv(sum(block_lens), kvheads=4)
+    ring_mask = RingMask(causal=True)
+    emulator.start()
+    out, shard = run_ring_loop(_compute_attention_ring_pass_kv, strategy, ring_mask, q, k, v)
+    emulator.stop()
+    torch.testing.assert_close(out, dense_reference(q, k, v, ring_mask)[:, :, shard])
+
+    assert emulator.compute_s > 0
+    if rank == world_size - 1:
+        assert emulator.injected_s == pytest.approx(3 * emulator.compute_s)
+    else:
+        assert emulator.injected_s == 0
+
+
+def test_emulated_ring_matches_dense(tmp_path):
+    block_lens = [7, 3, 5]
+    run_ring_workers(_emulated_worker, len(block_lens), tmp_path, block_lens)
@@ -0,0 +1,66 @@
+import pytest
+import torch
+
+from fms.distributed.kv_compression import (
+    compression_error,
+    dequantize_kv,
+    message_bytes,
+    quantize_kv,
+)
+from fms.distributed.planner import CostModel, plan_context_parallel
+from fms.distributed.ring_attention import _compute_attention_ring_pass_kv
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from ring_testing import random_qkv, run_ring_loop, run_ring_workers
+
+
+@pytest.mark.parametrize("compression,tolerance", [("int8", 0.01), ("fp8", 0.05)])
+def test_quantize_round_trip(compression, tolerance):
+    torch.manual_seed(0)
+    # heads of very different magnitude get their own scales
+    x = torch.randn(2, 3, 17, 8) * torch.tensor([0.01, 1.0, 100.0]).view(1, 3, 1, 1)
+    message = quantize_kv(x, compression)
+    assert message.dtype == torch.uint8
+    assert message.numel() == message_bytes(tuple(x.shape), compression)
+    assert compression_error(x, compression) < tolerance
+
+    zeros = torch.zeros(1, 2, 5, 4, dtype=torch.bfloat16)
+    restored = dequantize_kv(quantize_kv(zeros, compression), (1, 2, 5, 4), compression, torch.bfloat16)
+    assert restored.dtype == torch.bfloat16
+    assert torch.equal(restored, zeros)
+
+
+def _compressed_worker(rank, world_size, block_lens, compression):
+    strategy = RingAttentionStrategy(block_lens=block_lens)
+    q, k, v = random_qkv(sum(block_lens))
+    ring_mask = RingMask(causal=True)
+    expected, _ = run_ring_loop(_compute_attention_ring_pass_kv, strategy, ring_mask, q, k, v)
+    strategy.set_kv_compression(compression)
+    actual, _ = run_ring_loop(_compute_attention_ring_pass_kv, strategy, ring_mask, q, k, v)
+    torch.testing.assert_close(actual, expected, atol=0.05, rtol=0.05)
+
+
+@pytest.mark.parametrize("compression", ["int8", "fp8"])
+def test_compressed_ring_matches_fp(tmp_path, compression):
+    block_lens = [6, 4, 5]
+    run_ring_workers(_compressed_worker, len(block_lens), tmp_path, block_lens, compression)
+
+
+def test_planner_enables_compression_when_comm_bound():
+    slow_links = CostModel(
+        speeds=[1e12] * 4, kv_bytes_per_token=1024, bandwidth=1.0, latency_us=0.0,
+        step_overhead_us=0.0,
+    )
+    assert slow_links.comm_bound([1024] * 4)
+    plan = plan_context_parallel(4096, slow_links, modes=("pass_kv",), kv_compression="int8")
+    assert plan.kv_compression == "int8"
+    assert plan.estimated_time < slow_links.pass_kv_time(plan.block_lens)
+
+    # compute bound: the ring hides its hops, no reason to lose accuracy
+    slow_ranks = CostModel(
+        speeds=[1e6] * 4, kv_bytes_per_token=1024, bandwidth=100.0, latency_us=0.0,
+        step_overhead_us=0.0,
+    )
+    assert not slow_ranks.comm_bound([1024] * 4)
+    plan = plan_context_parallel(4096, slow_ranks, modes=("pass_kv",), kv_compression="int8")
+    assert plan.kv_compression is None
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from fms.distributed.link_probe import LinkProfile, probe_links
+from fms.distributed.topology import load_topology
+from ring_testing import run_ring_workers
+
+
+def _probe_worker(rank, world_size, cache_dir):
+    sizes = [64, 4096]
+    profile = probe_links(message_sizes=sizes, iters=2, warmup=1, cache_dir=cache_dir)
+    assert profile.message_sizes == sizes
+    assert len(profile.times) == len(sizes)
+    for i in range(world_size):
+        for j in range(world_size):
+            if i != j:
+                assert profile.bandwidth[i][j] > 0
+                assert profile.latency[i][j] >= 0
+    assert sorted(profile.ring_order()) == list(range(world_size))
+
+    # every rank sees rank 0's measurements, and the second call hits the cache
+    assert len(os.listdir(cache_dir)) == 1
+    assert probe_links(message_sizes=sizes, cache_dir=cache_dir) == profile
+
+    # a different set of sizes is probed again
+    assert probe_links(message_sizes=[64], iters=1, warmup=0, cache_dir=cache_dir).message_sizes == [64]
+
+
+def test_probe_links_is_cached(tmp_path):
+    world_size = 3
+    run_ring_workers(_probe_worker, world_size, tmp_path, str(tmp_path / "cache"))
+
+
+def test_profile_is_a_topology_file(tmp_path):
+    profile = LinkProfile(
+        message_sizes=[1024],
+        times=[[[0.0, 2e-6], [3e-6, 0.0]]],
+        latency=[[0.0, 1.0], [2.0, 0.0]],
+        bandwidth=[[0.0, 100.0], [50.0, 0.0]],
+    )
+    path = str(tmp_path / "links.json")
+    profile.save(path)
+    assert LinkProfile.load(path) == profile
+    assert load_topology(path) == (profile.bandwidth, profile.latency)
+    assert profile.transfer_time(1, 0, 10**9) == pytest.approx(2e-6 + 1 / 50)
+    assert profile.transfer_time(0, 0, 10**9) == 0.0
@@ -0,0 +1,86 @@
+import dataclasses
+
+import pytest
+
+from fms.distributed.memory import MemoryModel, memory_constrained_block_lens
+from fms.distributed.planner import CostModel, plan_context_parallel
+from fms.models.llama import LLaMA, LLaMAConfig
+
+
+GiB = 2**30
+
+
+def _llama_8b(**kwargs):
+    config = LLaMAConfig(emb_dim=4096, nheads=32, kvheads=8, nlayers=32, hidden_grow_factor=3.5)
+    return MemoryModel.from_config(config, **kwargs)
+
+
+def test_weights_match_model():
+    config = LLaMAConfig(src_vocab_size=64, emb_dim=32, nheads=4, kvheads=2, nlayers=2, multiple_of=16)
+    memory_model = MemoryModel.from_config(config, element_size=4)
+    params = sum(p.numel() for p in LLaMA(config).parameters())
+    norms = (2 * config.nlayers + 1) * config.emb_dim
+    assert memory_model.weight_bytes() == (params - norms) * 4
+
+
+def test_estimate_categories():
+    memory_model = _llama_8b()
+    block_lens = [40000, 20000]
+    big, small = (memory_model.estimate(block_lens, r) for r in range(2))
+    assert big.weights == small.weights
+    assert big.kv_cache == 2 * small.kv_cache
+    # receive buffers are padded to the longest block
+    assert big.buffers == small.buffers
+    assert big.total > small.total
+    assert memory_model.peak(block_lens) == [big.total, small.total]
+
+    compressed = dataclasses.replace(memory_model, kv_compression="int8")
+    assert compressed.estimate(block_lens, 1).buffers < small.buffers
+    prefetch = dataclasses.replace(memory_model, prefetch_depth=4)
+    assert prefetch.estimate(block_lens, 1).buffers > small.buffers
+    allgather = dataclasses.replace(memory_model, mode="allgather")
+    assert allgather.estimate(block_lens, 1).buffers > small.buffers
+
+
+def test_memory_constrained_split():
+    memory_model = _llama_8b()
+    seq_len, speeds = 131072, [3.0, 1.0]
+    capacities = [40 * GiB, 80 * GiB]
+    with pytest.raises(ValueError):
+        memory_model.check([98304, 32768], capacities)
+
+    block_lens = memory_constrained_block_lens(seq_len, speeds, memory_model, capacities)
+    assert sum(block_lens) == seq_len
+    assert block_lens[0] < 98304
+    memory_model.check(block_lens, capacities)
+
+    # enough memory everywhere: the split follows the speeds
+    roomy = [80 * GiB, 80 * GiB]
+    assert memory_constrained_block_lens(seq_len, speeds, memory_model, roomy) == [98304, 32768]
+
+    with pytest.raises(ValueError):
+        memory_constrained_block_lens(10**6, speeds, memory_model, [24 * GiB, 24 * GiB])
+
+
+def test_planner_rules_out_modes_that_dont_fit():
+    memory_model = _llama_8b()
+    # fast links favour the all-gather, which has to hold every block
+    fast_links = CostModel(
+        speeds=[1e12] * 4, kv_bytes_per_token=1024, bandwidth=1000.0, latency_us=0.0,
+        step_overhead_us=1000.0, causal=False,
+    )
+    seq_len = 65536
+    assert plan_context_parallel(seq_len, fast_links).mode == "allgather"
+
+    # room for the ring's buffers but not for every rank's block
+    capacity = memory_model.estimate([seq_len // 4] * 4, 0).total + 2**20
+    plan = plan_context_parallel(
+        seq_len, fast_links, memory_model=memory_model, capacities=[capacity] * 4
+    )
+    assert plan.mode == "pass_kv"
+    assert plan.block_lens == [seq_len // 4] * 4
+
+    with pytest.raises(ValueError):
+        plan_context_parallel(
+            seq_len, fast_links, memory_model=memory_model, capacities=[16 * GiB] * 4
+        )
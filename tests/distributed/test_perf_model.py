@@ -0,0 +1,87 @@
+import math
+
+import pytest
+import torch.distributed as dist
+
+from fms.distributed.perf_model import OnlinePerformanceModel, record_forward
+from fms.distributed.strategy import RingAttentionStrategy
+from ring_testing import run_ring_workers
+
+
+def _seconds(seq_len, share, tokens, scale=1.0):
+    # log throughput quadratic in log2 seq_len and the device share
+    x = math.log2(seq_len)
+    log_throughput = 20.0 - 0.3 * x + 1.5 * share - 0.2 * share * share + 0.01 * x * share
+    return tokens / (scale * math.exp(log_throughput))
+
+
+def _observe_grid(model, scale=1.0):
+    for seq_len in (4096, 8192, 16384, 32768, 65536):
+        for share in (0.25, 0.5, 0.75, 1.0):
+            model.observe(seq_len, [share], 1000, _seconds(seq_len, share, 1000, scale))
+
+
+def test_fit_recovers_throughput():
+    model = OnlinePerformanceModel(num_rank_features=1, decay=1.0, ridge=1e-9)
+    assert model.weights(8192, [[1.0], [0.5]]) == [0.5, 0.5]
+    with pytest.raises(ValueError):
+        model.predict(8192, [[1.0]])
+    _observe_grid(model)
+
+    for seq_len, share in ((12000, 0.6), (4096, 1.0), (50000, 0.3)):
+        expected = 1000 / _seconds(seq_len, share, 1000)
+        assert model.predict(seq_len, [[share]])[0] == pytest.approx(expected, rel=1e-3)
+    weights = model.weights(16384, [[1.0], [0.5]])
+    assert sum(weights) == pytest.approx(1.0)
+    assert weights[0] > weights[1]
+    assert sum(model.block_lens(16384, [[1.0], [0.5]])) == 16384
+    with pytest.raises(ValueError):
+        model.observe(4096, [1.0, 2.0], 1000, 1.0)
+
+
+def test_decay_follows_changes():
+    model = OnlinePerformanceModel(num_rank_features=1, decay=0.8, ridge=1e-9)
+    _observe_grid(model)
+    # the hardware gets twice as fast, e.g. after a driver upgrade
+    for _ in range(10):
+        _observe_grid(model, scale=2.0)
+    expected = 2000 / _seconds(8192, 0.5, 1000)
+    assert model.predict(8192, [[0.5]])[0] == pytest.approx(expected, rel=1e-3)
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "models" / "perf_model.json")
+    model = OnlinePerformanceModel.load_or_create(path, num_rank_features=1, decay=0.9)
+    assert model.count == 0
+    _observe_grid(model)
+    model.save(path)
+
+    loaded = OnlinePerformanceModel.load_or_create(path, num_rank_features=1)
+    assert loaded.decay == 0.9
+    assert loaded.count == pytest.approx(model.count)
+    assert loaded.predict(8192, [[0.5], [1.0]]) == pytest.approx(model.predict(8192, [[0.5], [1.0]]))
+
+
+def _record_worker(rank, world_size):
+    strategy = RingAttentionStrategy(block_lens=[30, 10], profile=True)
+    model = OnlinePerformanceModel(num_rank_features=1)
+    with pytest.raises(ValueError):
+        record_forward(model, strategy, [1.0 if rank == 0 else 1 / 3])
+    assert model.count == 0
+
+    # both ranks take 30 ms a forward, so rank 1 is three times slower per token
+    strategy.timings.forwards = 2
+    strategy.timings.busy_ms = 60.0
+    record_forward(model, strategy, [1.0 if rank == 0 else 1 / 3])
+    assert model.count == pytest.approx(1 + model.decay)
+    assert strategy.timings.forwards == 0
+
+    # every rank got both ranks' measurements
+    gathered = [None] * world_size
+    dist.all_gather_object(gathered, model.moment.tolist())
+    assert gathered[0] == gathered[1]
+
+
+def test_record_forward(tmp_path):
+    world_size = 2
+    run_ring_workers(_record_worker, world_size, tmp_path)
@@ -0,0 +1,103 @@
+import math
+
+import pytest
+import torch
+
+from fms.distributed.performance_profile import (
+    PerformanceProfile,
+    ProfilePoint,
+    _pchip,
+)
+
+
+_CONFIG = dict(device="mps", dtype="bfloat16", nheads=32, kvheads=8, head_dim=128)
+
+
+def _power_law(seq_len, slowdown):
+    # attention throughput falls with the sequence length, and scales with the share
+    return 1e6 * slowdown / 100 * (seq_len / 4096) ** -0.5
+
+
+def _profile(world_sizes=(2,)):
+    return PerformanceProfile(
+        [
+            ProfilePoint(
+                slowdown=slowdown, seq_len=seq_len, world_size=world_size,
+                throughput=_power_law(seq_len, slowdown), **_CONFIG,
+            )
+            for world_size in world_sizes
+            for slowdown in (25, 50, 100)
+            for seq_len in (4096, 8192, 16384, 32768)
+        ]
+    )
+
+
+def test_interpolation_and_extrapolation():
+    profile = _profile()
+    # measured points are reproduced, and a power law is exact in log-log space
+    for seq_len in (4096, 12000, 32768, 131072, 2048):
+        expected = _power_law(seq_len, 100)
+        assert profile.throughput(seq_len).item() == pytest.approx(expected, rel=1e-9)
+
+    # between slowdowns the value stays within its neighbours, beyond them it's held
+    mid = profile.throughput(8192, 75.0).item()
+    assert _power_law(8192, 50) < mid < _power_law(8192, 100)
+    assert profile.throughput(8192, 150.0).item() == pytest.approx(_power_law(8192, 100))
+    assert profile.throughput(8192, 10.0).item() == pytest.approx(_power_law(8192, 25))
+
+
+def test_vectorized_queries():
+    profile = _profile()
+    seq_lens = torch.tensor([4096, 65536, 131072])
+    out = profile.throughput(seq_lens, [100.0, 50.0, 25.0])
+    assert out.shape == (3,)
+    expected = [_power_law(s, m) for s, m in zip(seq_lens.tolist(), (100, 50, 25))]
+    torch.testing.assert_close(out, torch.tensor(expected, dtype=torch.float64))
+    assert profile.throughput(torch.tensor([[4096], [8192]]), [25.0, 50.0, 100.0]).shape == (2, 3)
+
+    weights = profile.weights(65536, [100.0, 25.0])
+    assert weights == pytest.approx([0.8, 0.2])
+
+
+def test_pchip_is_monotone():
+    x = torch.tensor([0.0, 1.0, 2.0, 3.0, 4.0], dtype=torch.float64)
+    y = torch.tensor([0.0, 0.1, 0.2, 5.0, 5.1], dtype=torch.float64)
+    xq = torch.linspace(0, 4, 401, dtype=torch.float64)
+    out = _pchip(x, y[:, None].expand(-1, xq.numel()), xq, extrapolate=False)
+    assert (out[1:] >= out[:-1]).all()
+    assert out.min() >= 0.0 and out.max() <= 5.1
+
+    interpolate = pytest.importorskip("scipy.interpolate")
+    expected = interpolate.PchipInterpolator(x.numpy(), y.numpy())(xq.numpy())
+    torch.testing.assert_close(out, torch.from_numpy(expected))
+
+
+def test_config_selection():
+    profile = _profile(world_sizes=(2, 8))
+    with pytest.raises(ValueError):
+        profile.throughput(8192)
+    # an unmeasured ring size uses the nearest measured one
+    assert profile.throughput(8192, world_size=3).item() == pytest.approx(_power_law(8192, 100))
+    with pytest.raises(KeyError):
+        profile.throughput(8192, world_size=2, device="L40S")
+
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    profile = _profile(world_sizes=(2, 4))
+    path = str(tmp_path / "profile.parquet")
+    profile.save(path)
+    loaded = PerformanceProfile.load(path)
+    assert loaded == profile
+    assert loaded.throughput(20000, 60.0, world_size=4).item() == pytest.approx(
+        profile.throughput(20000, 60.0, world_size=4).item()
+    )
+
+
+def test_from_csv(tmp_path):
+    path = tmp_path / "ring_attention_profile.csv"
+    path.write_text("mps_pct,latency_ms\n100,10.0\n50,20.0\n")
+    profile = PerformanceProfile.from_csv(str(path), seq_len=8192)
+    assert len(profile) == 2
+    assert profile.throughput(8192).item() == pytest.approx(8192 / 0.01)
+    assert profile.weights(8192, [100, 50]) == pytest.approx([2 / 3, 1 / 3])
@@ -0,0 +1,69 @@
+import pytest
+import torch
+
+from fms.distributed.planner import CostModel, _visible_pairs, plan_context_parallel
+from fms.distributed.ring_attention import _compute_attention_allgather
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from fms.models.llama import LLaMA
+from ring_testing import check_ring_loop, run_ring_workers
+
+
+def _allgather_worker(rank, world_size, block_lens, ring_mask):
+    strategy = RingAttentionStrategy(block_lens=block_lens, mode="allgather")
+    check_ring_loop(_compute_attention_allgather, strategy, ring_mask)
+
+    # the same strategy switches modes between requests
+    torch.manual_seed(0)
+    config = dict(src_vocab_size=64, emb_dim=32, nheads=4, kvheads=2, nlayers=2)
+    ref = LLaMA(**config)
+    ref.reset_parameters()
+    model = LLaMA(distributed_strategy=strategy, **config)
+    model.load_state_dict(ref.state_dict())
+    input_ids = torch.randint(0, 64, (1, sum(block_lens)))
+    with torch.no_grad():
+        expected = ref(input_ids, is_causal_mask=True)
+        for mode in ("allgather", "pass_kv"):
+            strategy.set_mode(mode)
+            actual = model(input_ids, is_causal_mask=True)
+            torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize(
+    "ring_mask",
+    [RingMask(causal=True), RingMask(causal=False), RingMask(causal=True, sliding_window=6)],
+)
+def test_allgather_matches_dense(tmp_path, ring_mask):
+    block_lens = [9, 3, 6]
+    run_ring_workers(_allgather_worker, len(block_lens), tmp_path, block_lens, ring_mask)
+
+
+@pytest.mark.parametrize("causal", [True, False])
+def test_visible_pairs(causal):
+    idx = torch.arange(20)
+    allowed = idx[None, :] <= idx[:, None] if causal else torch.ones(20, 20, dtype=torch.bool)
+    for q_start, q_len, k_start, k_len in [(0, 5, 0, 5), (5, 7, 0, 5), (0, 5, 12, 4), (3, 10, 6, 9)]:
+        expected = allowed[q_start : q_start + q_len, k_start : k_start + k_len].sum()
+        assert _visible_pairs(q_start, q_len, k_start, k_len, causal) == expected
+
+
+def test_planner_picks_mode_from_cost():
+    # hops as long as a block: the pass-KV ring hides them behind compute
+    slow_links = CostModel(
+        speeds=[1e9] * 4, kv_bytes_per_token=1024, bandwidth=1.0, latency_us=0.0,
+        step_overhead_us=0.0, causal=False,
+    )
+    plan = plan_context_parallel(4096, slow_links)
+    assert plan.mode == "pass_kv"
+    assert plan.block_lens == [1024] * 4
+
+    # fast links and costly ring steps favour one all-gather
+    fast_links = CostModel(
+        speeds=[1e9] * 4, kv_bytes_per_token=1024, bandwidth=1000.0, latency_us=0.0,
+        step_overhead_us=1000.0, causal=False,
+    )
+    assert plan_context_parallel(4096, fast_links).mode == "allgather"
+
+    # block lens follow the rank speeds
+    hetero = CostModel(speeds=[3e9, 1e9], kv_bytes_per_token=1024)
+    assert plan_context_parallel(4000, hetero).block_lens == [3000, 1000]
@@ -0,0 +1,133 @@
+import math
+
+import pytest
+import torch
+
+from fms.distributed.ring_attention import _block_softmax_stats_naive
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from fms.models.granite import Granite
+from fms.models.llama import LLaMA
+from fms.modules.attention import MultiHeadAttention
+from ring_testing import run_ring_workers
+
+
+_SEQ_LEN = 24
+# uneven shards of _SEQ_LEN over three ranks
+_BLOCK_LENS = [11, 5, 8]
+
+
+def _model_pair(model_cls, block_lens=(_SEQ_LEN,), **kwargs):
+    torch.manual_seed(0)
+    ref = model_cls(**kwargs)
+    ref.reset_parameters()
+    ring = model_cls(
+        distributed_strategy=RingAttentionStrategy(block_lens=list(block_lens)), **kwargs
+    )
+    ring.load_state_dict(ref.state_dict())
+    return ref.eval(), ring.eval()
+
+
+def _llama_kwargs(kvheads):
+    return dict(
+        src_vocab_size=64,
+        emb_dim=32,
+        nheads=4,
+        kvheads=kvheads,
+        nlayers=2,
+        max_expected_seq_len=64,
+    )
+
+
+# attention_multiplier is passed to the op as a scale multiplier
+_GRANITE_KWARGS = dict(
+    src_vocab_size=64,
+    emb_dim=32,
+    nheads=4,
+    head_dim=8,
+    kvheads=2,
+    nlayers=2,
+    multiple_of=2,
+    attention_multiplier=0.5,
+    residual_multiplier=0.7,
+)
+
+
+def _check_logits(model_cls, batch_size, block_lens=(_SEQ_LEN,), **kwargs):
+    ref, ring = _model_pair(model_cls, block_lens, **kwargs)
+    input_ids = torch.randint(0, 64, (batch_size, _SEQ_LEN))
+    with torch.no_grad():
+        expected = ref(input_ids, is_causal_mask=True)
+        actual = ring(input_ids, is_causal_mask=True)
+    torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize("kvheads", [0, 2])
+def test_llama_ring_matches_sdpa(kvheads):
+    _check_logits(LLaMA, 2, **_llama_kwargs(kvheads))
+
+
+def test_granite_ring_matches_sdpa():
+    _check_logits(Granite, 1, **_GRANITE_KWARGS)
+
+
+def _multi_rank_worker(rank, world_size):
+    for kvheads in (0, 2):
+        _check_logits(LLaMA, 2, _BLOCK_LENS, **_llama_kwargs(kvheads))
+    _check_logits(Granite, 1, _BLOCK_LENS, **_GRANITE_KWARGS)
+
+
+def test_multi_rank_ring_matches_sdpa(tmp_path):
+    run_ring_workers(_multi_rank_worker, len(_BLOCK_LENS), tmp_path)
+
+
+def test_ring_op_rejects_decode():
+    strategy = RingAttentionStrategy(block_lens=[1])
+    attn = MultiHeadAttention(16, 4, 4, nheads=4, kvheads=4)
+    x = strategy.shard_input(torch.randn(1, 1, 16))
+    past = (torch.randn(1, 4, 3, 4), torch.randn(1, 4, 3, 4))
+    with pytest.raises(ValueError):
+        attn(
+            x,
+            past_key_value_state=past,
+            use_cache=True,
+            attn_name="ring",
+            ring_strategy=strategy,
+        )
+
+
+def test_block_stats_dropout():
+    torch.manual_seed(0)
+    q, k, v = torch.randn(1, 2, 5, 4), torch.randn(1, 2, 7, 4), torch.randn(1, 2, 7, 4)
+    idx_q, idx_k = torch.arange(2, 7), torch.arange(7)
+    ring_mask = RingMask(causal=True)
+
+    torch.manual_seed(1)
+    z, l, m = _block_softmax_stats_naive(
+        q, k, v, idx_q, idx_k, math.sqrt(4), None, True, ring_mask, dropout_p=0.25
+    )
+
+    scores = q @ k.transpose(-2, -1) / math.sqrt(4)
+    scores = scores.masked_fill(~ring_mask.block_mask(idx_q, idx_k), float("-inf"))
+    probs = torch.softmax(scores, dim=-1)
+    torch.manual_seed(1)
+    keep = torch.rand_like(probs) >= 0.25
+    expected = (probs * keep / 0.75) @ v
+    torch.testing.assert_close(z / l, expected)
+
+
+def test_ring_op_applies_dropout():
+    strategy = RingAttentionStrategy(block_lens=[8])
+    torch.manual_seed(0)
+    attn = MultiHeadAttention(16, 4, 4, nheads=4, kvheads=4, p_dropout=0.5)
+    x = strategy.shard_input(torch.randn(1, 8, 16))
+
+    def run():
+        return attn(x, attn_name="ring", ring_strategy=strategy, is_causal_mask=True)
+
+    with torch.no_grad():
+        attn.eval()
+        expected = attn(x, attn_name="sdpa_causal")
+        torch.testing.assert_close(run(), expected, atol=1e-5, rtol=1e-5)
+        attn.train()
+        assert not torch.allclose(run(), expected, atol=1e-3)
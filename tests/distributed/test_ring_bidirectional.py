@@ -0,0 +1,39 @@
+import pytest
+
+from fms.distributed.ring_attention import _compute_attention_bidirectional_ring
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from ring_testing import check_kv_dtype_on_wire, check_ring_loop, run_ring_workers
+
+
+def _bidirectional_worker(rank, world_size, block_lens, ring_mask):
+    strategy = RingAttentionStrategy(block_lens=block_lens, bidirectional=True)
+    check_ring_loop(
+        _compute_attention_bidirectional_ring, strategy, ring_mask, batch_size=2
+    )
+    check_kv_dtype_on_wire(
+        _compute_attention_bidirectional_ring, strategy, ring_mask, batch_size=2
+    )
+
+
+@pytest.mark.parametrize(
+    "ring_mask",
+    [
+        RingMask(causal=True),
+        RingMask(causal=False),
+        RingMask.from_padding([14, 9], 14, padding_side="right", causal=False),
+    ],
+)
+@pytest.mark.parametrize("block_lens", [[5, 8, 1], [4, 4, 3, 3], [3, 1, 4, 2, 4]])
+def test_bidirectional_ring_matches_dense(tmp_path, block_lens, ring_mask):
+    run_ring_workers(
+        _bidirectional_worker, len(block_lens), tmp_path, block_lens, ring_mask
+    )
+
+
+def test_bidirectional_steps_halve_the_ring():
+    strategy = RingAttentionStrategy(block_lens=[7])
+    assert strategy.bidirectional_steps() == (0, 0)
+    for world_size, steps in ((2, (1, 0)), (3, (1, 1)), (4, (2, 1)), (7, (3, 3))):
+        strategy.world_size = world_size
+        assert strategy.bidirectional_steps() == steps
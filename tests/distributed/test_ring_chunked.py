@@ -0,0 +1,43 @@
+import pytest
+
+from fms.distributed.planner import CostModel
+from fms.distributed.ring_attention import _compute_attention_chunked_ring
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from ring_testing import check_kv_dtype_on_wire, check_ring_loop, run_ring_workers
+
+
+def _chunked_worker(rank, world_size, block_lens, chunk_size, ring_mask):
+    strategy = RingAttentionStrategy(block_lens=block_lens, chunk_size=chunk_size)
+    check_ring_loop(_compute_attention_chunked_ring, strategy, ring_mask)
+    check_kv_dtype_on_wire(_compute_attention_chunked_ring, strategy, ring_mask)
+
+
+@pytest.mark.parametrize(
+    "ring_mask",
+    [RingMask(causal=True), RingMask(causal=False), RingMask(causal=True, sliding_window=5)],
+)
+@pytest.mark.parametrize("chunk_size", [1, 3, 64])
+def test_chunked_ring_matches_dense(tmp_path, chunk_size, ring_mask):
+    block_lens = [7, 0, 4, 9]
+    run_ring_workers(
+        _chunked_worker, len(block_lens), tmp_path, block_lens, chunk_size, ring_mask
+    )
+
+
+def test_kv_chunks():
+    strategy = RingAttentionStrategy(block_lens=[10], chunk_size=4)
+    assert strategy.kv_chunks(10) == [(0, 4), (4, 4), (8, 2)]
+    assert strategy.kv_chunks(0) == []
+    strategy.set_chunk_size(None)
+    assert strategy.kv_chunks(10) == [(0, 10)]
+
+
+def test_chunk_size_follows_links():
+    # 10 us latency, 1 KB per token at 1 GB/s: 1 us per token
+    cost_model = CostModel(
+        speeds=[1e9] * 2, kv_bytes_per_token=1000, bandwidth=1.0, latency_us=10.0
+    )
+    assert cost_model.chunk_size([1000, 1000]) == 40
+    assert cost_model.chunk_size([1000, 1000], latency_overhead=1.0) == 10
+    assert cost_model.chunk_size([8, 4]) == 8
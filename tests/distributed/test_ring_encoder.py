@@ -0,0 +1,88 @@
+import torch
+
+from fms.distributed.strategy import RingAttentionStrategy
+from fms.models.mpnet import Mpnet
+from fms.models.roberta import RoBERTa, RoBERTaForClassification
+from ring_testing import run_ring_workers
+
+
+_BLOCK_LENS = [9, 4, 11]
+_LENGTHS = [24, 15]
+
+
+def _padding_mask():
+    # bidirectional padding mask over keys, pad tokens on the right
+    seq_len = sum(_BLOCK_LENS)
+    valid = torch.arange(seq_len)[None, :] < torch.tensor(_LENGTHS)[:, None]
+    return valid[:, None, :].expand(-1, seq_len, -1)
+
+
+def _input_ids(pad_id):
+    input_ids = torch.randint(3, 64, (len(_LENGTHS), sum(_BLOCK_LENS)))
+    for b, length in enumerate(_LENGTHS):
+        input_ids[b, length:] = pad_id
+    return input_ids
+
+
+def _model_pair(model_cls, gather_output=True, **kwargs):
+    torch.manual_seed(0)
+    ref = model_cls(**kwargs)
+    ref.reset_parameters()
+    strategy = RingAttentionStrategy(block_lens=_BLOCK_LENS, gather_output=gather_output)
+    ring = model_cls(distributed_strategy=strategy, **kwargs)
+    ring.load_state_dict(ref.state_dict())
+    return ref.eval(), ring.eval(), strategy
+
+
+def _encoder_worker(rank, world_size):
+    roberta_kwargs = dict(
+        src_vocab_size=64, emb_dim=32, nheads=4, nlayers=2, max_pos=64, p_dropout=0.0
+    )
+    ref, ring, _ = _model_pair(RoBERTaForClassification, num_classes=3, **roberta_kwargs)
+    input_ids = _input_ids(ref.config.pad_id)
+    with torch.no_grad():
+        expected = ref(input_ids, mask=_padding_mask())
+        actual = ring(input_ids, mask=_padding_mask())
+    torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+    # pooling from the sharded output only needs the rank holding CLS
+    ref, ring, strategy = _model_pair(RoBERTa, gather_output=False, **roberta_kwargs)
+    with torch.no_grad():
+        expected = ref.base_model(input_ids, mask=_padding_mask())
+        local = ring.base_model(input_ids, mask=_padding_mask())
+        start, length = strategy.local_q_start, strategy.local_q_len
+        torch.testing.assert_close(
+            local, expected[:, start : start + length], atol=1e-4, rtol=1e-4
+        )
+        torch.testing.assert_close(
+            strategy.first_token(local), expected[:, :1], atol=1e-4, rtol=1e-4
+        )
+
+    # relative position bias is evaluated per KV block
+    ref, ring, _ = _model_pair(
+        Mpnet,
+        src_vocab_size=64,
+        emb_dim=32,
+        nheads=4,
+        nlayers=2,
+        p_dropout=0.0,
+        hidden_dropout_prob=0.0,
+        max_expected_seq_len=64,
+    )
+    input_ids = _input_ids(ref.config.pad_id)
+    with torch.no_grad():
+        expected = ref(input_ids, mask=_padding_mask())
+        actual = ring(input_ids, mask=_padding_mask())
+    for a, e in zip(actual, expected):
+        torch.testing.assert_close(a, e, atol=1e-4, rtol=1e-4)
+
+
+def test_bidirectional_ring_matches_encoders(tmp_path):
+    world_size = len(_BLOCK_LENS)
+    run_ring_workers(_encoder_worker, world_size, tmp_path)
+
+
+def test_first_token_single_rank():
+    strategy = RingAttentionStrategy(block_lens=[8])
+    x = torch.randn(2, 8, 4)
+    torch.testing.assert_close(strategy.first_token(x), x[:, :1])
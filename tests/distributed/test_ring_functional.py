@@ -0,0 +1,32 @@
+import pytest
+
+from fms.distributed.ring_attention import _compute_attention_ring_functional
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy, RingTimings
+from ring_testing import check_ring_loop, run_ring_workers
+
+
+def _functional_worker(rank, world_size, block_lens, ring_mask):
+    strategy = RingAttentionStrategy(block_lens=block_lens)
+    check_ring_loop(
+        _compute_attention_ring_functional,
+        strategy,
+        ring_mask,
+        kvheads=4,
+        sliding_window=ring_mask.sliding_window,
+    )
+
+
+@pytest.mark.parametrize(
+    "ring_mask",
+    [RingMask(causal=True), RingMask(causal=False), RingMask(causal=True, sliding_window=4)],
+)
+def test_functional_ring_matches_dense(tmp_path, ring_mask):
+    block_lens = [7, 3, 5]
+    run_ring_workers(_functional_worker, len(block_lens), tmp_path, block_lens, ring_mask)
+
+
+def test_ring_timings_reset():
+    timings = RingTimings(layers=3, compute_ms=1.5, comm_ms=2.0, bytes=1024)
+    timings.reset()
+    assert timings == RingTimings()
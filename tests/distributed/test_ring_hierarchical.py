@@ -0,0 +1,60 @@
+import pytest
+
+from fms.distributed.ring_attention import _compute_attention_hierarchical_ring
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import (
+    HierarchicalRingAttentionStrategy,
+    hierarchical_block_lens,
+)
+from fms.models import get_model
+from ring_testing import check_kv_dtype_on_wire, check_ring_loop, run_ring_workers
+
+
+def _hierarchical_worker(rank, world_size, ranks_per_node, causal):
+    block_lens = hierarchical_block_lens(22, [1.0, 2.0, 3.0, 1.5], ranks_per_node)
+    strategy = HierarchicalRingAttentionStrategy(block_lens, ranks_per_node)
+    # every block is visited exactly once
+    sources = [strategy.block_source(i) for i in range(world_size)]
+    assert sorted(sources) == list(range(world_size))
+    assert sources[0] == strategy.rank
+
+    ring_mask = RingMask(causal=causal)
+    check_ring_loop(_compute_attention_hierarchical_ring, strategy, ring_mask)
+    check_kv_dtype_on_wire(_compute_attention_hierarchical_ring, strategy, ring_mask)
+
+@pytest.mark.parametrize("ranks_per_node", [1, 2, 4])
+@pytest.mark.parametrize("causal", [True, False])
+def test_hierarchical_ring_matches_dense(tmp_path, ranks_per_node, causal):
+    world_size = 4
+    run_ring_workers(_hierarchical_worker, world_size, tmp_path, ranks_per_node, causal)
+
+
+def test_block_lens_are_weighted_per_level():
+    # node 0 has weight 3 and node 1 weight 1: 30 / 10 tokens, then 2:1 within
+    assert hierarchical_block_lens(40, [2.0, 1.0, 0.5, 0.5], 2) == [20, 10, 5, 5]
+    assert sum(hierarchical_block_lens(23, [1.0, 2.0, 3.0], 1)) == 23
+
+
+def _get_model_worker(rank, world_size):
+    model = get_model(
+        "llama",
+        "micro",
+        distributed_strategy="ring",
+        block_lens=[8, 8, 8, 8],
+        ranks_per_node=2,
+        ring_order=[1, 0, 3, 2],
+        ring_profile=True,
+        ring_kv_compression="int8",
+    )
+    strategy = model.distributed_strategy
+    assert isinstance(strategy, HierarchicalRingAttentionStrategy)
+    assert strategy.ring_order == [1, 0, 3, 2]
+    assert strategy.profile and strategy.kv_compression == "int8"
+
+    with pytest.raises(ValueError):
+        HierarchicalRingAttentionStrategy([8, 8, 8, 8], 2, bidirectional=True)
+
+
+def test_get_model_hierarchical_ring_options(tmp_path):
+    world_size = 4
+    run_ring_workers(_get_model_worker, world_size, tmp_path)
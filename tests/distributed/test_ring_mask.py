@@ -0,0 +1,129 @@
+import math
+
+import pytest
+import torch
+
+from fms.distributed.ring_attention import _block_softmax_stats_naive
+from fms.distributed.ring_mask import RingMask
+from fms.utils.generation import pad_input_ids
+
+
+def _dense_reference(ring_mask: RingMask, batch_size: int, seq_len: int):
+    """Build the full [B, N, N] boolean mask element by element."""
+    dense = torch.zeros(batch_size, seq_len, seq_len, dtype=torch.bool)
+    docs = ring_mask.document_ids
+    for b in range(batch_size):
+        for i in range(seq_len):
+            for j in range(seq_len):
+                ok = j <= i if ring_mask.causal else True
+                if ring_mask.sliding_window is not None:
+                    ok = ok and abs(i - j) < ring_mask.sliding_window
+                if j < ring_mask.prefix_len:
+                    ok = True
+                if docs is not None:
+                    ok = ok and bool(docs[b % docs.size(0), i] == docs[b % docs.size(0), j])
+                if ring_mask.valid_start is not None:
+                    vs = int(ring_mask.valid_start[b])
+                    ve = int(ring_mask.valid_end[b])
+                    ok = ok and ((vs <= i < ve) == (vs <= j < ve))
+                dense[b, i, j] = ok
+    return dense
+
+
+_SEQ_LEN = 24
+_MASKS = [
+    RingMask(causal=True),
+    RingMask(causal=False),
+    RingMask(causal=True, sliding_window=5),
+    RingMask(causal=False, sliding_window=4),
+    RingMask(causal=True, prefix_len=7),
+    RingMask(causal=True, sliding_window=3, prefix_len=4),
+    RingMask(
+        causal=True,
+        document_ids=torch.tensor([0] * 9 + [1] * 6 + [2] * 9),
+    ),
+    RingMask(
+        causal=False,
+        document_ids=torch.tensor([[0] * 12 + [1] * 12, [0] * 3 + [1] * 21]),
+    ),
+    RingMask.from_padding([24, 17], _SEQ_LEN, padding_side="left"),
+    RingMask.from_padding([10, 20], _SEQ_LEN, padding_side="right", causal=False),
+]
+
+
+@pytest.mark.parametrize("ring_mask", _MASKS)
+def test_block_mask_matches_dense(ring_mask):
+    dense = _dense_reference(ring_mask, 2, _SEQ_LEN)
+    idx = torch.arange(_SEQ_LEN)
+    block = ring_mask.block_mask(idx, idx)[:, 0].expand(2, -1, -1)
+    torch.testing.assert_close(block, dense)
+
+    # a single off-diagonal block is the corresponding slice of the dense mask
+    block = ring_mask.block_mask(idx[5:13], idx[2:19])[:, 0].expand(2, -1, -1)
+    torch.testing.assert_close(block, dense[:, 5:13, 2:19])
+
+
+@pytest.mark.parametrize("ring_mask", _MASKS)
+def test_block_key_range_is_conservative(ring_mask):
+    dense = _dense_reference(ring_mask, 2, _SEQ_LEN)
+    bounds = [0, 3, 8, 9, 16, 24]
+    for q_start, q_end in zip(bounds[:-1], bounds[1:]):
+        for k_start, k_end in zip(bounds[:-1], bounds[1:]):
+            lo, hi = ring_mask.block_key_range(q_start, q_end, k_start, k_end)
+            visible = dense[:, q_start:q_end, k_start:k_end].any(dim=(0, 1))
+            visible_keys = torch.nonzero(visible).flatten() + k_start
+            if lo >= hi:
+                assert visible_keys.numel() == 0
+                assert ring_mask.is_block_masked(q_start, q_end, k_start, k_end)
+            else:
+                assert k_start <= lo and hi <= k_end
+                assert all(lo <= int(k) < hi for k in visible_keys)
+
+
+def test_causal_skips_future_blocks():
+    ring_mask = RingMask(causal=True)
+    assert ring_mask.is_block_masked(0, 8, 8, 16)
+    assert not ring_mask.is_block_masked(8, 16, 0, 8)
+
+
+def test_sliding_window_trims_old_keys():
+    ring_mask = RingMask(causal=True, sliding_window=4)
+    assert ring_mask.block_key_range(100, 110, 0, 110) == (97, 110)
+    assert ring_mask.is_block_masked(100, 110, 0, 90)
+
+
+def test_from_padding_matches_pad_input_ids():
+    seqs = [torch.arange(1, 6), torch.arange(1, 9)]
+    _, padding_kwargs = pad_input_ids(seqs, is_causal_mask=True)
+    expected = padding_kwargs["mask"] == 0.0
+    ring_mask = RingMask.from_padding([5, 8], 8)
+    idx = torch.arange(8)
+    torch.testing.assert_close(ring_mask.block_mask(idx, idx)[:, 0], expected)
+    with pytest.raises(ValueError):
+        RingMask.from_padding([5, 8], 8, padding_side="center")
+
+
+def test_naive_stats_with_ring_mask_match_dense():
+    torch.manual_seed(0)
+    q = torch.randn(2, 3, 10, 16)
+    k = torch.randn(2, 3, 14, 16)
+    v = torch.randn(2, 3, 14, 8)
+    q_idx = torch.arange(10, 20)
+    k_idx = torch.arange(6, 20)
+    ring_mask = RingMask(
+        causal=True,
+        sliding_window=6,
+        valid_start=torch.tensor([0, 8]),
+        valid_end=torch.tensor([20, 20]),
+    )
+    allowed = ring_mask.block_mask(q_idx, k_idx)
+    additive = torch.zeros(allowed.shape).masked_fill(~allowed, float("-inf"))
+
+    z, l, m = _block_softmax_stats_naive(
+        q, k, v, q_idx, k_idx, math.sqrt(16), None, True, ring_mask
+    )
+    z_ref, l_ref, m_ref = _block_softmax_stats_naive(
+        q, k, v, q_idx, k_idx, math.sqrt(16), additive, False
+    )
+    torch.testing.assert_close(z / l, z_ref / l_ref)
+    torch.testing.assert_close(m, m_ref)
@@ -0,0 +1,111 @@
+import pytest
+import torch
+import torch.distributed as dist
+
+from fms.distributed.emulation import HeteroEmulator
+from fms.distributed.ring_attention import ring_attention
+from fms.distributed.ring_metrics import RingMetrics, collect_ring_metrics
+from fms.distributed.strategy import RingAttentionStrategy
+from fms.modules.attention import MultiHeadAttention
+from fms.training.plugins import MetricReporter
+from ring_testing import run_ring_workers
+
+
+def test_straggler_score():
+    metrics = RingMetrics(
+        forwards=2,
+        busy_ms=[10.0, 20.0, 30.0],
+        wait_ms=[30.0, 20.0, 0.0],
+        hop_wait_ms=[[30.0], [20.0], [0.0]],
+    )
+    assert metrics.straggler_score == pytest.approx(1.5)
+    assert metrics.straggler == 2
+    assert metrics.idle_fraction == pytest.approx([0.75, 0.5, 0.0])
+    flat = metrics.as_dict()
+    assert flat["ring_straggler_score"] == pytest.approx(1.5)
+    assert flat["ring_wait_ms/0"] == 30.0
+
+    balanced = RingMetrics(1, [5.0, 5.0], [1.0, 1.0], [[1.0], [1.0]])
+    assert balanced.straggler_score == 1.0
+
+
+def test_no_profiled_forwards():
+    strategy = RingAttentionStrategy(block_lens=[4], profile=True)
+    assert collect_ring_metrics(strategy) is None
+
+
+def _metrics_worker(rank, world_size, ring_kwargs, steps):
+    # the last rank is a straggler the others wait for
+    emulator = HeteroEmulator(speed=0.1 if rank == world_size - 1 else 1.0)
+    strategy = RingAttentionStrategy(
+        block_lens=[8] * world_size, profile=True, emulator=emulator, **ring_kwargs
+    )
+    torch.manual_seed(0)
+    attn = MultiHeadAttention(16, 4, 4, nheads=4, kvheads=4)
+    x = strategy.shard_input(torch.randn(1, 8 * world_size, 16))
+    for _ in range(2):
+        ring_attention(x_norm=x, attn_module=attn, strategy=strategy, causal=False)
+
+    assert strategy.timings.forwards == 2
+    # one entry per ring step that waited on a block
+    assert len(strategy.timings.hop_wait_ms) == steps
+    metrics = collect_ring_metrics(strategy)
+    assert strategy.timings.forwards == 0
+    assert metrics.forwards == 2
+    assert metrics.straggler == world_size - 1
+    assert metrics.straggler_score > 1.2
+    assert metrics.wait_ms[0] > metrics.wait_ms[world_size - 1]
+    # waits on sends are not a hop of the ring
+    if ring_kwargs.get("prefetch_depth", 1) > 1:
+        assert sum(metrics.hop_wait_ms[0]) <= metrics.wait_ms[0]
+    else:
+        assert sum(metrics.hop_wait_ms[0]) == pytest.approx(metrics.wait_ms[0])
+
+
+@pytest.mark.parametrize(
+    "ring_kwargs, steps",
+    [
+        # the pass-KV ring waits for the next block at the end of a step
+        ({}, 2),
+        # these wait for a block at the start of the step that attends to it
+        ({"prefetch_depth": 2}, 3),
+        ({"chunk_size": 3}, 3),
+        # world_size // 2 hops, both directions waited on at the same step
+        ({"bidirectional": True}, 1),
+    ],
+)
+def test_ring_metrics_find_straggler(tmp_path, ring_kwargs, steps):
+    world_size = 3
+    run_ring_workers(_metrics_worker, world_size, tmp_path, ring_kwargs, steps)
+
+
+def _reporter_worker(rank, world_size):
+    strategy = RingAttentionStrategy(block_lens=[8] * world_size, profile=True)
+    torch.manual_seed(0)
+    attn = MultiHeadAttention(16, 4, 4, nheads=4, kvheads=4)
+    x = strategy.shard_input(torch.randn(1, 8 * world_size, 16))
+    reports = []
+    # the ranks' clocks disagree on whether it is time to report
+    reporter = MetricReporter(
+        seconds=0 if rank == 0 else 1e9,
+        writer=lambda *args: reports.append(args[-1]),
+        ring_strategy=strategy,
+    )
+    ring_attention(x_norm=x, attn_module=attn, strategy=strategy, causal=False)
+    reporter.step(0, 1, {"loss": 1.0, "batch_size": 1, "input_length": 8})
+    assert len(reports) == 1 and "ring_straggler" in reports[0]
+
+    reporter.seconds = 1e9 if rank == 0 else 0
+    ring_attention(x_norm=x, attn_module=attn, strategy=strategy, causal=False)
+    reporter.step(0, 2, {"loss": 1.0, "batch_size": 1, "input_length": 8})
+    assert len(reports) == 1
+
+    # the first rank's clock schedules the next check, the same on every rank
+    checks = [None] * world_size
+    dist.all_gather_object(checks, reporter._ring_next_check)
+    assert checks == [checks[0]] * world_size and checks[0] > 3
+
+
+def test_metric_reporter_reports_on_every_rank(tmp_path):
+    world_size = 3
+    run_ring_workers(_reporter_worker, world_size, tmp_path)
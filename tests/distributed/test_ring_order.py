@@ -0,0 +1,105 @@
+import pytest
+import torch
+
+from fms.distributed.ring_attention import _compute_attention_ring_pass_kv
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from fms.distributed.topology import (
+    hop_times,
+    load_topology,
+    optimize_ring_order,
+    row_links,
+    save_topology,
+)
+from ring_testing import dense_reference, random_qkv, run_ring_loop, run_ring_workers
+
+
+def _two_nvlink_pairs(n_pairs):
+    # fast links inside each pair (0-1, 2-3, ...), a slow default elsewhere and one
+    # fast bridge between consecutive pairs
+    bandwidth = [[10.0] * (2 * n_pairs) for _ in range(2 * n_pairs)]
+    for p in range(n_pairs):
+        a, b = 2 * p, 2 * p + 1
+        bandwidth[a][b] = bandwidth[b][a] = 100.0
+        c = (2 * p + 2) % (2 * n_pairs)
+        bandwidth[b][c] = bandwidth[c][b] = 50.0
+    return bandwidth
+
+
+def _relabel(bandwidth, perm):
+    n = len(bandwidth)
+    return [[bandwidth[perm[i]][perm[j]] for j in range(n)] for i in range(n)]
+
+
+def test_optimizer_avoids_slow_links():
+    # fast pairs are (0, 2) and (1, 3), the launcher order crosses slow links
+    bandwidth = _relabel(_two_nvlink_pairs(2), [0, 2, 1, 3])
+    assert max(hop_times([0, 1, 2, 3], bandwidth)) == 1 / 10.0
+    order = optimize_ring_order(bandwidth)
+    assert order[0] == 0
+    assert max(hop_times(order, bandwidth)) == 1 / 50.0
+
+
+def test_greedy_search_on_large_rings():
+    bandwidth = _two_nvlink_pairs(6)
+    # shuffle the rank ids so the launcher order is bad
+    perm = torch.randperm(12, generator=torch.Generator().manual_seed(0)).tolist()
+    shuffled = _relabel(bandwidth, perm)
+    order = optimize_ring_order(shuffled)
+    assert sorted(order) == list(range(12))
+    assert max(hop_times(order, shuffled)) == 1 / 50.0
+
+
+def test_latency_matters_for_small_messages():
+    bandwidth = [[0, 100, 10], [100, 0, 100], [10, 100, 0]]
+    latency = [[0, 50, 1], [50, 0, 1], [1, 1, 0]]
+    times = hop_times([0, 1, 2], bandwidth, latency, message_bytes=1024)
+    assert times[0] > times[1]
+    assert times[0] == pytest.approx(50e-6 + 1024 / 100e9)
+
+
+def test_topology_file_round_trip(tmp_path):
+    bandwidth = _two_nvlink_pairs(2)
+    latency = [[1.0] * 4 for _ in range(4)]
+    path = str(tmp_path / "topology.json")
+    save_topology(path, bandwidth, latency)
+    assert load_topology(path) == (bandwidth, latency)
+
+
+def test_row_links_take_the_slowest_column():
+    # rows of two ranks; the second column of rows 0 -> 1 is the slow one
+    bandwidth = [[100.0] * 4 for _ in range(4)]
+    bandwidth[1][3] = 10.0
+    latency = [[1.0] * 4 for _ in range(4)]
+    latency[2][0] = 5.0
+    rows, row_latency = row_links(bandwidth, latency, 2)
+    assert rows == [[100.0, 10.0], [100.0, 100.0]]
+    assert row_latency == [[1.0, 1.0], [5.0, 1.0]]
+    assert row_links(bandwidth, None, 4) == ([[100.0]], None)
+    with pytest.raises(ValueError):
+        row_links(bandwidth, None, 3)
+
+
+def _ordered_ring_worker(rank, world_size, ring_order):
+    block_lens = [5, 8, 3, 8]
+    strategy = RingAttentionStrategy(block_lens=block_lens, ring_order=ring_order)
+    assert strategy.rank == ring_order.index(rank)
+
+    q, k, v = random_qkv(sum(block_lens), nheads=2)
+    ring_mask = RingMask(causal=True)
+    out, shard = run_ring_loop(_compute_attention_ring_pass_kv, strategy, ring_mask, q, k, v)
+    assert (shard.start, shard.stop - shard.start) == (
+        strategy.block_starts[strategy.rank],
+        block_lens[strategy.rank],
+    )
+    expected = dense_reference(q, k, v, ring_mask)
+    torch.testing.assert_close(out, expected[:, :, shard])
+
+    # gathers follow the ring order, not the group ranks
+    gathered = strategy.gather_tensor(out.transpose(1, 2), dim=1)
+    torch.testing.assert_close(gathered, expected.transpose(1, 2))
+
+
+def test_ring_follows_logical_order(tmp_path):
+    ring_order = [2, 0, 3, 1]
+    run_ring_workers(_ordered_ring_worker, len(ring_order), tmp_path, ring_order)
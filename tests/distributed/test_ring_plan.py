@@ -0,0 +1,76 @@
+import pytest
+import torch
+
+from fms.distributed import ring_attention, ring_plan
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from fms.models.llama import LLaMA
+from ring_testing import dense_reference, random_qkv, run_ring_loop, run_ring_workers
+
+
+def _plan_worker(rank, world_size, block_lens):
+    strategy = RingAttentionStrategy(block_lens=block_lens)
+    torch.manual_seed(0)
+    config = dict(src_vocab_size=64, emb_dim=32, nheads=4, kvheads=2, nlayers=3)
+    ref = LLaMA(**config)
+    ref.reset_parameters()
+    model = LLaMA(distributed_strategy=strategy, **config)
+    model.load_state_dict(ref.state_dict())
+
+    builds = []
+
+    def counting_build(*args, **kwargs):
+        builds.append(1)
+        return ring_plan.build_ring_plan(*args, **kwargs)
+
+    # patched in this worker process only
+    ring_attention.build_ring_plan = counting_build
+    input_ids = torch.randint(0, 64, (2, sum(block_lens)))
+    with torch.no_grad():
+        expected = ref(input_ids, is_causal_mask=True)
+        for _ in range(2):
+            actual = model(input_ids, is_causal_mask=True)
+            torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+    # one plan per forward, shared by all three layers
+    assert len(builds) == 2
+    assert len(strategy._ring_plans) == 1
+
+
+def test_plan_is_shared_by_layers(tmp_path):
+    block_lens = [5, 9, 2]
+    run_ring_workers(_plan_worker, len(block_lens), tmp_path, block_lens)
+
+
+@pytest.mark.parametrize("sliding_window", [None, 3])
+def test_plan_matches_strategy_layout(sliding_window):
+    strategy = RingAttentionStrategy(block_lens=[8])
+    strategy.shard_input(torch.empty(1, 8))
+    plan = ring_plan.build_ring_plan(
+        strategy, RingMask(causal=True, sliding_window=sliding_window), None, torch.device("cpu")
+    )
+    assert plan.num_steps == 1
+    assert plan.blocks[0].key_range == (0, 8)
+    assert torch.equal(plan.query_indices, torch.arange(8))
+    assert plan.recv_lens == [0]
+
+    k, v = torch.empty(1, 2, 8, 4), torch.empty(1, 2, 8, 4)
+    # two alternating buffer sets, reused across calls
+    assert plan.recv_buffers(0, k, v)[0] is plan.recv_buffers(2, k, v)[0]
+    assert plan.recv_buffers(0, k, v)[0] is not plan.recv_buffers(1, k, v)[0]
+
+
+def test_stale_plan_is_rebuilt():
+    strategy = RingAttentionStrategy(block_lens=[8])
+    ring_mask = RingMask(causal=True)
+    strategy.shard_input(torch.empty(1, 8))
+    stale = ring_attention._ring_plan(strategy, ring_mask, True, None, torch.device("cpu"))
+
+    # a planner repartitioned the sequence since the plan was built
+    strategy.set_block_lens([6])
+    q, k, v = random_qkv(6)
+    out, _ = run_ring_loop(
+        ring_attention._compute_attention_ring_pass_kv,
+        strategy, ring_mask, q, k, v, plan=stale,
+    )
+    assert not stale.matches(ring_attention._plan_key(strategy, ring_mask, True, None))
+    torch.testing.assert_close(out, dense_reference(q, k, v, ring_mask))
@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+from fms.distributed.ring_attention import _compute_attention_prefetch_ring
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from ring_testing import check_kv_dtype_on_wire, check_ring_loop, run_ring_workers
+
+
+def _prefetch_worker(rank, world_size, block_lens, depth, ring_mask):
+    strategy = RingAttentionStrategy(block_lens=block_lens, prefetch_depth=depth)
+    # a straggler: the other ranks keep forwarding blocks meanwhile
+    if rank == 1:
+        time.sleep(0.2)
+    check_ring_loop(_compute_attention_prefetch_ring, strategy, ring_mask, batch_size=2)
+    check_kv_dtype_on_wire(_compute_attention_prefetch_ring, strategy, ring_mask)
+
+
+@pytest.mark.parametrize(
+    "ring_mask",
+    [RingMask(causal=True), RingMask(causal=False), RingMask(causal=True, sliding_window=4)],
+)
+@pytest.mark.parametrize("depth", [2, 3, 8])
+def test_prefetch_ring_matches_dense(tmp_path, depth, ring_mask):
+    block_lens = [6, 3, 0, 8, 5]
+    run_ring_workers(
+        _prefetch_worker, len(block_lens), tmp_path, block_lens, depth, ring_mask
+    )
+
+
+def test_prefetch_depth_excludes_chunking():
+    strategy = RingAttentionStrategy(block_lens=[4], prefetch_depth=2)
+    with pytest.raises(ValueError):
+        strategy.set_chunk_size(2)
+    with pytest.raises(ValueError):
+        RingAttentionStrategy(block_lens=[4], prefetch_depth=0)
@@ -0,0 +1,78 @@
+import pytest
+import torch
+
+from fms.distributed.strategy import RingAttentionStrategy
+from fms.models.bamba import Bamba
+from fms.modules.ssm import SSM
+from ring_testing import run_ring_workers
+
+
+def _ssm_worker(rank, world_size, block_lens):
+    torch.manual_seed(0)
+    ssm = SSM(
+        nheads=4,
+        emb_dim=16,
+        state_size=8,
+        conv_kernel=4,
+        expand=2.0,
+        use_bias=False,
+        use_conv_bias=True,
+        activation_fn="swish",
+        norm_eps=1e-5,
+        n_groups=2,
+        head_dim=8,
+        chunk_size=4,
+    )
+    x = torch.randn(2, sum(block_lens), 16)
+    with torch.no_grad():
+        expected, _ = ssm(x, None)
+
+        strategy = RingAttentionStrategy(block_lens=block_lens)
+        local_x = strategy.shard_input(x)
+        actual, _ = ssm(local_x, None, ring_strategy=strategy)
+
+    start, length = strategy.local_q_start, strategy.local_q_len
+    torch.testing.assert_close(
+        actual, expected[:, start : start + length], atol=1e-5, rtol=1e-4
+    )
+
+
+def _bamba_worker(rank, world_size, block_lens):
+    config = dict(
+        src_vocab_size=64,
+        emb_dim=32,
+        nheads=4,
+        kvheads=2,
+        nlayers=3,
+        attn_layer_indices=[1],
+        mamba_n_heads=4,
+        head_dim=16,
+        state_size=8,
+        n_groups=1,
+        chunk_size=4,
+        multiple_of=2,
+    )
+    torch.manual_seed(0)
+    ref = Bamba(**config)
+    ref.reset_parameters()
+    ring = Bamba(
+        distributed_strategy=RingAttentionStrategy(block_lens=block_lens), **config
+    )
+    ring.load_state_dict(ref.state_dict())
+
+    input_ids = torch.randint(0, 64, (1, sum(block_lens)))
+    with torch.no_grad():
+        expected = ref(input_ids, is_causal_mask=True)
+        actual = ring(input_ids, is_causal_mask=True)
+    torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+
+# a rank with an empty shard passes the carried conv and SSM state through
+@pytest.mark.parametrize("block_lens", [[8, 8], [5, 1, 11], [6, 0, 10]])
+def test_ssm_context_parallel_matches_full(tmp_path, block_lens):
+    run_ring_workers(_ssm_worker, len(block_lens), tmp_path, block_lens)
+
+
+@pytest.mark.parametrize("block_lens", [[7, 13], [7, 0, 13]])
+def test_bamba_context_parallel_matches_full(tmp_path, block_lens):
+    run_ring_workers(_bamba_worker, len(block_lens), tmp_path, block_lens)
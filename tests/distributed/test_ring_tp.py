@@ -0,0 +1,80 @@
+import pytest
+import torch
+
+from fms.distributed.strategy import RingTensorParallelStrategy
+from fms.distributed.topology import save_topology
+from fms.models import get_model
+from fms.models.llama import LLaMA
+from fms.utils import serialization
+from ring_testing import run_ring_workers
+
+
+def _ring_tp_worker(rank, world_size, tp_size, block_lens, kvheads):
+    strategy = RingTensorParallelStrategy(block_lens=block_lens, tp_size=tp_size)
+    assert strategy.tp_group.size() == tp_size
+    assert strategy.world_size == len(block_lens)
+    assert strategy.rank == rank // tp_size
+
+    torch.manual_seed(0)
+    config = dict(src_vocab_size=64, emb_dim=32, nheads=4, kvheads=kvheads, nlayers=2)
+    ref = LLaMA(**config)
+    ref.reset_parameters()
+    model = LLaMA(distributed_strategy=strategy, **config)
+    serialization.load_state_dict_into_model(
+        model,
+        dict(ref.state_dict()),
+        architecture="llama",
+        source="fms",
+        distributed_strategy="ring_tp",
+    )
+
+    input_ids = torch.randint(0, 64, (2, sum(block_lens)))
+    with torch.no_grad():
+        expected = ref(input_ids, is_causal_mask=True)
+        actual = model(input_ids, is_causal_mask=True)
+    torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize("kvheads", [1, 2, 4])
+@pytest.mark.parametrize("tp_size,block_lens", [(2, [11, 5]), (1, [7, 2, 5, 4])])
+def test_ring_tp_matches_single_rank(tmp_path, tp_size, block_lens, kvheads):
+    world_size = tp_size * len(block_lens)
+    run_ring_workers(_ring_tp_worker, world_size, tmp_path, tp_size, block_lens, kvheads)
+
+
+def _get_model_worker(rank, world_size, topology):
+    model = get_model(
+        "llama",
+        "micro",
+        distributed_strategy="ring_tp",
+        block_lens=[8, 8, 8],
+        tp_size=2,
+        ring_topology=topology,
+        ring_profile=True,
+        ring_kv_compression="int8",
+    )
+    strategy = model.distributed_strategy
+    assert isinstance(strategy, RingTensorParallelStrategy)
+    # the ring runs over the three TP groups, avoiding the slow link of one column
+    assert strategy.ring_order == [0, 2, 1]
+    assert strategy.profile and strategy.kv_compression == "int8"
+
+    with pytest.raises(ValueError):
+        get_model(
+            "llama",
+            "micro",
+            distributed_strategy="ring_tp",
+            block_lens=[8, 8, 8],
+            tp_size=2,
+            ring_calibrate=True,
+        )
+
+
+def test_get_model_ring_tp_options(tmp_path):
+    world_size = 6
+    bandwidth = [[100.0] * world_size for _ in range(world_size)]
+    # second column of TP group 0 -> TP group 1
+    bandwidth[1][3] = 1.0
+    topology = str(tmp_path / "topology.json")
+    save_topology(topology, bandwidth)
+    run_ring_workers(_get_model_worker, world_size, tmp_path, topology)
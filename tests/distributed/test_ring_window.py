@@ -0,0 +1,94 @@
+import pytest
+import torch
+
+from fms.distributed.ring_attention import _compute_attention_ring_pass_kv
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from fms.models.mistral import Mistral
+from ring_testing import dense_reference, random_qkv, run_ring_loop, run_ring_workers
+
+
+def _windowed_ring_worker(rank, world_size, block_lens, window, steps):
+    strategy = RingAttentionStrategy(block_lens=block_lens)
+    strategy.shard_input(torch.empty(1, sum(block_lens)))
+    assert strategy.ring_steps(window) == steps
+
+    # the window is given to the loop, not on the mask
+    q, k, v = random_qkv(sum(block_lens))
+    out, shard = run_ring_loop(
+        _compute_attention_ring_pass_kv,
+        strategy,
+        RingMask(causal=True),
+        q,
+        k,
+        v,
+        sliding_window=window,
+    )
+    expected = dense_reference(q, k, v, RingMask(causal=True, sliding_window=window))
+    torch.testing.assert_close(out, expected[:, :, shard])
+
+@pytest.mark.parametrize(
+    "block_lens,window,steps",
+    [
+        ([8, 8, 8, 8], 5, 2),
+        ([12, 4, 6, 10], 7, 3),
+        ([8, 8, 8, 8], 64, 4),
+    ],
+)
+def test_windowed_ring_matches_dense(tmp_path, block_lens, window, steps):
+    world_size = len(block_lens)
+    run_ring_workers(_windowed_ring_worker, world_size, tmp_path, block_lens, window, steps)
+
+
+def test_window_span_is_tail_of_block():
+    strategy = RingAttentionStrategy(block_lens=[16])
+    # a single rank never sends anything under a window
+    assert strategy.kv_span(0, 4) == (16, 0)
+    assert strategy.kv_span(0) == (0, 16)
+    assert strategy.ring_steps(4) == 1
+
+
+_MISTRAL_KWARGS = dict(
+    src_vocab_size=64,
+    emb_dim=32,
+    nheads=4,
+    kvheads=2,
+    head_dim=8,
+    nlayers=2,
+    multiple_of=2,
+    max_expected_seq_len=64,
+    sliding_window=6,
+)
+
+
+def _mistral_worker(rank, world_size, block_lens):
+    torch.manual_seed(0)
+    ref = Mistral(**_MISTRAL_KWARGS)
+    ref.reset_parameters()
+    ref.eval()
+    seq_len = sum(block_lens)
+    input_ids = torch.randint(0, 64, (2, seq_len))
+    idx = torch.arange(seq_len)
+    window_mask = RingMask(causal=True, sliding_window=6).block_mask(idx, idx)[:, 0]
+
+    for sliding_window in (False, True):
+        strategy = RingAttentionStrategy(
+            block_lens=block_lens, sliding_window=sliding_window
+        )
+        ring = Mistral(distributed_strategy=strategy, **_MISTRAL_KWARGS)
+        ring.load_state_dict(ref.state_dict())
+        ring.eval()
+        with torch.no_grad():
+            actual = ring(input_ids, is_causal_mask=True)
+            if sliding_window:
+                # the window is opt-in, the reference gets it as a mask
+                expected = ref(input_ids, mask=window_mask.expand(2, -1, -1))
+            else:
+                # by default the ring attends like the non-distributed model
+                expected = ref(input_ids, is_causal_mask=True)
+        torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+
+def test_mistral_ring_matches_model(tmp_path):
+    block_lens = [11, 5, 8]
+    run_ring_workers(_mistral_worker, len(block_lens), tmp_path, block_lens)
@@ -0,0 +1,67 @@
+import dataclasses
+import os
+
+import torch
+import torch.distributed as dist
+
+from fms.distributed.sweep import SweepCache, config_key, run_sweep
+
+
+@dataclasses.dataclass(frozen=True)
+class _Config:
+    seq_len: int
+    rank_mps: tuple
+
+    @property
+    def world_size(self):
+        return len(self.rank_mps)
+
+
+def _sum_ranks(rank, config):
+    assert os.environ["SWEEP_TEST_MPS"] == str(config.rank_mps[rank])
+    if config.seq_len < 0:
+        raise ValueError("bad config")
+    total = torch.tensor([float(config.rank_mps[rank])])
+    dist.all_reduce(total)
+    return {"total": total.item(), "world_size": dist.get_world_size()}
+
+
+def _mps_env(config, rank):
+    return {"SWEEP_TEST_MPS": config.rank_mps[rank]}
+
+
+def _never_called(rank, config):
+    raise AssertionError("cached configs must not run again")
+
+
+def test_sweep_resumes_from_cache(tmp_path):
+    cache_path = str(tmp_path / "sweep.jsonl")
+    configs = [_Config(16, (100, 50)), _Config(-1, (100, 50)), _Config(16, (100, 100, 30))]
+    seen = []
+    results = run_sweep(
+        configs, _sum_ranks, cache_path, env=_mps_env, on_result=lambda c, r: seen.append(c)
+    )
+    # the failing config is left out, the others run on their own number of ranks
+    assert [c for c, _ in results] == [configs[0], configs[2]]
+    assert seen == [configs[0], configs[2]]
+    assert results[0][1] == {"total": 150.0, "world_size": 2}
+    assert results[1][1] == {"total": 230.0, "world_size": 3}
+
+    resumed = run_sweep(configs[::2], _never_called, cache_path)
+    assert resumed == results
+
+
+def test_cache_skips_truncated_lines(tmp_path):
+    path = str(tmp_path / "sweep.jsonl")
+    cache = SweepCache(path)
+    cache.add(_Config(16, (100, 50)), {"total": 1.0})
+    with open(path, "a") as f:
+        f.write('{"key": "abc", "res')
+
+    cache = SweepCache(path)
+    assert len(cache) == 1
+    assert cache.get(_Config(16, (100, 50))) == {"total": 1.0}
+    cache.add(_Config(32, (100, 50)), {"total": 2.0})
+    reloaded = SweepCache(path)
+    assert len(reloaded) == 2
+    assert reloaded.results[config_key(_Config(32, (100, 50)))] == {"total": 2.0}
@@ -0,0 +1,114 @@
+import json
+
+import torch
+from torch import nn
+
+from fms.distributed.ring_attention import _compute_attention_ring_pass_kv
+from fms.distributed.ring_mask import RingMask
+from fms.distributed.strategy import RingAttentionStrategy
+from fms.distributed.tracing import Tracer, main, merge_traces, trace_modules
+from ring_testing import random_qkv, run_ring_loop, run_ring_workers
+
+
+def test_spans_and_layers():
+    tracer = Tracer(rank=3)
+    tracer.begin_layer()
+    with tracer.span("compute", "compute", block=8):
+        pass
+    tracer.next_hop()
+    with tracer.span("recv_wait", "comm"):
+        pass
+    tracer.end_layer()
+
+    compute, wait, layer = tracer.events
+    assert compute["args"] == {"layer": 0, "hop": 0, "block": 8}
+    assert wait["args"]["hop"] == 1
+    assert layer["name"] == "layer 0" and layer["dur"] >= compute["dur"]
+    assert {e["pid"] for e in tracer.events} == {3}
+    assert compute["tid"] != wait["tid"]
+
+    names = [e["name"] for e in tracer.trace()["traceEvents"] if e["ph"] == "M"]
+    assert "process_name" in names and "thread_name" in names
+    tracer.reset()
+    assert tracer.events == [] and tracer.layer == -1
+
+
+def test_merge_removes_clock_offsets(tmp_path):
+    traces = []
+    for rank, offset in enumerate([0.0, 500.0]):
+        tracer = Tracer(rank=rank)
+        tracer.clock_offset_us = offset
+        # both spans happened at the same time, on clocks 500us apart
+        tracer.add("compute", "compute", 1000.0 + offset, 1100.0 + offset)
+        traces.append(tracer.trace())
+    merged = merge_traces(traces)
+    spans = [e for e in merged["traceEvents"] if e["ph"] == "X"]
+    assert [e["ts"] for e in spans] == [0.0, 0.0]
+    assert {e["pid"] for e in merged["traceEvents"]} == {0, 1}
+
+    paths = []
+    for rank, trace in enumerate(traces):
+        paths.append(str(tmp_path / f"trace_rank{rank}.json"))
+        with open(paths[-1], "w") as f:
+            json.dump(trace, f)
+    main([str(tmp_path / "merged.json")] + paths)
+    with open(tmp_path / "merged.json") as f:
+        assert json.load(f) == merged
+
+
+def test_trace_modules():
+    class Model(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.layers = nn.ModuleList(
+                [nn.Sequential(nn.Linear(4, 4), nn.ReLU()) for _ in range(2)]
+            )
+
+        def forward(self, x):
+            for layer in self.layers:
+                x = layer(x)
+            return x
+
+    model = Model()
+    tracer = Tracer(rank=0)
+    handles = trace_modules(model, tracer)
+    model(torch.randn(2, 4))
+    names = [(e["name"], e["cat"]) for e in tracer.events]
+    assert ("layers.0", "layer") in names and ("layers.1.0", "compute") in names
+    assert len(names) == 6
+    for handle in handles:
+        handle.remove()
+
+
+def _traced_worker(rank, world_size, block_lens, trace_dir):
+    tracer = Tracer()
+    tracer.align_clocks()
+    strategy = RingAttentionStrategy(block_lens=block_lens, tracer=tracer)
+    q, k, v = random_qkv(sum(block_lens), kvheads=4)
+
+    tracer.begin_layer(0)
+    run_ring_loop(_compute_attention_ring_pass_kv, strategy, RingMask(causal=False), q, k, v)
+    tracer.end_layer()
+    tracer.save(f"{trace_dir}/trace_rank{rank}.json")
+
+    names = [e["name"] for e in tracer.events]
+    # one block per hop, every one attended without a mask
+    assert names.count("compute") == world_size
+    assert names.count("merge") == world_size
+    assert names.count("recv_wait") == world_size - 1
+    assert "send" in names and "layer 0" in names
+    hops = [e["args"]["hop"] for e in tracer.events if e["name"] == "compute"]
+    assert hops == list(range(world_size))
+
+
+def test_ring_trace(tmp_path):
+    block_lens = [5, 3, 4]
+    run_ring_workers(_traced_worker, len(block_lens), tmp_path, block_lens, str(tmp_path))
+    traces = []
+    for rank in range(len(block_lens)):
+        with open(tmp_path / f"trace_rank{rank}.json") as f:
+            traces.append(json.load(f))
+    merged = merge_traces(traces)
+    spans = [e for e in merged["traceEvents"] if e["ph"] == "X"]
+    assert {e["pid"] for e in spans} == {0, 1, 2}
+    assert min(e["ts"] for e in spans) == 0.0
@@ -0,0 +1,43 @@
+import pytest
+import torch
+
+from fms.distributed.strategy import UlyssesStrategy
+from fms.models.llama import LLaMA
+from ring_testing import run_ring_workers
+
+
+def _ulysses_worker(rank, world_size, block_lens, head_weights, kvheads):
+    strategy = UlyssesStrategy(block_lens=block_lens, head_weights=head_weights)
+    torch.manual_seed(0)
+    config = dict(src_vocab_size=64, emb_dim=32, nheads=4, kvheads=kvheads, nlayers=2)
+    ref = LLaMA(**config)
+    ref.reset_parameters()
+    model = LLaMA(distributed_strategy=strategy, **config)
+    model.load_state_dict(ref.state_dict())
+
+    input_ids = torch.randint(0, 64, (2, sum(block_lens)))
+    with torch.no_grad():
+        expected = ref(input_ids, is_causal_mask=True)
+        actual = model(input_ids, is_causal_mask=True)
+    torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize(
+    "head_weights,kvheads",
+    [([2.0, 1.0, 1.0], 2), ([1.0, 1.0, 2.0], 4), ([1.0, 0.0, 3.0], 4)],
+)
+def test_ulysses_matches_single_rank(tmp_path, head_weights, kvheads):
+    block_lens = [5, 8, 3]
+    run_ring_workers(_ulysses_worker, 3, tmp_path, block_lens, head_weights, kvheads)
+
+
+def test_head_counts():
+    strategy = UlyssesStrategy(block_lens=[4], head_weights=[1.0])
+    assert strategy.head_counts(8, 2) == ([8], [2], False)
+
+    strategy.world_size, strategy.head_weights = 3, [2.0, 1.0, 1.0]
+    # fewer KV heads than ranks: query heads are split and K/V expanded
+    assert strategy.head_counts(8, 2) == ([4, 2, 2], [4, 2, 2], True)
+    # whole KV groups of 2 query heads each
+    assert strategy.head_counts(8, 4) == ([4, 2, 2], [2, 1, 1], False)
+    assert strategy.head_counts(4, 4) == ([2, 1, 1], [2, 1, 1], False)